@@ -5,7 +5,12 @@ Created on May 4 2020
 
 """
 from os import path as os_path
-from argparse import ArgumentParser
+from os.path import expanduser
+from argparse import (
+    ArgumentParser,
+    ArgumentTypeError,
+)
+from re import match
 
 from retropath2_wrapper._version import __version__
 
@@ -15,10 +20,34 @@ __PACKAGE_FOLDER = os_path.dirname(
 )
 DEFAULTS = {
     'MSC_TIMEOUT': 10,  # minutes
+    # Diameter bounds of the workflow, keeping every rule
+    'DMIN': 0,
+    'DMAX': 1000,
     'RP2_VERSION': 'r20250728',
     'KNIME_FOLDER': __PACKAGE_FOLDER,
+    'KNIME_WORKERS': 1,
+    'JOBS': 1,
+    'CACHE_FOLDER': os_path.join(expanduser('~'), '.cache', 'retropath2_wrapper'),
+    'CACHE_SIZE': 10 * 1024 ** 3,  # bytes
+    'SINK_INDEX_FOLDER': os_path.join(expanduser('~'), '.cache', 'retropath2_wrapper', 'sink_index'),
+    'SINK_INDEX_AGE': 30 * 24 * 3600,  # seconds
+    'STAGING_FOLDER': os_path.join(expanduser('~'), '.cache', 'retropath2_wrapper', 'staging'),
+    'STAGING_SIZE': 10 * 1024 ** 3,  # bytes
+    'STAGING_AGE': 30 * 24 * 3600,  # seconds
+    'STORE_FILE': os_path.join(expanduser('~'), '.cache', 'retropath2_wrapper', 'results.sqlite'),
+    'WORKFLOW_FOLDER': os_path.join(expanduser('~'), '.cache', 'retropath2_wrapper', 'workflows'),
+    'EARLY_STOP_INTERVAL': 2,  # seconds
+    'QUEUE_LEASE': 300,  # seconds
+    'QUEUE_ATTEMPTS': 3,
+    'QUEUE_POLL': 10,  # seconds
+    'SERVER_HOST': '127.0.0.1',
+    'SERVER_PORT': 8080,
+    'SERVER_QUEUE': 100,
+    'SERVER_RETENTION': 1000,  # done jobs kept
     "STD_HYDROGEN": "auto",  # How hydrogens are represented in chemical rules
 }
+# Versions of the RetroPath2.0 workflow shipped in workflows/
+RP2_VERSIONS = ['v9', 'r20210127', 'r20220104', 'r20220224', 'r20250728']
 RETCODES = {
     'OK': 0,
     'NoError': 0,
@@ -30,15 +59,232 @@ RETCODES = {
     'OSError': 2,
     'InChI': 3,
     'SinkFileMalformed': 4,
+    'TimeOut': 5,
 }
 
 
+def jvm_heap_arg(value: str) -> str:
+    """Type of --jvm_heap: a size (e.g. 8g) or 'auto'."""
+    if value and value != 'auto' and not match(r'^\d+[kKmMgG]?$', value):
+        raise ArgumentTypeError(f"{value}: should be a size (e.g. 8g) or 'auto'")
+    return value
+
+
+def knime_threads_arg(value: str) -> str:
+    """Type of --knime_threads: a positive integer or 'auto'."""
+    if value and value != 'auto' and not match(r'^[1-9]\d*$', value):
+        raise ArgumentTypeError(f"{value}: should be a positive integer or 'auto'")
+    return value
+
+
 def build_args_parser():
     parser = ArgumentParser(prog='retropath2_wrapper', description='Python wrapper to parse RP2 to generate rpSBML collection of unique and complete (cofactors) pathways')
     parser = _add_arguments(parser)
     return parser
 
 
+def build_batch_args_parser():
+    parser = ArgumentParser(prog='retropath2_wrapper.batch', description='Run the RetroPath2.0 workflow concurrently on many targets')
+    parser = _add_arguments(parser)
+    parser_batch = parser.add_argument_group("Batch arguments")
+    parser_batch.add_argument(
+        '--jobs',
+        type=int,
+        default=DEFAULTS['JOBS'],
+        help=f'Number of targets processed concurrently (default: {DEFAULTS["JOBS"]}).'
+    )
+    return parser
+
+
+def build_sweep_args_parser():
+    parser = ArgumentParser(prog='retropath2_wrapper.sweep', description='Run the RetroPath2.0 workflow on one target for each point of a parameter grid')
+    parser = _add_arguments(parser)
+    parser_sweep = parser.add_argument_group("Sweep arguments")
+    parser_sweep.add_argument(
+        '--grid',
+        type=str,
+        nargs='+',
+        required=True,
+        metavar='PARAM=V1,V2',
+        help='Values of the swept parameters, among topx, dmin, dmax, max_steps, mwmax_source, min_rule_score, msc_timeout and rp2_version (e.g. --grid topx=50,100 max_steps=3,4). Other parameters keep their value for all points.'
+    )
+    parser_sweep.add_argument(
+        '--jobs',
+        type=int,
+        default=DEFAULTS['JOBS'],
+        help=f'Number of points processed concurrently (default: {DEFAULTS["JOBS"]}).'
+    )
+    return parser
+
+
+def build_queue_args_parser():
+    parser = ArgumentParser(prog='retropath2_wrapper.jobqueue', description='Queue RetroPath2.0 jobs into a shared folder and run them from workers on several nodes')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    parser_submit = subparsers.add_parser('submit', help='Queue one job per target of a source file or folder, options are the ones of batch mode')
+    _add_arguments(parser_submit)
+    parser_queue = parser_submit.add_argument_group("Queue arguments")
+    parser_queue.add_argument(
+        '--lease',
+        type=float,
+        default=DEFAULTS['QUEUE_LEASE'],
+        help=f'Seconds after which the job of a worker which stopped sending heartbeats is taken back, set when the queue is created (default: {DEFAULTS["QUEUE_LEASE"]}).'
+    )
+    parser_queue.add_argument(
+        '--max_attempts',
+        type=int,
+        default=DEFAULTS['QUEUE_ATTEMPTS'],
+        help=f'Number of times a job is taken back before being given up, set when the queue is created (default: {DEFAULTS["QUEUE_ATTEMPTS"]}).'
+    )
+
+    parser_worker = subparsers.add_parser('worker', help='Run queued jobs')
+    parser_worker.add_argument(
+        '--kinstall',
+        type=str,
+        default=DEFAULTS['KNIME_FOLDER'],
+        help='Directory where to find a KNIME executable file',
+    )
+    parser_worker.add_argument(
+        '--jobs',
+        type=int,
+        default=DEFAULTS['JOBS'],
+        help=f'Number of jobs run concurrently by the worker (default: {DEFAULTS["JOBS"]}).'
+    )
+    parser_worker.add_argument(
+        '--poll',
+        type=float,
+        default=DEFAULTS['QUEUE_POLL'],
+        help=f'Seconds between two looks at the queue (default: {DEFAULTS["QUEUE_POLL"]}).'
+    )
+    parser_worker.add_argument(
+        '--exit_when_empty',
+        action='store_true',
+        default=False,
+        help='Stop once no job is pending nor running, instead of waiting for new jobs'
+    )
+
+    parser_status = subparsers.add_parser('status', help='Count jobs by state and return code')
+    parser_requeue = subparsers.add_parser('requeue', help='Take back the jobs of dead workers now')
+
+    for name, par in [
+        ('submit', parser_submit),
+        ('worker', parser_worker),
+        ('status', parser_status),
+        ('requeue', parser_requeue),
+    ]:
+        par.add_argument(
+            '--queue_dir',
+            type=str,
+            required=True,
+            help='Folder of the queue, shared by all nodes'
+        )
+        if name != 'submit':
+            par.add_argument(
+                '--log',
+                metavar='ARG',
+                type=str,
+                choices=[
+                    'debug', 'info', 'warning', 'error', 'critical', 'silent', 'quiet',
+                    'DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL', 'SILENT', 'QUIET'
+                ],
+                default='def_info',
+                help='Adds a console logger for the specified level (default: error)'
+            )
+    return parser
+
+
+def build_pathways_args_parser():
+    parser = ArgumentParser(prog='retropath2_wrapper.pathways', description='Enumerate and rank the pathways from source to sink of a scope or results file')
+    parser.add_argument(
+        'scope_file',
+        type=str,
+        help='Scope or results file written by the workflow (may be gzipped)'
+    )
+    parser.add_argument(
+        '--outfile',
+        type=str,
+        default='pathways.csv',
+        help='File where pathways are written, best first (default: pathways.csv)'
+    )
+    parser.add_argument(
+        '--top',
+        type=int,
+        default=None,
+        help='Number of best pathways to find, pathways which can not be among them are pruned (default: all pathways)'
+    )
+    parser.add_argument(
+        '--max_steps',
+        type=int,
+        default=None,
+        help='Maximal number of transformations from the source to the sink (default: number of iterations of the file)'
+    )
+    parser.add_argument(
+        '--log', '-l',
+        metavar='ARG',
+        type=str,
+        choices=[
+            'debug', 'info', 'warning', 'error', 'critical', 'silent', 'quiet',
+            'DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL', 'SILENT', 'QUIET'
+        ],
+        default='def_info',
+        help='Adds a console logger for the specified level (default: error)'
+    )
+    return parser
+
+
+def build_server_args_parser():
+    parser = ArgumentParser(prog='retropath2_wrapper.server', description='Serve RetroPath2.0 runs through a local HTTP API, sink indexes, caches and KNIME workspaces being kept between jobs')
+    parser = _add_arguments(parser)
+    parser_server = parser.add_argument_group("Server arguments")
+    parser_server.add_argument(
+        '--host',
+        type=str,
+        default=DEFAULTS['SERVER_HOST'],
+        help=f'Address to listen on (default: {DEFAULTS["SERVER_HOST"]}).'
+    )
+    parser_server.add_argument(
+        '--port',
+        type=int,
+        default=DEFAULTS['SERVER_PORT'],
+        help=f'Port to listen on (default: {DEFAULTS["SERVER_PORT"]}).'
+    )
+    parser_server.add_argument(
+        '--jobs',
+        type=int,
+        default=DEFAULTS['JOBS'],
+        help=f'Number of jobs run concurrently (default: {DEFAULTS["JOBS"]}).'
+    )
+    parser_server.add_argument(
+        '--queue_size',
+        type=int,
+        default=DEFAULTS['SERVER_QUEUE'],
+        help=f'Number of jobs waiting to be run, further submissions are refused until some start (default: {DEFAULTS["SERVER_QUEUE"]}).'
+    )
+    parser_server.add_argument(
+        '--retention',
+        type=int,
+        default=DEFAULTS['SERVER_RETENTION'],
+        help=f'Number of done jobs kept, the outputs of the oldest ones being removed beyond (default: {DEFAULTS["SERVER_RETENTION"]}).'
+    )
+    parser_server.add_argument(
+        '--sinks',
+        type=str,
+        nargs='+',
+        default=[],
+        metavar='NAME=PATH',
+        help='Other sink files which jobs can refer to by name, sink_file being named "default".'
+    )
+    parser_server.add_argument(
+        '--rules',
+        type=str,
+        nargs='+',
+        default=[],
+        metavar='NAME=PATH',
+        help='Other rules files which jobs can refer to by name, rules_file being named "default".'
+    )
+    return parser
+
+
 def _add_arguments(parser):
 
     ## Positional arguments
@@ -65,7 +311,7 @@ def _add_arguments(parser):
     parser_in.add_argument(
         '--source_file',
         type=str,
-        help='Path of file containing the InChI (not compliant with --source_name nor --source_inchi)'
+        help='Path of file containing the InChI (not compliant with --source_name nor --source_inchi). In batch mode, path of a file containing several targets or of a folder of such files'
     )
     parser_in.add_argument(
         '--source_name',
@@ -89,21 +335,122 @@ def _add_arguments(parser):
         help='Directory where to find a KNIME executable file',
     )
 
+    parser_knime.add_argument(
+        '--workflow_cache_dir',
+        type=str,
+        default='',
+        help=f'Folder where the workflow is extracted once and cloned for each run, the workflow archive is given to KNIME if not set (e.g. {DEFAULTS["WORKFLOW_FOLDER"]})',
+    )
+
+    parser_knime.add_argument(
+        '--timeout',
+        type=float,
+        default=None,
+        help='Wall-clock time budget of a KNIME run in minutes, KNIME is stopped and partial results are kept when exceeded (default: no limit)',
+    )
+    parser_knime.add_argument(
+        '--cpu_timeout',
+        type=float,
+        default=None,
+        help='CPU time budget of a KNIME run in minutes, all threads included (default: no limit)',
+    )
+    parser_knime.add_argument(
+        '--jvm_heap',
+        type=jvm_heap_arg,
+        default='',
+        help="Maximal heap of the KNIME JVM (e.g. 8g), 'auto' to size it from the numbers of rules and sink compounds and from the memory available to each concurrent job (default: the one of knime.ini)",
+    )
+    parser_knime.add_argument(
+        '--jvm_gc',
+        type=str,
+        default='',
+        choices=['', 'G1', 'Parallel', 'Serial', 'Shenandoah', 'Z'],
+        help='Garbage collector of the KNIME JVM (default: the one of the JVM)',
+    )
+    parser_knime.add_argument(
+        '--jvm_gc_log',
+        action='store_true',
+        default=False,
+        help='Write the garbage collector log of the KNIME JVM into the output folder',
+    )
+    parser_knime.add_argument(
+        '--knime_threads',
+        type=knime_threads_arg,
+        default='',
+        help="Maximal number of threads of KNIME, 'auto' to share the available CPUs between concurrent jobs (default: the one of KNIME)",
+    )
+    parser_knime.add_argument(
+        '--knime_temp_dir',
+        type=str,
+        default='',
+        help='Folder of the temporary files of KNIME (default: the one of KNIME)',
+    )
+    parser_knime.add_argument(
+        '--table_cache',
+        type=str,
+        default='',
+        choices=['', 'LRU', 'SMALL', 'auto'],
+        help="Tables KNIME keeps in memory, recently used ones (LRU) or small ones only (SMALL), 'auto' to choose from the memory available to each concurrent job (default: the one of KNIME)",
+    )
+    parser_knime.add_argument(
+        '--cells_in_memory',
+        type=int,
+        default=0,
+        help='Tables with less cells are kept in memory by KNIME (default: the one of KNIME)',
+    )
+
     # RetroPath2.0 workflow options
     parser_rp = parser.add_argument_group("Retropath2.0 workflow")
     parser_rp.add_argument(
         '--rp2_version',
         type=str,
         default=DEFAULTS['RP2_VERSION'],
-        choices=['v9', 'r20210127', 'r20220104', "r20220224", "r20250728"],
+        choices=RP2_VERSIONS,
         help=f'version of RetroPath2.0 workflow (default: {DEFAULTS["RP2_VERSION"]}).'
     )
 
     parser_rp.add_argument('--max_steps'    , type=int, default=3)
     parser_rp.add_argument('--topx'         , type=int, default=100)
-    parser_rp.add_argument('--dmin'         , type=int, default=0)
-    parser_rp.add_argument('--dmax'         , type=int, default=1000)
+    parser_rp.add_argument('--dmin'         , type=int, default=DEFAULTS['DMIN'])
+    parser_rp.add_argument('--dmax'         , type=int, default=DEFAULTS['DMAX'])
     parser_rp.add_argument('--mwmax_source' , type=int, default=1000)
+    parser_rp.add_argument(
+        '--min_rule_score',
+        type=float,
+        default=None,
+        help='Discard rules with a score lower than this threshold before running the workflow.'
+    )
+    parser_rp.add_argument(
+        '--stop_solutions',
+        type=int,
+        default=None,
+        help='Stop KNIME once this number of solutions (transformations whose products are all in the sink) is written into the results, the results written so far being kept (default: no early stop).'
+    )
+    parser_rp.add_argument(
+        '--stop_iterations',
+        type=int,
+        default=None,
+        help='Stop KNIME once this number of iterations is done, the results written so far being kept (default: no early stop).'
+    )
+    parser_rp.add_argument(
+        '--resume_dir',
+        type=str,
+        default=None,
+        help='Output folder of a previous run with the same inputs and a lower --max_steps, only the iterations left are computed from its last iteration and its results are merged (in batch mode, output folder of a previous batch).'
+    )
+    parser_rp.add_argument(
+        '--columnar',
+        action='store_true',
+        default=False,
+        help='Also write the results and scopes as compressed columnar tables (<name>.columns.zip), read with retropath2_wrapper.columnar.ColumnarTable.'
+    )
+    parser_rp.add_argument(
+        '--no_prefilter_rules',
+        dest='prefilter_rules',
+        action='store_false',
+        default=True,
+        help='Give the whole rules file to KNIME instead of the rules within [dmin, dmax] only.'
+    )
     parser_rp.add_argument(
         '--msc_timeout',
         type=int,
@@ -117,6 +464,52 @@ def _add_arguments(parser):
         help="How hydrogens are represented in chemical rules, auto mode will try to guess from the chemical rules",
     )
 
+    # Cache options
+    parser_cache = parser.add_argument_group("Cache arguments")
+    parser_cache.add_argument(
+        '--cache_dir',
+        type=str,
+        default=None,
+        help=f'Folder of the result cache, results are not cached if not set (e.g. {DEFAULTS["CACHE_FOLDER"]})'
+    )
+    parser_cache.add_argument(
+        '--cache_size',
+        type=int,
+        default=DEFAULTS['CACHE_SIZE'] // 1024 ** 2,
+        help=f'Maximal size of the result cache in MB (default: {DEFAULTS["CACHE_SIZE"] // 1024 ** 2}).'
+    )
+
+    parser_cache.add_argument(
+        '--staging_dir',
+        type=str,
+        default=None,
+        help=f'Folder of prepared rules shared across runs, rules are prepared for each run if not set (e.g. {DEFAULTS["STAGING_FOLDER"]})'
+    )
+    parser_cache.add_argument(
+        '--staging_size',
+        type=int,
+        default=DEFAULTS['STAGING_SIZE'] // 1024 ** 2,
+        help=f'Maximal size of prepared rules in MB (default: {DEFAULTS["STAGING_SIZE"] // 1024 ** 2}).'
+    )
+    parser_cache.add_argument(
+        '--staging_max_age',
+        type=int,
+        default=DEFAULTS['STAGING_AGE'] // (24 * 3600),
+        help=f'Prepared rules not used for this number of days are removed (default: {DEFAULTS["STAGING_AGE"] // (24 * 3600)}).'
+    )
+    parser_cache.add_argument(
+        '--store',
+        type=str,
+        default=None,
+        help=f'SQLite database the results are loaded into, see python -m retropath2_wrapper.store (e.g. {DEFAULTS["STORE_FILE"]})'
+    )
+    parser_cache.add_argument(
+        '--sink_index_dir',
+        type=str,
+        default=None,
+        help=f'Folder of persistent sink indexes used to check if the source is in the sink; if not set, the sink is scanned by single runs and indexed into a temporary folder by batch, sweep, queue and server runs (e.g. {DEFAULTS["SINK_INDEX_FOLDER"]})'
+    )
+
     # Program options
     parser_sp = parser.add_argument_group("Logging")
     parser_sp.add_argument(
@@ -130,6 +523,12 @@ def _add_arguments(parser):
         default='def_info',
         help='Adds a console logger for the specified level (default: error)'
     )
+    parser_sp.add_argument(
+        '--progress',
+        action='store_true',
+        default=False,
+        help='Follow the progress of KNIME (iterations, executed nodes) from its console output'
+    )
     parser_sp.add_argument(
         '--silent',
         action='store_true',
@@ -6,19 +6,28 @@ Created on January 16 2020
 @description: Python wrapper to run RetroPath2.0 KNIME workflow
 
 """
+import asyncio
 import gzip
 import tarfile
 import zipfile
+from contextlib import contextmanager
+from io import TextIOWrapper
 from os import (
+    link as os_link,
     mkdir as os_mkdir,
     path  as os_path,
-    rename
+    remove as os_remove,
+    symlink as os_symlink,
 )
-from shutil import copyfile
-from brs_utils import extract_gz
+from shutil import (
+    copyfile,
+    copyfileobj,
+    copytree,
+)
+from glob import glob
 from filetype import guess
 from tempfile import TemporaryDirectory
-from typing import Dict, Tuple
+from typing import Any, BinaryIO, Callable, Dict, Generator, Iterator, Tuple
 from types import SimpleNamespace
 from logging import (
     Logger,
@@ -26,6 +35,7 @@ from logging import (
 )
 from re import match
 from csv import reader as csv_reader
+from csv import writer as csv_writer
 from colored import attr
 from csv import reader
 
@@ -38,6 +48,24 @@ from retropath2_wrapper.knime import (
     install_online as knime_install_online
 )
 from retropath2_wrapper.preference import Preference
+from retropath2_wrapper.cache import ResultCache
+from retropath2_wrapper.columnar import (
+    export_outputs,
+    list_columnar,
+)
+from retropath2_wrapper.deepen import (
+    last_iteration,
+    merge_results,
+    read_frontier,
+)
+from retropath2_wrapper.early_stop import EarlyStop
+from retropath2_wrapper.outputs import write_sources
+from retropath2_wrapper.pathways import write_scope
+from retropath2_wrapper.progress import ProgressEvent
+from retropath2_wrapper.report import RunReport
+from retropath2_wrapper.sink_index import SinkIndex
+from retropath2_wrapper.store import ResultStore
+from retropath2_wrapper.staging import StagingCache
 
 
 here = os_path.dirname(os_path.realpath(__file__))
@@ -57,8 +85,148 @@ def retropath2(
     dmax: int = 1000,
     mwmax_source: int = 1000,
     msc_timeout: int = DEFAULTS['MSC_TIMEOUT'],
+    cache: ResultCache | None = None,
+    store: ResultStore | None = None,
+    prefilter_rules: bool = True,
+    min_rule_score: float | None = None,
+    sink_index: SinkIndex | None = None,
+    staging: StagingCache | None = None,
+    timeout: float | None = None,
+    cpu_timeout: float | None = None,
+    progress: Callable[[ProgressEvent], None] | None = None,
+    stop_solutions: int | None = None,
+    stop_iterations: int | None = None,
+    resume_dir: str | None = None,
+    columnar: bool = False,
+    cancel: Callable[[], bool] | None = None,
     logger: Logger = getLogger(__name__)
 ) -> Tuple[str, Dict]:
+    """
+    Run the RetroPath2.0 workflow.
+
+    cancel, if given, is polled while KNIME runs: once it returns True,
+    KNIME is stopped and the run returns OSError at once, without
+    touching the output folder any further (e.g. a job taken back from
+    its worker, see jobqueue.py).
+
+    Returns
+    -------
+    Tuple[int, Dict] Return code and paths of the files of the run.
+
+    """
+    steps = _retropath2_steps(
+        sink_file=sink_file,
+        source_file=source_file,
+        rules_file=rules_file,
+        outdir=outdir,
+        std_hydrogen=std_hydrogen,
+        knime=knime,
+        rp2_version=rp2_version,
+        max_steps=max_steps,
+        topx=topx,
+        dmin=dmin,
+        dmax=dmax,
+        mwmax_source=mwmax_source,
+        msc_timeout=msc_timeout,
+        cache=cache,
+        store=store,
+        prefilter_rules=prefilter_rules,
+        min_rule_score=min_rule_score,
+        sink_index=sink_index,
+        staging=staging,
+        timeout=timeout,
+        cpu_timeout=cpu_timeout,
+        progress=progress,
+        stop_solutions=stop_solutions,
+        stop_iterations=stop_iterations,
+        resume_dir=resume_dir,
+        columnar=columnar,
+        cancel=cancel,
+        logger=logger,
+    )
+    knime_r_code = None
+    try:
+        while True:
+            done, value = _next_step(steps, knime_r_code)
+            if done:
+                return value
+            knime, kwargs = value
+            knime_r_code = knime.call(**kwargs)
+    finally:
+        steps.close()
+
+
+async def retropath2_async(*args, **kwargs) -> Tuple[int, Dict]:
+    """
+    Asyncio counterpart of retropath2(), with the same arguments.
+
+    KNIME is launched through asyncio.create_subprocess_exec, and the other
+    steps (input checks, preparation of the files, checks of the results)
+    run in the default executor, so that the event loop is never blocked
+    and many runs can be awaited concurrently.
+
+    Returns
+    -------
+    Tuple[int, Dict] Return code and paths of the files of the run.
+
+    """
+    steps = _retropath2_steps(*args, **kwargs)
+    knime_r_code = None
+    try:
+        while True:
+            done, value = await asyncio.to_thread(_next_step, steps, knime_r_code)
+            if done:
+                return value
+            knime, kwargs = value
+            knime_r_code = await knime.acall(**kwargs)
+    finally:
+        steps.close()
+
+
+def _next_step(steps: Generator, value: int | None) -> Tuple[bool, Any]:
+    # StopIteration can not go through a Future, translated to a flag
+    try:
+        return False, steps.send(value)
+    except StopIteration as e:
+        return True, e.value
+
+
+def _retropath2_steps(
+    sink_file: str,
+    source_file: str,
+    rules_file: str,
+    outdir: str,
+    std_hydrogen: str,
+    knime: Knime | None,
+    rp2_version: str | None = DEFAULTS['RP2_VERSION'],
+    max_steps: int = 3,
+    topx: int = 100,
+    dmin: int = 0,
+    dmax: int = 1000,
+    mwmax_source: int = 1000,
+    msc_timeout: int = DEFAULTS['MSC_TIMEOUT'],
+    cache: ResultCache | None = None,
+    store: ResultStore | None = None,
+    prefilter_rules: bool = True,
+    min_rule_score: float | None = None,
+    sink_index: SinkIndex | None = None,
+    staging: StagingCache | None = None,
+    timeout: float | None = None,
+    cpu_timeout: float | None = None,
+    progress: Callable[[ProgressEvent], None] | None = None,
+    stop_solutions: int | None = None,
+    stop_iterations: int | None = None,
+    resume_dir: str | None = None,
+    columnar: bool = False,
+    cancel: Callable[[], bool] | None = None,
+    logger: Logger = getLogger(__name__)
+) -> Generator[Tuple[Knime, Dict], int, Tuple[int, Dict]]:
+    """
+    Steps of a run, as a generator which yields the Knime object and the
+    arguments of the KNIME call, receives its return code and returns the
+    one of the run. The call is left to the caller, see retropath2() and
+    retropath2_async().
+    """
 
     logger.debug(f'sink_file: {sink_file}')
     logger.debug(f'source_file: {source_file}')
@@ -72,26 +240,22 @@ def retropath2(
     logger.debug(f'dmax: {dmax}')
     logger.debug(f'mwmax_source: {mwmax_source}')
     logger.debug(f'msc_timeout: {msc_timeout}')
+    logger.debug(f'cache: {cache}')
+    logger.debug(f'store: {store}')
+    logger.debug(f'prefilter_rules: {prefilter_rules}')
+    logger.debug(f'min_rule_score: {min_rule_score}')
+    logger.debug(f'sink_index: {sink_index}')
+    logger.debug(f'staging: {staging}')
+    logger.debug(f'timeout: {timeout}')
+    logger.debug(f'cpu_timeout: {cpu_timeout}')
+    logger.debug(f'progress: {progress}')
+    logger.debug(f'stop_solutions: {stop_solutions}')
+    logger.debug(f'stop_iterations: {stop_iterations}')
+    logger.debug(f'resume_dir: {resume_dir}')
+    logger.debug(f'columnar: {columnar}')
+    logger.debug(f'cancel: {cancel}')
 
-    # Create Knime object
-    if knime is None:
-        knime = Knime()
-    if rp2_version is not None:
-        knime.workflow = os_path.join(
-            here, 'workflows', f'RetroPath2.0_{rp2_version}.knwf'
-        )
-    if knime.kexec == "":
-        # Install KNIME
-        args_knime = SimpleNamespace(
-            kinstall=knime.kinstall,
-            kver=Knime.DEFAULT_VERSION,
-        )
-        knime_install_online(args_knime, logger=logger)
-        # Init Knime again to set Knime.kexec
-        knime = Knime(
-            kinstall=knime.kinstall,
-            workflow=knime.workflow,
-        )
+    knime = init_knime(knime=knime, rp2_version=rp2_version, logger=logger)
     logger.debug('knime: ' + str(knime))
 
     # Store RetroPath2 params into a dictionary
@@ -105,50 +269,487 @@ def retropath2(
     }
     logger.debug('rp2_params: ' + str(rp2_params))
 
-    r_code, inchi = check_input(source_file, sink_file)
+    report = RunReport()
+    # Sink not scanned for the report, rows known from its index only
+    report.add_input('sink', sink_file)
+    if sink_index is not None:
+        report.inputs['sink']['rows'] = len(sink_index)
+    report.add_input('source', source_file)
+    report.add_input('rules', rules_file)
+    report.params = dict(
+        rp2_params,
+        msc_timeout=msc_timeout,
+        min_rule_score=min_rule_score,
+        workflow=os_path.basename(knime.workflow),
+    )
+
+    with report.phase('check_input'):
+        r_code, inchi = check_input(source_file, sink_file, sink_index=sink_index)
     if r_code != RETCODES['OK']:
         return r_code, None
+    source_name = read_source_name(source_file)
 
     logger.info('{attr1}Initializing{attr2}'.format(attr1=attr('bold'), attr2=attr('reset')))
 
+    # Deepen a previous run, only the iterations left are computed
+    if resume_dir is not None:
+        prior_results = os_path.join(resume_dir, 'results.csv')
+        try:
+            offset = last_iteration(prior_results) + 1
+            frontier = read_frontier(prior_results)
+        except FileNotFoundError as e:
+            logger.error(e)
+            return RETCODES['FileNotFound'], None
+        logger.info(f'   |- Resuming {resume_dir}: {offset} iterations done, {len(frontier)} compounds to expand')
+        report.add_input('resume', prior_results, rows=True)
+        if offset >= max_steps or not frontier:
+            files = resume_outputs(resume_dir, outdir, logger)
+            if columnar:
+                with report.phase('columnar'):
+                    export_outputs(files['outdir'], list_outputs(files), logger)
+            if store is not None:
+                with report.phase('store'):
+                    store.ingest(files['outdir'], report.params, checked_code(RETCODES['OK'], files), logger=logger)
+            write_report(report, files, RETCODES['OK'], logger)
+            return RETCODES['OK'], files
+        rp2_params['max_steps'] = max_steps - offset
+        # Sources differ from the ones of the key
+        cache = None
+
+    # Results of an identical run
+    if cache is not None:
+        with report.phase('cache_lookup'):
+            cache_key = ResultCache.key(
+                files={
+                    'sink': sink_file,
+                    'source': source_file,
+                    'rules': rules_file,
+                    'workflow': knime.workflow,
+                },
+                params=dict(rp2_params, msc_timeout=msc_timeout, min_rule_score=min_rule_score, prefilter_rules=prefilter_rules),
+            )
+            r_code = cache.get(cache_key, outdir, logger)
+        if r_code is not None:
+            files = {
+                'sink'      : os_path.abspath(sink_file),
+                'source'    : os_path.abspath(source_file),
+                'rules'     : os_path.abspath(rules_file),
+                'results'   : 'results'+'.csv',
+                'src-in-sk' : 'source-in-sink'+'.csv',
+                'outdir'    : os_path.abspath(outdir)
+            }
+            if columnar:
+                with report.phase('columnar'):
+                    export_outputs(files['outdir'], list_outputs(files), logger)
+            if store is not None:
+                with report.phase('store'):
+                    store.ingest(files['outdir'], report.params, checked_code(r_code, files), logger=logger)
+            write_report(report, files, r_code, logger)
+            return r_code, files
+
     # Preferences
     preference = Preference(rdkit_timeout_minutes=msc_timeout)
     with TemporaryDirectory() as tempd:
 
-        # Format files for KNIME
-        files = format_files_for_knime(
-            sink_file, source_file, rules_file,
-            tempd, outdir,
-            logger
-        )
+        if resume_dir is not None:
+            source_file = write_sources(frontier, os_path.join(tempd, 'frontier.csv'))
+            # Kept aside, KNIME may write into the same folder
+            prior_dir = os_path.join(tempd, 'prior')
+            os_mkdir(prior_dir)
+            for name in ['results.csv', 'source-in-sink.csv']:
+                if os_path.exists(os_path.join(resume_dir, name)):
+                    copyfile(os_path.join(resume_dir, name), os_path.join(prior_dir, name))
+
+        # Format files for KNIME, bounds keeping every rule are not
+        # applied so that the rules file is given as it is
+        with report.phase('format_files'):
+            files = format_files_for_knime(
+                sink_file, source_file, rules_file,
+                tempd, outdir,
+                logger,
+                dmin=dmin if prefilter_rules and dmin > DEFAULTS['DMIN'] else None,
+                dmax=dmax if prefilter_rules and dmax < DEFAULTS['DMAX'] else None,
+                min_score=min_rule_score,
+                staging=staging,
+            )
         logger.debug(files)
+        # Not scanned for the report either
+        report.add_input('rules_prepared', files['rules'])
 
         # Create outdir if does not exist
         if not os_path.exists(outdir):
             os_mkdir(outdir)
+        # Columnar copies would describe the outputs of a previous run
+        for name in list_columnar(outdir):
+            os_remove(os_path.join(outdir, name))
+
+        # Stop KNIME once enough solutions or iterations
+        early_stop = None
+        if stop_solutions is not None or stop_iterations is not None:
+            early_stop = EarlyStop(
+                results=os_path.join(files['outdir'], files['results']),
+                solutions=stop_solutions,
+                iterations=stop_iterations,
+                logger=logger,
+            )
+            if stop_iterations is not None:
+                progress = early_stop.watch(progress)
+        stop = early_stop
+        if cancel is not None:
+            stop = lambda: cancel() or (early_stop is not None and early_stop())
 
         # Call KNIME
-        r_code = knime.call(
-            files=files,
-            params=rp2_params,
-            preference=preference,
-            logger=logger,
-        )
-        if r_code == RETCODES['OSError']:
+        with report.phase('knime'):
+            r_code = yield knime, dict(
+                files=files,
+                params=rp2_params,
+                preference=preference,
+                logger=logger,
+                timeout=timeout,
+                cpu_timeout=cpu_timeout,
+                usage=report.knime,
+                progress=progress,
+                stop=stop,
+            )
+        if cancel is not None and cancel():
+            logger.warning('   |- Run cancelled')
+            return RETCODES['OSError'], files
+        # Partial outputs of a timed out run are left in outdir, not cached
+        if r_code in [RETCODES['OSError'], RETCODES['TimeOut']]:
+            write_report(report, files, r_code, logger)
             return r_code, files
+        knime_r_code = r_code
+        if report.knime.get('stopped'):
+            report.knime['early_stop'] = early_stop.reason
+            early_stop.keep_outputs(os_path.join(files['outdir'], files['src-in-sk']))
+            # Scope is computed by KNIME after its last iteration only
+            with report.phase('scope'):
+                write_source_scope(files, source_name, logger)
 
-    r_code = check_src_in_sink_2(
-        src_in_sink_file = os_path.join(files['outdir'], files['src-in-sk']),
-        logger = logger
-    )
+        if resume_dir is not None:
+            with report.phase('merge_results'):
+                merge_outputs(prior_dir, offset, files, source_name, logger)
+
+    with report.phase('check_src_in_sink'):
+        r_code = check_src_in_sink_2(
+            src_in_sink_file = os_path.join(files['outdir'], files['src-in-sk']),
+            logger = logger
+        )
 
+    # Columnar copies of the tables, stored in the cache with them
+    if columnar and r_code != RETCODES['FileNotFound']:
+        with report.phase('columnar'):
+            export_outputs(files['outdir'], list_outputs(files), logger)
+
+    # Results loaded into the store of all runs
+    if store is not None and r_code != RETCODES['FileNotFound']:
+        with report.phase('store'):
+            store.ingest(files['outdir'], report.params, checked_code(r_code, files), logger=logger)
+
+    # Results of a stopped run depend on the time taken, not cached
+    if (
+        cache is not None
+        and knime_r_code == 0
+        and r_code != RETCODES['FileNotFound']
+        and not report.knime.get('stopped')
+    ):
+        with report.phase('cache_store'):
+            cache.put(
+                key=cache_key,
+                outdir=files['outdir'],
+                outputs=list_outputs(files),
+                r_code=r_code,
+                logger=logger,
+            )
+
+    write_report(report, files, r_code, logger)
     return r_code, files
 
 
+def write_report(
+    report: RunReport,
+    files: Dict,
+    r_code: int,
+    logger: Logger = getLogger(__name__)
+) -> None:
+    """
+    Describe the outputs of the run and write the report into the output folder.
+
+    Parameters
+    ----------
+    report : RunReport
+        Measurements of the run.
+    files : Dict
+        Filenames, as returned by format_files_for_knime().
+    r_code : int
+        Return code of the run, recorded once checked (see checked_code()).
+    logger : Logger
+        The logger object.
+
+    """
+    report.add_outputs(files['outdir'], list_outputs(files))
+    try:
+        path = report.write(files['outdir'], checked_code(r_code, files))
+        logger.debug(f'Run report: {path}')
+    except OSError as e:
+        logger.warning(f'Run report not written: {e}')
+
+
+def resume_outputs(
+    resume_dir: str,
+    outdir: str,
+    logger: Logger = getLogger(__name__)
+) -> Dict:
+    """
+    Copy the outputs of a previous run left as they are, no iteration
+    being left to compute.
+
+    Parameters
+    ----------
+    resume_dir : str
+        Output folder of the previous run.
+    outdir : str
+        Output folder of the run.
+    logger : Logger
+        The logger object.
+
+    Returns
+    -------
+    Dict Filenames, as returned by format_files_for_knime().
+
+    """
+    logger.info('   |- Nothing left to compute, outputs of the previous run copied')
+    files = {
+        'results'   : 'results'+'.csv',
+        'src-in-sk' : 'source-in-sink'+'.csv',
+        'outdir'    : os_path.abspath(resume_dir)
+    }
+    if not os_path.exists(outdir):
+        os_mkdir(outdir)
+    if os_path.samefile(resume_dir, outdir):
+        files['outdir'] = os_path.abspath(outdir)
+        return files
+    for name in list_outputs(files):
+        src = os_path.join(resume_dir, name)
+        if os_path.isdir(src):
+            copytree(src, os_path.join(outdir, name), dirs_exist_ok=True)
+        elif os_path.isfile(src):
+            copyfile(src, os_path.join(outdir, name))
+    files['outdir'] = os_path.abspath(outdir)
+    return files
+
+
+def merge_outputs(
+    prior_dir: str,
+    offset: int,
+    files: Dict,
+    name: str,
+    logger: Logger = getLogger(__name__)
+) -> None:
+    """
+    Merge the outputs of a deepening run with the ones of the previous run.
+
+    Results are appended to the previous ones and the source-in-sink file
+    of the previous run is kept. Scopes found from the frontier compounds,
+    not from the source, are replaced by the scope of the source written
+    from the merged results.
+
+    Parameters
+    ----------
+    prior_dir : str
+        Folder holding the results and source-in-sink files of the
+        previous run.
+    offset : int
+        Number of iterations of the previous run.
+    files : Dict
+        Filenames, as returned by format_files_for_knime().
+    name : str
+        Name of the source of the previous run.
+    logger : Logger
+        The logger object.
+
+    """
+    results = os_path.join(files['outdir'], files['results'])
+    if os_path.exists(results):
+        rows = merge_results(os_path.join(prior_dir, files['results']), results, offset)
+        logger.info(f'   |- {rows} rows of results after merging the previous run')
+    src_in_sink = os_path.join(prior_dir, files['src-in-sk'])
+    if os_path.exists(src_in_sink):
+        copyfile(src_in_sink, os_path.join(files['outdir'], files['src-in-sk']))
+    for pattern in ['*_scope.csv', '*_scope.json']:
+        for scope in glob(os_path.join(files['outdir'], pattern)):
+            logger.debug(f'Scope of the frontier removed: {scope}')
+            os_remove(scope)
+    write_source_scope(files, name, logger)
+
+
+def write_source_scope(
+    files: Dict,
+    name: str,
+    logger: Logger = getLogger(__name__)
+) -> None:
+    """
+    Write the scope of the source from the results, for runs whose scope
+    has not been computed by the workflow.
+
+    Parameters
+    ----------
+    files : Dict
+        Filenames, as returned by format_files_for_knime().
+    name : str
+        Name of the source, the scope is written into <name>_scope.csv.
+    logger : Logger
+        The logger object.
+
+    """
+    results = os_path.join(files['outdir'], files['results'])
+    if not os_path.exists(results):
+        return
+    # Name of a source, not a path
+    name = os_path.basename(name)
+    path = os_path.join(files['outdir'], f'{name}_scope.csv')
+    n = write_scope(results, path)
+    logger.info(f'   |- Scope of {name} written from the results: {n} transformations')
+
+
+def list_outputs(files: Dict) -> list:
+    """
+    List outputs written by the workflow into the output folder.
+
+    Parameters
+    ----------
+    files : Dict
+        Filenames, as returned by format_files_for_knime().
+
+    Returns
+    -------
+    list Names of files and folders relative to the output folder.
+
+    """
+    outputs = [files['results'], files['src-in-sk']]
+    for pattern in ['*_scope.csv', '*_scope.json']:
+        outputs += sorted(
+            os_path.basename(x) for x in glob(os_path.join(files['outdir'], pattern))
+        )
+    outputs += list_columnar(files['outdir'])
+    if os_path.isdir(os_path.join(files['outdir'], 'svg')):
+        outputs.append('svg')
+    return outputs
+
+
+def init_knime(
+    knime: Knime | None,
+    rp2_version: str | None = DEFAULTS['RP2_VERSION'],
+    logger: Logger = getLogger(__name__)
+) -> Knime:
+    """
+    Set up the Knime object used to run the workflow, install KNIME if needed.
+
+    Parameters
+    ----------
+    knime : Knime | None
+        The Knime object, a default one is created if None.
+    rp2_version : str | None
+        Version of the RetroPath2.0 workflow, keep the one of knime if None.
+    logger : Logger
+        The logger object.
+
+    Returns
+    -------
+    Knime The Knime object.
+
+    """
+    # Create Knime object
+    if knime is None:
+        knime = Knime()
+    if rp2_version is not None:
+        knime.workflow = os_path.join(
+            here, 'workflows', f'RetroPath2.0_{rp2_version}.knwf'
+        )
+    if knime.kexec == "":
+        # Install KNIME
+        args_knime = SimpleNamespace(
+            kinstall=knime.kinstall,
+            kver=Knime.DEFAULT_VERSION,
+        )
+        knime_install_online(args_knime, logger=logger)
+        # Look for the executable again to set Knime.kexec,
+        # keeping the object given by the caller (e.g. a KnimePool)
+        knime.kexec = Knime.find_executable(path=knime.kinstall)
+
+    return knime
+
+
+def check_results(
+    result_files: Dict,
+    logger: Logger = getLogger(__name__)
+) -> int:
+    # Check if any result has been found
+    r_code = check_scope(result_files['outdir'], logger)
+    return r_code
+
+
+def checked_code(r_code: int, result_files: Dict) -> int:
+    """
+    Return code of a run once its results are checked, as check_results()
+    gives it to the callers, without logging. Recorded into the report
+    and the store of results.
+
+    Parameters
+    ----------
+    r_code : int
+        Return code of retropath2().
+    result_files : Dict
+        Filenames, as returned by retropath2().
+
+    Returns
+    -------
+    int Return code.
+
+    """
+    if r_code != RETCODES['OK']:
+        return r_code
+    if not glob(os_path.join(result_files['outdir'], '*_scope.csv')):
+        return RETCODES['NoSolution']
+    return r_code
+
+
+def check_scope(
+    outdir: str,
+    logger: Logger = getLogger(__name__)
+) -> int:
+    """
+    Check if result is present in outdir.
+
+    Parameters
+    ----------
+    outdir : str
+        The folder where results heve been written.
+    logger : Logger
+        The logger object.
+
+    Returns
+    -------
+    int Return code.
+
+    """
+    csv_scopes = sorted(
+        glob(os_path.join(outdir, '*_scope.csv')),
+        key=lambda scope: os_path.getmtime(scope)
+        )
+
+    if csv_scopes == []:
+        logger.warning('       Warning: No solution has been found')
+        return RETCODES['NoSolution']
+
+    return RETCODES['OK']
+
+
 def check_input(
     source_file: str,
     sink_file: str,
-    logger: Logger = getLogger(__name__)
+    logger: Logger = getLogger(__name__),
+    sink_index: SinkIndex | None = None
 ) -> Tuple[str, str]:
 
     logger.info('{attr1}Checking input data{attr2}'.format(attr1=attr('bold'), attr2=attr('reset')))
@@ -159,7 +760,7 @@ def check_input(
         return RETCODES['InChI'], None
 
     # Check if source is in sink
-    r_code = check_src_in_sink_1(inchi, sink_file, logger)
+    r_code = check_src_in_sink_1(inchi, sink_file, logger, sink_index)
     if r_code == RETCODES['SrcInSink']:
         return RETCODES['SrcInSink'], None
     elif r_code == RETCODES['FileNotFound']:
@@ -173,7 +774,8 @@ def check_input(
 def check_src_in_sink_1(
     source_inchi: str,
     sink_file: str,
-    logger: Logger = getLogger(__name__)
+    logger: Logger = getLogger(__name__),
+    sink_index: SinkIndex | None = None
 ) -> int:
     """
     Check if source is present in sink file. InChIs have to be strictly equal.
@@ -186,6 +788,8 @@ def check_src_in_sink_1(
         Path to file containing the sink.
     logger : Logger
         The logger object.
+    sink_index : SinkIndex | None
+        Index of the sink file, the sink file is scanned if None.
 
     Returns
     -------
@@ -195,6 +799,13 @@ def check_src_in_sink_1(
 
     logger.info('   |- Source in Sink (simple)')
 
+    if sink_index is not None:
+        sink_id = sink_index.lookup(source_inchi)
+        if sink_id is not None:
+            logger.error(f'        source has been found in sink ({sink_id})')
+            return RETCODES['SrcInSink']
+        return RETCODES['OK']
+
     try:
         with open(sink_file, 'r') as f:
             for row in csv_reader(f, delimiter=',', quotechar='"'):
@@ -228,34 +839,7 @@ def check_inchi_from_file(
                 logger.error(header)
                 return False
             compound_id, inchi = next(f_reader)[:2]  # Sniff first inchi
-            inchi = inchi.strip()  # Remove trailing spaces
-            # Match
-            #
-            #   InChI=
-            #   -----
-            #       matches 'InChI='
-            #
-            #   1(S)?
-            #   -----
-            #       matches:
-            #           1    --> version number, currently 1
-            #           (S)? --> standard or not
-            #
-            #   /(([a-z|[A-Z])\d+)+
-            #   ------------------
-            #       Main layer/Chemical formula, only mandatory sublayer
-            #       matches:
-            #           /                  --> layer separator
-            #           (([a-z|[A-Z])\d+)+ --> a letter followed by at least one number, at least one time
-            #
-            #   (/.+)?
-            #   ------
-            #       Other (sub-)layers
-            #       matches:
-            #           (/.+)? --> if '/' is present, then at least one character/symbol is mandatory
-            if match(r'InChI=1(S)?/(([a-z|[A-Z])+\d*)+(/.+)?$', inchi) is None:
-                logger.error('        {inchi} is not a valid InChI notation'.format(inchi=inchi))
-                return RETCODES['InChI']
+            inchi = check_inchi(inchi, logger)
 
     except FileNotFoundError as e:
         logger.error(e)
@@ -264,6 +848,65 @@ def check_inchi_from_file(
     return inchi
 
 
+def read_source_name(file: str) -> str:
+    """Name of the first compound of a source file."""
+    with open(file, 'r') as f:
+        f_reader = reader(f)
+        next(f_reader)
+        return next(f_reader)[0]
+
+
+def check_inchi(
+    inchi: str,
+    logger: Logger = getLogger(__name__)
+) -> str:
+    """
+    Check if an InChI is well-formed.
+
+    Parameters
+    ----------
+    inchi : str
+        The InChI to check.
+    logger : Logger
+        The logger object.
+
+    Returns
+    -------
+    str The stripped InChI, or a return code if malformed.
+
+    """
+    inchi = inchi.strip()  # Remove trailing spaces
+    # Match
+    #
+    #   InChI=
+    #   -----
+    #       matches 'InChI='
+    #
+    #   1(S)?
+    #   -----
+    #       matches:
+    #           1    --> version number, currently 1
+    #           (S)? --> standard or not
+    #
+    #   /(([a-z|[A-Z])\d+)+
+    #   ------------------
+    #       Main layer/Chemical formula, only mandatory sublayer
+    #       matches:
+    #           /                  --> layer separator
+    #           (([a-z|[A-Z])\d+)+ --> a letter followed by at least one number, at least one time
+    #
+    #   (/.+)?
+    #   ------
+    #       Other (sub-)layers
+    #       matches:
+    #           (/.+)? --> if '/' is present, then at least one character/symbol is mandatory
+    if match(r'InChI=1(S)?/(([a-z|[A-Z])+\d*)+(/.+)?$', inchi) is None:
+        logger.error('        {inchi} is not a valid InChI notation'.format(inchi=inchi))
+        return RETCODES['InChI']
+
+    return inchi
+
+
 def check_src_in_sink_2(
     src_in_sink_file: str,
     logger: Logger = getLogger(__name__)
@@ -302,6 +945,108 @@ def check_src_in_sink_2(
     return RETCODES['OK']
 
 
+def archive_kind(path: str) -> str | None:
+    """
+    Guess the kind of archive of a file from its content.
+
+    Parameters
+    ----------
+    path : str
+        Path of the file.
+
+    Returns
+    -------
+    str | None One of 'zip', 'tar' (compressed or not), 'gzip', None if not an archive.
+
+    """
+    if zipfile.is_zipfile(path):
+        return 'zip'
+    if tarfile.is_tarfile(path):
+        return 'tar'
+    kind = guess(path)
+    if kind and kind.mime == 'application/gzip':
+        return 'gzip'
+    return None
+
+
+@contextmanager
+def open_archive(path: str) -> Iterator[BinaryIO]:
+    """
+    Open the first data file of an archive (zip, tar, gzip), or the file
+    itself if it is not an archive, as a binary stream.
+
+    Parameters
+    ----------
+    path : str
+        Path of the file.
+
+    """
+    kind = archive_kind(path)
+    if kind == 'zip':
+        with zipfile.ZipFile(path, 'r') as zf:
+            names = [
+                name for name in zf.namelist()
+                if not name.startswith('_') and not name.endswith('/')
+            ]
+            if names == []:
+                raise ValueError(f'No file found in archive: {path}')
+            with zf.open(names[0]) as f:
+                yield f
+    elif kind == 'tar':
+        with tarfile.open(path, 'r:*') as tar:
+            # Pick the first regular file inside
+            member = next((x for x in tar if x.isfile()), None)
+            if member is None:
+                raise ValueError(f'No file found in archive: {path}')
+            with tar.extractfile(member) as f:
+                yield f
+    elif kind == 'gzip':
+        with gzip.open(path, 'rb') as f:
+            yield f
+    else:
+        with open(path, 'rb') as f:
+            yield f
+
+
+@contextmanager
+def open_archive_text(path: str) -> Iterator[TextIOWrapper]:
+    """
+    Same as open_archive(), as a text stream ready for csv readers.
+    """
+    with open_archive(path) as f:
+        with TextIOWrapper(f, encoding='utf-8', errors='ignore', newline='') as text:
+            yield text
+
+
+def extract_to_csv(filename: str, indir: str) -> str:
+    """
+    Uncompress an archive (gzip, tar or zip) into indir, in one streaming pass.
+
+    Parameters
+    ----------
+    filename : str
+        Path of file to deflate.
+    indir : str
+        Path where install.
+
+    Returns
+    -------
+    str Path of the uncompressed '.csv' file.
+
+    """
+    basename = os_path.basename(filename)
+    for ext in ['.gz', '.tgz', '.tar', '.zip']:
+        if basename.endswith(ext):
+            basename = basename[:-len(ext)]
+    if not basename.endswith('.csv'):
+        basename += '.csv'
+    new_f = os_path.join(indir, basename)
+    with open_archive(filename) as f, open(new_f, 'wb') as fod:
+        copyfileobj(f, fod, 1 << 20)
+
+    return new_f
+
+
 def gunzip_to_csv(filename: str, indir: str) -> str:
     """
     Uncompress gzip file into indir.
@@ -314,22 +1059,148 @@ def gunzip_to_csv(filename: str, indir: str) -> str:
         Path where install.
 
     """
-    new_f = os_path.join(
-        indir,
-        os_path.basename(filename)+'.gz'
-        )
-    copyfile(filename, new_f)
-    filename = extract_gz(new_f, indir)
-    rename(filename, filename+'.csv')
-    filename += '.csv'
+    return extract_to_csv(filename, indir)
+
+
+def link_or_copy(src: str, dst: str) -> None:
+    """
+    Make src available at dst without copying it if possible: symbolic
+    link, hard link, copy as a last resort.
+
+    Parameters
+    ----------
+    src : str
+        Path of the existing file.
+    dst : str
+        Path to create.
 
-    return filename
+    """
+    try:
+        os_symlink(os_path.abspath(src), dst)
+        return
+    except OSError:
+        pass
+    try:
+        os_link(src, dst)
+        return
+    except OSError:
+        pass
+    copyfile(src, dst)
+
+
+def filter_rules(
+    rulesfile: str,
+    indir: str,
+    dmin: int | None = None,
+    dmax: int | None = None,
+    min_score: float | None = None,
+    logger: Logger = getLogger(__name__)
+) -> str | None:
+    """
+    Keep only rules with a diameter within [dmin, dmax] and a score
+    greater or equal to min_score. Rules are streamed, so that the
+    filtered file is written at once into indir.
+
+    Parameters
+    ----------
+    rulesfile : str
+        Path of rules file, plain CSV or archive (gzip, tar, zip).
+    indir : str
+        Path where write the filtered rules.
+    dmin : int | None
+        Minimal diameter, no lower bound if None.
+    dmax : int | None
+        Maximal diameter, no upper bound if None.
+    min_score : float | None
+        Minimal score, no threshold if None.
+    logger : Logger
+        The logger object.
+
+    Returns
+    -------
+    str | None Path of filtered rules, None if rules can not be filtered.
+
+    """
+    logger.info('   |- Filtering rules')
+
+    basename = os_path.basename(rulesfile)
+    for ext in ['.gz', '.tgz', '.tar', '.zip', '.csv']:
+        if basename.endswith(ext):
+            basename = basename[:-len(ext)]
+    new_f = os_path.join(indir, basename+'.filtered.csv')
+
+    with open_archive_text(rulesfile) as f:
+        f_reader = csv_reader(f, delimiter=',', quotechar='"')
+        header = next(f_reader, [])
+        columns = {'Diameter': dmin is not None or dmax is not None, 'Score': min_score is not None}
+        for column, needed in columns.items():
+            if needed and column not in header:
+                logger.warning(f"        no '{column}' column in rules, rules are not filtered")
+                return None
+        i_diameter = header.index('Diameter') if columns['Diameter'] else None
+        i_score = header.index('Score') if columns['Score'] else None
+
+        n_in, n_out = 0, 0
+        with open(new_f, 'w', newline='') as fod:
+            f_writer = csv_writer(fod, delimiter=',', quotechar='"')
+            f_writer.writerow(header)
+            for row in f_reader:
+                n_in += 1
+                try:
+                    if i_diameter is not None:
+                        diameter = float(row[i_diameter])
+                        if dmin is not None and diameter < dmin:
+                            continue
+                        if dmax is not None and diameter > dmax:
+                            continue
+                    if i_score is not None and float(row[i_score]) < min_score:
+                        continue
+                except (IndexError, ValueError):
+                    # Let KNIME deal with malformed rules
+                    pass
+                f_writer.writerow(row)
+                n_out += 1
+
+    logger.info(f'        {n_out}/{n_in} rules kept')
+    return new_f
+
+
+def prepare_rules(
+    rulesfile: str,
+    indir: str,
+    dmin: int | None = None,
+    dmax: int | None = None,
+    min_score: float | None = None,
+    logger: Logger = getLogger(__name__)
+) -> str:
+    """
+    Make rules ready for KNIME: filtered (see filter_rules()) if any bound
+    is set, uncompressed if given as an archive.
+
+    Returns
+    -------
+    str Path of the rules for KNIME, rulesfile itself if nothing was to do.
+
+    """
+    filtered = None
+    if dmin is not None or dmax is not None or min_score is not None:
+        filtered = filter_rules(rulesfile, indir, dmin, dmax, min_score, logger)
+
+    if filtered is not None:
+        return filtered
+    if archive_kind(rulesfile) is not None:
+        return extract_to_csv(rulesfile, indir)
+    return rulesfile
 
 
 def format_files_for_knime(
     sinkfile: str, sourcefile: str, rulesfile: str,
     indir: str, outdir: str,
-    logger: Logger = getLogger(__name__)
+    logger: Logger = getLogger(__name__),
+    dmin: int | None = None,
+    dmax: int | None = None,
+    min_score: float | None = None,
+    staging: StagingCache | None = None,
 ) -> Dict:
     """
     Format files according to KNIME expectations.
@@ -348,6 +1219,14 @@ def format_files_for_knime(
         Path to output the resuts.
     logger : Logger
         The logger object.
+    dmin : int | None
+        If set with dmax or min_score, rules are filtered before KNIME.
+    dmax : int | None
+        See dmin.
+    min_score : float | None
+        See dmin.
+    staging : StagingCache | None
+        Cache of prepared rules shared across runs.
 
     Returns
     -------
@@ -356,11 +1235,16 @@ def format_files_for_knime(
    """
     logger.info('   |- Formatting files for KNIME')
 
-    # If 'rulesfile' is a pure gzip archive without tar
-    kind = guess(rulesfile)
-    if kind:
-        if kind.mime == 'application/gzip':
-            rulesfile = gunzip_to_csv(rulesfile, indir)
+    if staging is None:
+        rulesfile = prepare_rules(rulesfile, indir, dmin, dmax, min_score, logger)
+    else:
+        rulesfile = staging.stage(
+            rulesfile,
+            indir,
+            variant={'dmin': dmin, 'dmax': dmax, 'min_score': min_score},
+            build=lambda d: prepare_rules(rulesfile, d, dmin, dmax, min_score, logger),
+            logger=logger,
+        )
 
     files = {
         'sink'      : os_path.abspath(sinkfile),
@@ -371,14 +1255,14 @@ def format_files_for_knime(
         'outdir'    : os_path.abspath(outdir)
     }
     # Because KNIME accepts only '.csv' file extension,
-    # files have to be renamed
+    # files have to be renamed (linked, not copied)
     for key in ['sink', 'source', 'rules']:
         if os_path.splitext(files[key])[-1] != '.csv':
             new_f = os_path.join(
                 indir,
                 os_path.basename(files[key])+'.csv'
                 )
-            copyfile(files[key], new_f)
+            link_or_copy(files[key], new_f)
             files[key] = new_f
 
     return files
@@ -387,47 +1271,12 @@ def sniff_rules(path: str, logger: Logger = getLogger(__name__)) -> str:
     hydrogen_explicit_patterns = ["[#1"]
     n = 10
     lines = []
-    # --- Gzip compressed single file ---
-    if path.endswith(".gz") and not path.endswith(".tar.gz"):
-        with gzip.open(path, "rt", encoding="utf-8", errors="ignore") as f:
-            for i, line in enumerate(f):
-                if i >= n:
-                    break
-                lines.append(line.rstrip())
-    # --- Tar or Tar.gz archive ---
-    elif path.endswith(".tar") or path.endswith(".tar.gz"):
-        mode = "r:gz" if path.endswith(".gz") else "r:"
-        with tarfile.open(path, mode) as tar:
-            # Pick the first regular file inside
-            for member in tar:
-                if member.isfile():
-                    f = tar.extractfile(member)
-                    if f is None:
-                        continue
-                    for i, line in enumerate(f):
-                        if i >= n:
-                            break
-                        lines.append(line.decode("utf-8", errors="ignore").rstrip())
-                    break  # only first file
-    # --- Zip archive ---
-    elif path.endswith(".zip"):
-        with zipfile.ZipFile(path, "r") as zf:
-            for name in zf.namelist():
-                if name.startswith("_"):
-                    continue
-                with zf.open(name) as f:
-                    for i, line in enumerate(f):
-                        if i >= n:
-                            break
-                        lines.append(line.decode("utf-8", errors="ignore").rstrip())
+    # Plain text, or first file of a gzip, tar (compressed or not) or zip archive
+    with open_archive(path) as f:
+        for i, line in enumerate(f):
+            if i >= n:
                 break
-    # --- Plain text ---
-    else:
-        with open(path, "rt", encoding="utf-8", errors="ignore") as f:
-            for i, line in enumerate(f):
-                if i >= n:
-                    break
-                lines.append(line.rstrip())
+            lines.append(line.decode("utf-8", errors="ignore").rstrip())
 
     for line in lines:
         for pattern in hydrogen_explicit_patterns:
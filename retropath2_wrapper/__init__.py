@@ -4,10 +4,13 @@ Created on June 16 2020
 @author: Joan Hérisson
 """
 
-from retropath2_wrapper.RetroPath2 import retropath2
+from retropath2_wrapper.RetroPath2 import (
+    retropath2,
+    retropath2_async,
+)
 from retropath2_wrapper.Args       import build_args_parser
 from retropath2_wrapper._version   import __version__
 from retropath2_wrapper.__main__   import parse_and_check_args
 
 
-__all__ = ["retropath2", "build_args_parser"]
+__all__ = ["retropath2", "retropath2_async", "build_args_parser"]
@@ -10,10 +10,6 @@ from logging import (
     Logger,
     getLogger
 )
-from glob import glob
-from typing import (
-    Dict,
-)
 from colored import fg, attr
 
 from brs_utils import (
@@ -21,15 +17,27 @@ from brs_utils import (
 )
 
 from retropath2_wrapper.RetroPath2 import (
+    check_results,
+    check_scope,
     retropath2,
-    sniff_rules,
 )
 from retropath2_wrapper.Args import (
     build_args_parser,
     RETCODES
 )
 from retropath2_wrapper._version import __version__
+from retropath2_wrapper.batch import _cli as batch_cli
 from retropath2_wrapper.knime import Knime
+from retropath2_wrapper.options import (
+    build_cache,
+    build_sink_index,
+    build_staging,
+    build_store,
+    knime_options,
+    parse_std_hydrogen,
+)
+from retropath2_wrapper.outputs import write_sources
+from retropath2_wrapper.progress import ProgressLogger
 
 
 def print_conf(
@@ -68,6 +76,10 @@ def print_conf(
 
 
 def _cli():
+    # Many targets at once: python -m retropath2_wrapper batch ...
+    if sys.argv[1:2] == ['batch']:
+        return batch_cli(sys.argv[2:])
+
     parser = build_args_parser()
     args = parse_and_check_args(parser)
 
@@ -82,6 +94,7 @@ def _cli():
     knime = Knime(
         kinstall=args.kinstall,
         workflow=os_path.join(here, 'workflows', 'RetroPath2.0_%s.knwf' % (args.rp2_version,)),
+        **knime_options(args),
     )
 
     # Print out configuration
@@ -90,34 +103,42 @@ def _cli():
 
     logger.debug('args: ' + str(args))
     
-    # Sniff implicit/explicit hydrogens
-    if args.std_hydrogen == "auto":
-        std_hydrogen = sniff_rules(path=args.rules_file, logger=logger)
-    elif args.std_hydrogen in ["implicit", "explicit"]:
-        std_hydrogen = args.std_hydrogen
-    else:
-        parser.error("--std_hydrogen should be one of 'auto', 'implicit' or 'explicit'.")
-    if std_hydrogen == "implicit":
-        std_hydrogen = "Aromatized (no Hs added)"
-    else:
-        std_hydrogen = "H added + Aromatized"
-
-    r_code, result_files = retropath2(
-        sink_file=args.sink_file,
-        source_file=args.source_file,
-        rules_file=args.rules_file,
-        outdir=args.outdir,
-        std_hydrogen=std_hydrogen,
-        max_steps=args.max_steps,
-        topx=args.topx,
-        dmin=args.dmin,
-        dmax=args.dmax,
-        mwmax_source=args.mwmax_source,
-        rp2_version=None,
-        knime=knime,
-        msc_timeout=args.msc_timeout,
-        logger=logger
-    )
+    std_hydrogen = parse_std_hydrogen(parser, args, logger)
+
+    sink_index = build_sink_index(args, logger)
+    try:
+        r_code, result_files = retropath2(
+            sink_file=args.sink_file,
+            source_file=args.source_file,
+            rules_file=args.rules_file,
+            outdir=args.outdir,
+            std_hydrogen=std_hydrogen,
+            max_steps=args.max_steps,
+            topx=args.topx,
+            dmin=args.dmin,
+            dmax=args.dmax,
+            mwmax_source=args.mwmax_source,
+            rp2_version=None,
+            knime=knime,
+            msc_timeout=args.msc_timeout,
+            cache=build_cache(args),
+            store=build_store(args),
+            staging=build_staging(args),
+            prefilter_rules=args.prefilter_rules,
+            min_rule_score=args.min_rule_score,
+            sink_index=sink_index,
+            timeout=args.timeout,
+            cpu_timeout=args.cpu_timeout,
+            progress=ProgressLogger(logger) if args.progress else None,
+            stop_solutions=args.stop_solutions,
+            stop_iterations=args.stop_iterations,
+            columnar=args.columnar,
+            resume_dir=args.resume_dir,
+            logger=logger
+        )
+    finally:
+        if sink_index is not None:
+            sink_index.close()
 
     logger.info('')
 
@@ -135,6 +156,10 @@ def _cli():
     elif r_code == RETCODES['SinkFileMalformed']:
         logger.error('The sink file is malformed.')
         logger.error('Exiting...')
+    elif r_code == RETCODES['TimeOut']:
+        logger.error('The time budget has been exceeded, partial results are kept.')
+        logger.error('   |--path: '+args.outdir)
+        logger.error('Exiting...')
     else:
         logger.error(f'The following error occured: {r_code}')
         logger.error('Exiting...')
@@ -145,46 +170,6 @@ def _cli():
     return r_code
 
 
-def check_results(
-    result_files: Dict,
-    logger: Logger = getLogger(__name__)
-) -> int:
-    # Check if any result has been found
-    r_code = check_scope(result_files['outdir'], logger)
-    return r_code
-
-
-def check_scope(
-    outdir: str,
-    logger: Logger = getLogger(__name__)
-) -> int:
-    """
-    Check if result is present in outdir.
-
-    Parameters
-    ----------
-    outdir : str
-        The folder where results heve been written.
-    logger : Logger
-        The logger object.
-
-    Returns
-    -------
-    int Return code.
-
-    """
-    csv_scopes = sorted(
-        glob(os_path.join(outdir, '*_scope.csv')),
-        key=lambda scope: os_path.getmtime(scope)
-        )
-
-    if csv_scopes == []:
-        logger.warning('       Warning: No solution has been found')
-        return RETCODES['NoSolution']
-
-    return RETCODES['OK']
-
-
 def parse_and_check_args(
     parser: ArgumentParser
 ):
@@ -207,9 +192,7 @@ def parse_and_check_args(
             args.source_name = 'target'
         # Create temporary source file
         args.source_file = os_path.join(args.outdir, 'source.csv')
-        with open(args.source_file, 'w') as temp_f:
-            temp_f.write('Name,InChI\n')
-            temp_f.write('"%s","%s"' % (args.source_name, args.source_inchi.strip()))
+        write_sources([(args.source_name, args.source_inchi.strip())], args.source_file)
 
     return args
 
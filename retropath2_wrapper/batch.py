@@ -0,0 +1,482 @@
+"""
+Run the RetroPath2.0 workflow on many targets concurrently.
+
+Targets are read from a multi-row source file (or a folder of such files),
+checked up front, then processed by a bounded pool of KNIME workspaces, rules
+being prepared once for all targets through a staging cache. Each
+target gets its own output folder and a summary of the return codes is
+written into the batch output folder.
+"""
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from csv import (
+    reader as csv_reader,
+    writer as csv_writer,
+)
+from glob import glob
+from os import (
+    makedirs,
+    path as os_path,
+)
+from re import sub
+from logging import (
+    Logger,
+    getLogger
+)
+from tempfile import TemporaryDirectory
+from typing import (
+    Dict,
+    List,
+    Tuple,
+)
+from colored import attr
+
+from brs_utils import create_logger
+
+from retropath2_wrapper.Args import (
+    DEFAULTS,
+    RETCODES,
+    build_batch_args_parser,
+)
+from retropath2_wrapper.RetroPath2 import (
+    check_inchi,
+    check_results,
+    init_knime,
+    retropath2,
+)
+from retropath2_wrapper.knime import (
+    Knime,
+    KnimePool,
+)
+from retropath2_wrapper.options import (
+    build_cache,
+    build_staging,
+    build_store,
+    knime_options,
+    parse_std_hydrogen,
+)
+from retropath2_wrapper.outputs import write_sources
+from retropath2_wrapper.progress import ProgressLogger
+from retropath2_wrapper.sink_index import SinkIndex
+from retropath2_wrapper.staging import StagingCache
+
+
+SUMMARY_FILE = 'summary.csv'
+
+
+def read_sources(
+    path: str,
+    logger: Logger = getLogger(__name__)
+) -> List[Dict]:
+    """
+    Read targets from a source file or from all CSV files of a folder.
+
+    Parameters
+    ----------
+    path : str
+        Path of a source file with one target per row, or of a folder.
+    logger : Logger
+        The logger object.
+
+    Returns
+    -------
+    List[Dict] Jobs with 'name' and 'inchi' keys. Targets which cannot
+    be read have their 'r_code' already set.
+
+    """
+    if os_path.isdir(path):
+        files = sorted(glob(os_path.join(path, '*.csv')))
+    else:
+        files = [path]
+
+    jobs = []
+    for file in files:
+        with open(file, 'r') as f:
+            f_reader = csv_reader(f)
+            header = next(f_reader, [])
+            if [_.strip().lower() for _ in header[:2]] != ['name', 'inchi']:
+                logger.error(f'        {file}: malformed header {header}')
+                jobs.append({'name': os_path.basename(file), 'inchi': '', 'r_code': RETCODES['InChI']})
+                continue
+            for row in f_reader:
+                if row == []:
+                    continue
+                if len(row) < 2:
+                    logger.error(f'        {file}: malformed row {row}')
+                    jobs.append({'name': row[0], 'inchi': '', 'r_code': RETCODES['InChI']})
+                    continue
+                jobs.append({'name': row[0].strip(), 'inchi': row[1]})
+
+    return jobs
+
+
+def check_sources(
+    jobs: List[Dict],
+    sink_index: SinkIndex,
+    logger: Logger = getLogger(__name__)
+) -> None:
+    """
+    Check all targets before running any of them. Invalid targets, or
+    targets already in the sink, get their return code set.
+
+    Parameters
+    ----------
+    jobs : List[Dict]
+        Jobs as returned by read_sources().
+    sink_index : SinkIndex
+        Index of the sink file.
+    logger : Logger
+        The logger object.
+
+    """
+    logger.info('{attr1}Checking input data{attr2}'.format(attr1=attr('bold'), attr2=attr('reset')))
+
+    todo = []
+    for job in jobs:
+        if 'r_code' in job:
+            continue
+        inchi = check_inchi(job['inchi'], logger)
+        if inchi in RETCODES.values():
+            job['r_code'] = RETCODES['InChI']
+        else:
+            job['inchi'] = inchi
+            todo.append(job)
+
+    in_sink = sink_index.lookup_many(job['inchi'] for job in todo)
+    for job in todo:
+        if in_sink[job['inchi']] is not None:
+            logger.warning(f'        {job["name"]}: source has been found in sink')
+            job['r_code'] = RETCODES['SrcInSink']
+
+
+def set_job_outdirs(jobs: List[Dict], outdir: str) -> None:
+    """
+    Give each job its own output folder, named after the target.
+
+    Parameters
+    ----------
+    jobs : List[Dict]
+        Jobs as returned by read_sources().
+    outdir : str
+        Batch output folder.
+
+    """
+    names = set()
+    for job in jobs:
+        if 'r_code' in job:
+            continue
+        name = sub(r'[^\w.-]+', '_', job['name']) or 'target'
+        unique = name
+        i = 1
+        while unique in names:
+            unique = f'{name}_{i}'
+            i += 1
+        names.add(unique)
+        job['outdir'] = os_path.join(outdir, unique)
+
+
+def run_job(
+    job: Dict,
+    sink_file: str,
+    rules_file: str,
+    std_hydrogen: str,
+    knime: Knime,
+    logger: Logger = getLogger(__name__),
+    **kwargs
+) -> int:
+    """
+    Run the workflow for one target of a batch.
+
+    Parameters
+    ----------
+    job : Dict
+        The job, with 'name', 'inchi' and 'outdir' keys.
+    sink_file : str
+        Path to file containing the sink.
+    rules_file : str
+        Path to file containing the rules.
+    std_hydrogen : str
+        Standardization mode of the workflow.
+    knime : Knime
+        The Knime object.
+    logger : Logger
+        The logger object.
+    kwargs
+        Other parameters of retropath2().
+
+    Returns
+    -------
+    int Return code.
+
+    """
+    makedirs(job['outdir'], exist_ok=True)
+    # Line breaks would split the row of the target in the workflow
+    name = ' '.join(job['name'].split())
+    source_file = write_sources([(name, job['inchi'])], os_path.join(job['outdir'], 'source.csv'))
+
+    progress = kwargs.pop('progress', None)
+    if progress is not None:
+        # Tell jobs apart in progress events
+        kwargs['progress'] = lambda event: progress(event._replace(job=job['name']))
+    if kwargs.get('resume_dir') is not None:
+        # Output folder of a previous batch, one subfolder per target
+        kwargs['resume_dir'] = os_path.join(kwargs['resume_dir'], os_path.basename(job['outdir']))
+
+    try:
+        r_code, result_files = retropath2(
+            sink_file=sink_file,
+            source_file=source_file,
+            rules_file=rules_file,
+            outdir=job['outdir'],
+            std_hydrogen=std_hydrogen,
+            knime=knime,
+            rp2_version=None,
+            logger=logger,
+            **kwargs
+        )
+    except Exception as e:
+        # A failing target must not stop the whole batch
+        logger.error(f'{job["name"]}: {e}')
+        return RETCODES['OSError']
+
+    if r_code == RETCODES['OK']:
+        r_code = check_results(result_files, logger)
+    return r_code
+
+
+def write_summary(
+    jobs: List[Dict],
+    outdir: str,
+    logger: Logger = getLogger(__name__)
+) -> str:
+    """
+    Write the return code of each target into the batch output folder.
+
+    Parameters
+    ----------
+    jobs : List[Dict]
+        Processed jobs.
+    outdir : str
+        Batch output folder.
+    logger : Logger
+        The logger object.
+
+    Returns
+    -------
+    str Path of the summary file.
+
+    """
+    retcodes = {}
+    for key, value in RETCODES.items():
+        retcodes.setdefault(value, key)
+
+    summary_file = os_path.join(outdir, SUMMARY_FILE)
+    with open(summary_file, 'w', newline='') as f:
+        f_writer = csv_writer(f, quotechar='"')
+        f_writer.writerow(['Name', 'InChI', 'Outdir', 'Return code', 'Status'])
+        for job in jobs:
+            f_writer.writerow([
+                job['name'],
+                job['inchi'],
+                job.get('outdir', ''),
+                job['r_code'],
+                retcodes.get(job['r_code'], 'KNIME'),
+            ])
+
+    counts = {}
+    for job in jobs:
+        status = retcodes.get(job['r_code'], 'KNIME')
+        counts[status] = counts.get(status, 0) + 1
+    for status, count in sorted(counts.items()):
+        logger.info(f'   |- {status}: {count}')
+
+    return summary_file
+
+
+def retropath2_batch(
+    sink_file: str,
+    source_path: str,
+    rules_file: str,
+    outdir: str,
+    std_hydrogen: str,
+    knime: Knime | None = None,
+    jobs: int = DEFAULTS['JOBS'],
+    rp2_version: str | None = DEFAULTS['RP2_VERSION'],
+    sink_index_dir: str | None = None,
+    staging: StagingCache | None = None,
+    logger: Logger = getLogger(__name__),
+    **kwargs
+) -> Tuple[int, List[Dict]]:
+    """
+    Run the workflow on all targets of a source file or folder.
+
+    Parameters
+    ----------
+    sink_file : str
+        Path to file containing the sink.
+    source_path : str
+        Path of a source file with one target per row, or of a folder.
+    rules_file : str
+        Path to file containing the rules.
+    outdir : str
+        Batch output folder, one subfolder is created per target.
+    std_hydrogen : str
+        Standardization mode of the workflow.
+    knime : Knime | None
+        The Knime object. A KnimePool of `jobs` workspaces is created
+        if it is not a KnimePool already.
+    jobs : int
+        Number of targets processed concurrently.
+    rp2_version : str | None
+        Version of the RetroPath2.0 workflow.
+    sink_index_dir : str | None
+        Folder of persistent sink indexes, a temporary index shared by
+        all targets is used if None.
+    staging : StagingCache | None
+        Cache of prepared rules, a temporary one is used if None.
+    logger : Logger
+        The logger object.
+    kwargs
+        Other parameters of retropath2() (max_steps, topx, dmin...).
+
+    Returns
+    -------
+    Tuple[int, List[Dict]] Return code and processed jobs.
+
+    """
+    logger.debug(f'source_path: {source_path}')
+    logger.debug(f'jobs: {jobs}')
+
+    try:
+        batch = read_sources(source_path, logger)
+    except FileNotFoundError as e:
+        logger.error(e)
+        return RETCODES['FileNotFound'], []
+
+    with TemporaryDirectory() as tempd:
+        try:
+            # Index of the batch only, unless a folder of indexes is given
+            sink_index = SinkIndex(sink_file, path=sink_index_dir or tempd, logger=logger)
+        except FileNotFoundError as e:
+            logger.error(e)
+            return RETCODES['FileNotFound'], batch
+        except ValueError as e:
+            logger.error(e)
+            return RETCODES['SinkFileMalformed'], batch
+
+        pool = knime
+        try:
+            check_sources(batch, sink_index, logger)
+
+            makedirs(outdir, exist_ok=True)
+            set_job_outdirs(batch, outdir)
+
+            if not isinstance(pool, KnimePool):
+                pool = KnimePool(
+                    kinstall=DEFAULTS['KNIME_FOLDER'] if knime is None else knime.kinstall,
+                    workflow="" if knime is None else knime.workflow,
+                    size=jobs,
+                    **({} if knime is None else knime.options()),
+                )
+            # Install KNIME once, before workers start
+            pool = init_knime(knime=pool, rp2_version=rp2_version, logger=logger)
+
+            todo = [job for job in batch if 'r_code' not in job]
+            logger.info('{attr1}Running {n} targets ({jobs} concurrently){attr2}'.format(
+                attr1=attr('bold'), n=len(todo), jobs=jobs, attr2=attr('reset'))
+            )
+            if staging is None:
+                staging = StagingCache(path=os_path.join(tempd, 'staging'))
+            with ThreadPoolExecutor(max_workers=jobs) as executor:
+                futures = [
+                    executor.submit(
+                        run_job,
+                        job=job,
+                        sink_file=sink_file,
+                        rules_file=rules_file,
+                        std_hydrogen=std_hydrogen,
+                        knime=pool,
+                        sink_index=sink_index,
+                        staging=staging,
+                        logger=logger,
+                        **kwargs
+                    )
+                    for job in todo
+                ]
+                for job, future in zip(todo, futures):
+                    job['r_code'] = future.result()
+        finally:
+            sink_index.close()
+            if pool is not knime and pool is not None:
+                pool.shutdown()
+
+    logger.info('{attr1}Summary{attr2}'.format(attr1=attr('bold'), attr2=attr('reset')))
+    summary_file = write_summary(batch, outdir, logger)
+    logger.info('   |--path: ' + summary_file)
+
+    for job in batch:
+        if job['r_code'] not in [RETCODES['OK'], RETCODES['SrcInSink'], RETCODES['NoSolution']]:
+            return job['r_code'], batch
+    return RETCODES['OK'], batch
+
+
+def _cli(argv: List[str] | None = None):
+    parser = build_batch_args_parser()
+    args = parser.parse_args(argv)
+
+    if args.source_file is None:
+        parser.error("--source_file is mandatory in batch mode.")
+    if args.source_name is not None or args.source_inchi is not None:
+        parser.error("--source_name and --source_inchi are not compliant with batch mode.")
+    if args.jobs < 1:
+        parser.error("--jobs should be a positive integer.")
+
+    if args.log.lower() in ['silent', 'quiet'] or args.silent:
+        args.log = 'CRITICAL'
+
+    # Create logger
+    logger = create_logger(parser.prog, args.log)
+    logger.debug('args: ' + str(args))
+
+    std_hydrogen = parse_std_hydrogen(parser, args, logger)
+
+    with KnimePool(kinstall=args.kinstall, size=args.jobs, **knime_options(args)) as knime:
+        r_code, jobs = retropath2_batch(
+            sink_file=args.sink_file,
+            source_path=args.source_file,
+            rules_file=args.rules_file,
+            outdir=args.outdir,
+            std_hydrogen=std_hydrogen,
+            knime=knime,
+            jobs=args.jobs,
+            rp2_version=args.rp2_version,
+            max_steps=args.max_steps,
+            topx=args.topx,
+            dmin=args.dmin,
+            dmax=args.dmax,
+            mwmax_source=args.mwmax_source,
+            msc_timeout=args.msc_timeout,
+            cache=build_cache(args),
+            store=build_store(args),
+            staging=build_staging(args),
+            prefilter_rules=args.prefilter_rules,
+            min_rule_score=args.min_rule_score,
+            sink_index_dir=args.sink_index_dir,
+            timeout=args.timeout,
+            cpu_timeout=args.cpu_timeout,
+            progress=ProgressLogger(logger) if args.progress else None,
+            stop_solutions=args.stop_solutions,
+            stop_iterations=args.stop_iterations,
+            columnar=args.columnar,
+            resume_dir=args.resume_dir,
+            logger=logger
+        )
+
+    if args.quiet:
+        r_code = RETCODES['OK']
+
+    return r_code
+
+
+if __name__ == '__main__':
+    sys.exit(_cli())
@@ -0,0 +1,351 @@
+"""
+On-disk cache of RetroPath2.0 results.
+
+Entries are keyed on the content of the input files (sink, source, rules,
+workflow) and on the parameters of the workflow, so that running the same
+target twice returns the stored outputs instead of calling KNIME again.
+The cache is bounded in size, least recently used entries are evicted first.
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from glob import glob
+from logging import (
+    Logger,
+    getLogger
+)
+from typing import (
+    Dict,
+    List,
+    Optional,
+)
+
+from retropath2_wrapper.Args import DEFAULTS
+
+
+CACHE_VERSION = 1
+META_FILE = 'meta.json'
+
+__DIGESTS = {}
+
+
+def hash_file(path: str) -> str:
+    """
+    Compute the SHA-256 digest of a file content. Digests are memoized
+    per process on the path, size and modification time of the file.
+
+    Parameters
+    ----------
+    path : str
+        Path of the file.
+
+    Returns
+    -------
+    str Hexadecimal digest.
+
+    """
+    path = os.path.realpath(path)
+    stat = os.stat(path)
+    memo = (path, stat.st_size, stat.st_mtime_ns)
+    digest = __DIGESTS.get(memo)
+    if digest is None:
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+        digest = h.hexdigest()
+        __DIGESTS[memo] = digest
+    return digest
+
+
+def dir_size(path: str) -> int:
+    size = 0
+    for root, _, files in os.walk(path):
+        for file in files:
+            size += os.path.getsize(os.path.join(root, file))
+    return size
+
+
+class ResultCache(object):
+    """Content-addressed cache of workflow outputs.
+
+    Attributes
+    ----------
+    path: str
+        directory where entries are stored
+    max_size: int
+        maximal size of the cache, in bytes
+    """
+
+    def __init__(
+            self,
+            path: str = DEFAULTS['CACHE_FOLDER'],
+            max_size: int = DEFAULTS['CACHE_SIZE'],
+        ) -> None:
+        self.path = os.path.abspath(path)
+        self.max_size = max_size
+        os.makedirs(self.path, exist_ok=True)
+
+    def __repr__(self):
+        s = []
+        s.append(f"path: {self.path}")
+        s.append(f"max_size: {self.max_size}")
+        return "\n".join(s)
+
+    @classmethod
+    def key(cls, files: Dict[str, str], params: Dict) -> str:
+        """Build the key of an entry.
+
+        Parameters
+        ----------
+        files: Dict[str, str]
+            Paths of the input files, by role (sink, source, rules, workflow).
+        params: Dict
+            Parameters of the workflow.
+
+        Return
+        ------
+        str
+        """
+        content = {
+            'version': CACHE_VERSION,
+            'files': {role: hash_file(path) for role, path in files.items()},
+            'params': params,
+        }
+        return hashlib.sha256(
+            json.dumps(content, sort_keys=True, default=str).encode()
+        ).hexdigest()
+
+    def entry(self, key: str) -> str:
+        return os.path.join(self.path, key[:2], key)
+
+    def entries(self) -> List[str]:
+        return glob(os.path.join(self.path, '??', '*', META_FILE))
+
+    def get(
+        self,
+        key: str,
+        outdir: str,
+        logger: Logger = getLogger(__name__)
+    ) -> Optional[int]:
+        """Copy the outputs of an entry into outdir.
+
+        Parameters
+        ----------
+        key: str
+            Key of the entry.
+        outdir: str
+            Folder where outputs are copied.
+        logger : Logger
+            The logger object.
+
+        Return
+        ------
+        Optional[int]
+            Return code of the cached run, None if the entry does not exist.
+        """
+        entry = self.entry(key)
+        meta_file = os.path.join(entry, META_FILE)
+        try:
+            with open(meta_file, 'r') as f:
+                meta = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+        os.makedirs(outdir, exist_ok=True)
+        # Scope of a previous run in outdir would be taken for the one of the entry
+        for pattern in ['*_scope.csv', '*_scope.json']:
+            for scope in glob(os.path.join(outdir, pattern)):
+                os.remove(scope)
+        copied = []
+        try:
+            for name in meta['outputs']:
+                src = os.path.join(entry, name)
+                dst = os.path.join(outdir, name)
+                copied.append(dst)
+                if os.path.isdir(src):
+                    shutil.copytree(src, dst, dirs_exist_ok=True)
+                else:
+                    shutil.copyfile(src, dst)
+            # Mark entry as recently used
+            os.utime(meta_file)
+        except (FileNotFoundError, shutil.Error) as e:
+            # Entry evicted or cleared while being copied
+            logger.debug(e)
+            for dst in copied:
+                if os.path.isdir(dst):
+                    shutil.rmtree(dst, ignore_errors=True)
+                elif os.path.exists(dst):
+                    os.remove(dst)
+            return None
+
+        logger.info(f'   |- Results found in cache: {entry}')
+        return meta['r_code']
+
+    def put(
+        self,
+        key: str,
+        outdir: str,
+        outputs: List[str],
+        r_code: int,
+        logger: Logger = getLogger(__name__)
+    ) -> None:
+        """Store the outputs of a run.
+
+        Parameters
+        ----------
+        key: str
+            Key of the entry.
+        outdir: str
+            Folder where the run wrote its outputs.
+        outputs: List[str]
+            Names of files or folders of outdir to store.
+        r_code: int
+            Return code of the run.
+        logger : Logger
+            The logger object.
+        """
+        entry = self.entry(key)
+        if os.path.exists(entry):
+            return
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+
+        # Entry is built aside then moved, concurrent readers never see partial entries
+        tempd = tempfile.mkdtemp(dir=os.path.dirname(entry), prefix='.tmp_')
+        try:
+            stored = []
+            for name in outputs:
+                src = os.path.join(outdir, name)
+                if os.path.isdir(src):
+                    shutil.copytree(src, os.path.join(tempd, name))
+                elif os.path.isfile(src):
+                    shutil.copyfile(src, os.path.join(tempd, name))
+                else:
+                    continue
+                stored.append(name)
+            meta = {
+                'r_code': r_code,
+                'outputs': stored,
+                'created': time.time(),
+                'size': dir_size(tempd),
+            }
+            with open(os.path.join(tempd, META_FILE), 'w') as f:
+                json.dump(meta, f)
+            os.rename(tempd, entry)
+            logger.debug(f'Results stored in cache: {entry}')
+        except OSError as e:
+            # Entry stored by a concurrent run, or cache not writable
+            logger.debug(e)
+            shutil.rmtree(tempd, ignore_errors=True)
+            return
+
+        self.evict(logger=logger)
+
+    def evict(self, logger: Logger = getLogger(__name__)) -> int:
+        """Remove least recently used entries until the cache fits in max_size.
+
+        Return
+        ------
+        int
+            Number of evicted entries.
+        """
+        entries = []
+        total = 0
+        for meta_file in self.entries():
+            try:
+                with open(meta_file, 'r') as f:
+                    size = json.load(f)['size']
+                mtime = os.path.getmtime(meta_file)
+            except (OSError, ValueError, KeyError):
+                continue
+            entries.append((mtime, size, os.path.dirname(meta_file)))
+            total += size
+
+        count = 0
+        for _, size, entry in sorted(entries):
+            if total <= self.max_size:
+                break
+            logger.debug(f'Evict cache entry: {entry}')
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+            count += 1
+        return count
+
+    def stats(self) -> Dict:
+        """Describe the content of the cache.
+
+        Return
+        ------
+        Dict
+        """
+        sizes = []
+        mtimes = []
+        for meta_file in self.entries():
+            try:
+                with open(meta_file, 'r') as f:
+                    sizes.append(json.load(f)['size'])
+                mtimes.append(os.path.getmtime(meta_file))
+            except (OSError, ValueError, KeyError):
+                continue
+        return {
+            'path': self.path,
+            'entries': len(sizes),
+            'size': sum(sizes),
+            'max_size': self.max_size,
+            'oldest_use': min(mtimes) if mtimes else None,
+            'latest_use': max(mtimes) if mtimes else None,
+        }
+
+    def clear(self) -> None:
+        """Remove all entries."""
+        for meta_file in self.entries():
+            shutil.rmtree(os.path.dirname(meta_file), ignore_errors=True)
+
+
+def _stats(args) -> int:
+    cache = ResultCache(path=args.cache_dir, max_size=args.cache_size * 1024 ** 2)
+    stats = cache.stats()
+    for key in ['oldest_use', 'latest_use']:
+        if stats[key] is not None:
+            stats[key] = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(stats[key]))
+    print(json.dumps(stats, indent=2))
+    return 0
+
+
+def _evict(args) -> int:
+    cache = ResultCache(path=args.cache_dir, max_size=args.cache_size * 1024 ** 2)
+    print(f'{cache.evict()} entries evicted')
+    return 0
+
+
+def _clear(args) -> int:
+    cache = ResultCache(path=args.cache_dir)
+    cache.clear()
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='retropath2_wrapper.cache')
+    subparsers = parser.add_subparsers(required=True)
+
+    for name, func, help in [
+        ("stats", _stats, "Show cache statistics"),
+        ("evict", _evict, "Evict least recently used entries"),
+        ("clear", _clear, "Remove all entries"),
+    ]:
+        par = subparsers.add_parser(name, help=help)
+        par.add_argument(
+            "--cache_dir", default=DEFAULTS['CACHE_FOLDER'], help="Cache folder"
+        )
+        par.add_argument(
+            "--cache_size", type=int, default=DEFAULTS['CACHE_SIZE'] // 1024 ** 2, help="Maximal size of the cache (MB)"
+        )
+        par.set_defaults(func=func)
+
+    args = parser.parse_args()
+    sys.exit(args.func(args))
@@ -0,0 +1,280 @@
+"""
+Columnar copies of the results and scope tables.
+
+Results and scopes are wide csv files where long SMILES and InChI strings,
+rule ids and EC numbers are repeated from row to row. A columnar copy
+stores each column as separate members of a zip archive, one per chunk of
+CHUNK_ROWS rows so that the csv file is never held in memory: chunks with
+repeated values are dictionary encoded (unique values once, plus one
+integer code per row), the others stored as plain values. A ColumnarTable
+reads the columns lazily, only the members of the requested columns being
+decompressed.
+
+Only the standard library is used, so that the copies can be read without
+any additional dependency.
+"""
+import csv
+import json
+import os
+import zipfile
+from array import array
+from glob import glob
+from logging import (
+    Logger,
+    getLogger
+)
+from typing import (
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+
+
+COLUMNAR_EXT = '.columns.zip'
+COLUMNAR_VERSION = 2
+# Rows of the csv file encoded at once
+CHUNK_ROWS = 1 << 16
+# Dictionary encode a chunk if it has less unique values than this ratio of rows
+DICT_RATIO = 0.5
+META = 'meta.json'
+
+
+def columnar_path(path: str) -> str:
+    """Path of the columnar copy of a csv file."""
+    return os.path.splitext(path)[0] + COLUMNAR_EXT
+
+
+def code_typecode(n: int) -> str:
+    """Smallest unsigned array typecode holding n codes."""
+    for typecode in ['B', 'H', 'I', 'L']:
+        if n <= 2 ** (8 * array(typecode).itemsize):
+            return typecode
+    return 'Q'
+
+
+def write_chunk(
+    z: zipfile.ZipFile,
+    columns: List[List[str]],
+    meta: Dict,
+) -> None:
+    """Write the members of a chunk of rows, one per column."""
+    for column, column_meta in zip(columns, meta['columns']):
+        member = f'{column_meta["member"]}.{len(column_meta["chunks"]):06d}'
+        values = {}
+        for value in column:
+            values.setdefault(value, len(values))
+        if len(values) <= DICT_RATIO * len(column):
+            typecode = code_typecode(len(values))
+            codes = array(typecode, [values[x] for x in column])
+            z.writestr(member + '.dict', json.dumps(list(values)))
+            z.writestr(member + '.codes', codes.tobytes())
+            column_meta['chunks'].append({'encoding': 'dict', 'typecode': typecode})
+        else:
+            z.writestr(member + '.values', json.dumps(column))
+            column_meta['chunks'].append({'encoding': 'plain'})
+    meta['rows'] += len(columns[0]) if columns else 0
+
+
+def write_columns(
+    csv_file: str,
+    path: Optional[str] = None,
+    compression: int = zipfile.ZIP_DEFLATED,
+    chunk_rows: int = CHUNK_ROWS,
+) -> str:
+    """Write the columnar copy of a csv file.
+
+    Parameters
+    ----------
+    csv_file: str
+        Path of the csv file.
+    path: Optional[str]
+        Path of the copy, next to the csv file if None.
+    compression: int
+        Compression of the members of the archive.
+    chunk_rows: int
+        Rows of the csv file encoded at once.
+
+    Return
+    ------
+    str
+        Path of the copy.
+    """
+    if path is None:
+        path = columnar_path(csv_file)
+    tempf = path + '.tmp'
+    with open(csv_file, 'r', newline='') as f, \
+            zipfile.ZipFile(tempf, 'w', compression=compression) as z:
+        f_reader = csv.reader(f)
+        header = next(f_reader, [])
+        meta = {
+            'version': COLUMNAR_VERSION,
+            'rows': 0,
+            'chunk_rows': chunk_rows,
+            'columns': [{'name': name, 'member': f'{i:04d}', 'chunks': []} for i, name in enumerate(header)],
+        }
+        columns = [[] for _ in header]
+        for row in f_reader:
+            if row == [] or not header:
+                continue
+            for column, value in zip(columns, row + [''] * (len(header) - len(row))):
+                column.append(value)
+            if len(columns[0]) == chunk_rows:
+                write_chunk(z, columns, meta)
+                columns = [[] for _ in header]
+        if columns and columns[0]:
+            write_chunk(z, columns, meta)
+        z.writestr(META, json.dumps(meta))
+    os.replace(tempf, path)
+    return path
+
+
+def export_outputs(
+    outdir: str,
+    names: List[str],
+    logger: Logger = getLogger(__name__)
+) -> List[str]:
+    """Write the columnar copies of the csv outputs of a run.
+
+    Parameters
+    ----------
+    outdir: str
+        Output folder of the run.
+    names: List[str]
+        Names of the outputs, copies are written for csv files only.
+    logger : Logger
+        The logger object.
+
+    Return
+    ------
+    List[str]
+        Names of the copies.
+    """
+    copies = []
+    for name in names:
+        csv_file = os.path.join(outdir, name)
+        if not name.endswith('.csv') or not os.path.isfile(csv_file):
+            continue
+        path = write_columns(csv_file)
+        logger.debug(f'Columnar copy: {path}')
+        copies.append(os.path.basename(path))
+    return copies
+
+
+def list_columnar(outdir: str) -> List[str]:
+    """Names of the columnar copies of an output folder."""
+    return sorted(os.path.basename(x) for x in glob(os.path.join(outdir, '*' + COLUMNAR_EXT)))
+
+
+class ColumnarTable(object):
+    """Columnar copy of a csv file, read lazily.
+
+    Attributes
+    ----------
+    path: str
+        path of the copy
+    columns: List[str]
+        names of the columns, in csv order
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._zip = zipfile.ZipFile(path, 'r')
+        meta = json.loads(self._zip.read(META))
+        if meta.get('version') != COLUMNAR_VERSION:
+            self._zip.close()
+            raise ValueError(f'Unsupported columnar version: {meta.get("version")}')
+        for column in meta['columns']:
+            for i, chunk in enumerate(column['chunks']):
+                chunk['member'] = f'{column["member"]}.{i:06d}'
+        self._rows = meta['rows']
+        self._meta = {x['name']: x for x in meta['columns']}
+        self.columns = [x['name'] for x in meta['columns']]
+        self._cache = {}
+
+    def __repr__(self):
+        s = []
+        s.append(f"path: {self.path}")
+        s.append(f"rows: {self._rows}")
+        s.append(f"columns: {self.columns}")
+        return "\n".join(s)
+
+    def __len__(self) -> int:
+        return self._rows
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._zip.close()
+
+    def __getitem__(self, name: str) -> List[str]:
+        return self.column(name)
+
+    def _encoded(self, name: str) -> Optional[Tuple[List[str], array]]:
+        """Unique values and codes of a column whose chunks are all
+        dictionary encoded, None otherwise."""
+        chunks = self._meta[name]['chunks']
+        if any(x['encoding'] != 'dict' for x in chunks):
+            return None
+        values = {}
+        codes = []
+        for chunk in chunks:
+            # Codes of the chunk dictionary into the column one
+            remap = [
+                values.setdefault(x, len(values))
+                for x in json.loads(self._zip.read(chunk['member'] + '.dict'))
+            ]
+            chunk_codes = array(chunk['typecode'])
+            chunk_codes.frombytes(self._zip.read(chunk['member'] + '.codes'))
+            codes.extend(remap[x] for x in chunk_codes)
+        return list(values), array(code_typecode(len(values)), codes)
+
+    def dictionary(self, name: str) -> Optional[List[str]]:
+        """Unique values of a dictionary encoded column, None if plain."""
+        encoded = self._encoded(name)
+        return None if encoded is None else encoded[0]
+
+    def codes(self, name: str) -> Optional[array]:
+        """Codes of a dictionary encoded column (indices into
+        dictionary()), None if plain."""
+        encoded = self._encoded(name)
+        return None if encoded is None else encoded[1]
+
+    def column(self, name: str, type: Optional[Callable] = None) -> List:
+        """Values of a column, one per row.
+
+        Parameters
+        ----------
+        name: str
+            Name of the column.
+        type: Optional[Callable]
+            Applied to each value (e.g. float), values are str if None.
+        """
+        if name not in self._cache:
+            values = []
+            for chunk in self._meta[name]['chunks']:
+                if chunk['encoding'] == 'dict':
+                    dictionary = json.loads(self._zip.read(chunk['member'] + '.dict'))
+                    codes = array(chunk['typecode'])
+                    codes.frombytes(self._zip.read(chunk['member'] + '.codes'))
+                    values.extend(dictionary[x] for x in codes)
+                else:
+                    values.extend(json.loads(self._zip.read(chunk['member'] + '.values')))
+            self._cache[name] = values
+        values = self._cache[name]
+        if type is not None:
+            return [type(x) for x in values]
+        return values
+
+    def rows(self, columns: Optional[List[str]] = None) -> Iterator[Dict[str, str]]:
+        """Rows as dictionaries, restricted to some columns if given."""
+        columns = self.columns if columns is None else columns
+        values = [self.column(x) for x in columns]
+        for row in zip(*values):
+            yield dict(zip(columns, row))
@@ -0,0 +1,105 @@
+"""
+Incremental deepening of a previous run.
+
+The iterations of a run do not depend on max_steps: a run at max_steps=5
+computes the 3 iterations of a run at max_steps=3 again. To deepen a run,
+the compounds produced by its last iteration and not found in the sink
+(its frontier) are given to the workflow as sources, for the remaining
+iterations only. The results of this run are then appended to the ones
+of the previous run, iterations and transformation ids being shifted so
+that the merged results read as the ones of a single run.
+"""
+import csv
+import os
+import re
+from typing import (
+    List,
+    Tuple,
+)
+
+from retropath2_wrapper.outputs import iter_rows
+
+
+FRONTIER_NAME = 'frontier_{}'
+TRS_ID = re.compile(r'^TRS_(?P<source>\d+)_(?P<iteration>\d+)_(?P<n>\d+)$')
+
+
+def last_iteration(path: str) -> int:
+    """Last iteration of a results file, -1 if it holds no result."""
+    return max((row.iteration for row in iter_rows(path)), default=-1)
+
+
+def read_frontier(path: str) -> List[Tuple[str, str]]:
+    """Read the compounds left to expand after the last iteration of a
+    results file: the products of the last iteration which are not in the
+    sink and have not been expanded yet.
+
+    Parameters
+    ----------
+    path: str
+        Path of a results file.
+
+    Return
+    ------
+    List[Tuple[str, str]]
+        Name and InChI of the compounds, in order of appearance.
+    """
+    last = last_iteration(path)
+    expanded = set()
+    products = {}
+    for row in iter_rows(path):
+        expanded.add(row.substrate_inchi)
+        if row.iteration == last and not row.in_sink:
+            products.setdefault(row.product_inchi, None)
+    inchis = [x for x in products if x not in expanded]
+    return [(FRONTIER_NAME.format(i), inchi) for i, inchi in enumerate(inchis)]
+
+
+def merge_results(prior: str, path: str, offset: int) -> int:
+    """Append the results of a deepening run to the ones of the previous
+    run, in place.
+
+    Parameters
+    ----------
+    prior: str
+        Path of the results of the previous run.
+    path: str
+        Path of the results of the deepening run, overwritten by the
+        merged results.
+    offset: int
+        Number of iterations of the previous run.
+
+    Return
+    ------
+    int
+        Number of rows of the merged results.
+    """
+    with open(prior, 'r', newline='') as f:
+        f_reader = csv.reader(f)
+        header = next(f_reader)
+        rows = list(f_reader)
+    i_source = header.index('Initial source')
+    i_trs = header.index('Transformation ID')
+    i_iteration = header.index('Iteration')
+    initial_source = rows[0][i_source] if rows else ''
+
+    with open(path, 'r', newline='') as f:
+        f_reader = csv.DictReader(f)
+        for row in f_reader:
+            # Frontier compounds descend from the source of the previous run
+            row['Initial source'] = initial_source
+            row['Iteration'] = str(int(row['Iteration']) + offset)
+            m = TRS_ID.match(row['Transformation ID'])
+            if m is not None:
+                row['Transformation ID'] = 'TRS_{}_{}_{}'.format(
+                    m.group('source'), int(m.group('iteration')) + offset, m.group('n')
+                )
+            rows.append([row[x] for x in header])
+
+    tempf = path + '.tmp'
+    with open(tempf, 'w', newline='') as f:
+        f_writer = csv.writer(f, quoting=csv.QUOTE_ALL, lineterminator='\n')
+        f_writer.writerow(header)
+        f_writer.writerows(rows)
+    os.replace(tempf, path)
+    return len(rows)
@@ -0,0 +1,209 @@
+"""
+Early stop of a run once enough solutions, or iterations, are reached.
+
+A solution is a transformation whose products are all in the sink, which
+ends at least one pathway from the source. Solutions are counted from the
+results file while KNIME writes it, iterations from the progress events
+of KNIME (see progress.py). Once a target is reached, KNIME is stopped and
+the outputs written so far are made readable (last incomplete row
+removed, missing source-in-sink file created).
+"""
+import csv
+import os
+import time
+from logging import (
+    Logger,
+    getLogger
+)
+from typing import (
+    Callable,
+    Optional,
+    Tuple,
+)
+
+from retropath2_wrapper.Args import DEFAULTS
+from retropath2_wrapper.progress import ProgressEvent
+
+
+class EarlyStop(object):
+    """Condition polled during a KNIME run, see `Knime.call`.
+
+    Iterations are followed through the progress events, see watch().
+
+    Attributes
+    ----------
+    results: str
+        path of the results file written by the workflow
+    solutions: Optional[int]
+        stop once this number of solutions is found
+    iterations: Optional[int]
+        stop once this number of iterations is done
+    interval: float
+        minimal time between two reads of the results file, in seconds
+    reason: str
+        why the run has been stopped, empty if not stopped
+    """
+
+    def __init__(
+            self,
+            results: str,
+            solutions: Optional[int] = None,
+            iterations: Optional[int] = None,
+            interval: float = DEFAULTS['EARLY_STOP_INTERVAL'],
+            logger: Logger = getLogger(__name__),
+        ) -> None:
+        self.results = results
+        self.solutions = solutions
+        self.iterations = iterations
+        self.interval = interval
+        self.logger = logger
+        self.reason = ''
+        self.found = 0
+        self.iteration = 0
+        self._checked = 0.0
+        self._stat = None
+
+    def __repr__(self):
+        s = []
+        s.append(f"results: {self.results}")
+        s.append(f"solutions: {self.solutions}")
+        s.append(f"iterations: {self.iterations}")
+        return "\n".join(s)
+
+    SRC_IN_SINK_HEADER = ['Name', 'InChI', 'SMILES']
+
+    def __call__(self) -> bool:
+        """Tell if KNIME has to be stopped."""
+        if self.reason:
+            return True
+        if self.iterations is not None and self.iteration >= self.iterations:
+            self.reason = f'{self.iterations} iterations done'
+        elif self.solutions is not None and self.results_changed():
+            self.found = EarlyStop.count_solutions(self.results)[0]
+            if self.found >= self.solutions:
+                self.reason = f'{self.found} solutions found'
+        if self.reason:
+            self.logger.info(f'   |- Early stop: {self.reason}')
+        return bool(self.reason)
+
+    def on_progress(self, event: ProgressEvent) -> None:
+        """Progress callback following the iterations of the workflow."""
+        if event.kind == 'iteration':
+            # Iteration n starts once iteration n - 1 is done
+            self.iteration = event.iteration - 1
+
+    def watch(
+            self,
+            progress: Optional[Callable[[ProgressEvent], None]] = None,
+        ) -> Callable[[ProgressEvent], None]:
+        """Progress callback giving the events to on_progress(), then to
+        progress if any."""
+        def callback(event: ProgressEvent) -> None:
+            self.on_progress(event)
+            if progress is not None:
+                progress(event)
+        return callback
+
+    def keep_outputs(self, src_in_sink: str) -> int:
+        """Make the outputs of a stopped run readable: incomplete rows
+        of the results removed, source-in-sink file created if not
+        written yet (source not found in sink).
+
+        Parameters
+        ----------
+        src_in_sink: str
+            Path of the source-in-sink file.
+
+        Return
+        ------
+        int
+            Number of rows of results kept.
+        """
+        rows = EarlyStop.repair(self.results)
+        if not os.path.exists(src_in_sink):
+            with open(src_in_sink, 'w', newline='') as f:
+                csv.writer(f, quoting=csv.QUOTE_ALL).writerow(EarlyStop.SRC_IN_SINK_HEADER)
+        self.logger.info(f'   |- {rows} rows of results kept')
+        return rows
+
+    def results_changed(self) -> bool:
+        now = time.monotonic()
+        if now - self._checked < self.interval:
+            return False
+        self._checked = now
+        try:
+            stat = os.stat(self.results)
+        except FileNotFoundError:
+            return False
+        stat = (stat.st_size, stat.st_mtime_ns)
+        if stat == self._stat:
+            return False
+        self._stat = stat
+        return True
+
+    @classmethod
+    def count_solutions(cls, path: str) -> Tuple[int, int]:
+        """Count the transformations whose products are all in the sink.
+
+        Parameters
+        ----------
+        path: str
+            Path of a results file, possibly being written.
+
+        Return
+        ------
+        Tuple[int, int]
+            Number of solutions, number of complete rows.
+        """
+        in_sink = {}
+        rows = 0
+        try:
+            with open(path, 'r', newline='') as f:
+                f_reader = csv.reader(f)
+                header = next(f_reader, [])
+                try:
+                    i_trs = header.index('Transformation ID')
+                    i_sink = header.index('In Sink')
+                except ValueError:
+                    return 0, 0
+                for row in f_reader:
+                    if len(row) != len(header):
+                        # Row being written
+                        break
+                    rows += 1
+                    trs = row[i_trs]
+                    in_sink[trs] = in_sink.get(trs, True) and row[i_sink].strip() == '1'
+        except (FileNotFoundError, csv.Error):
+            pass
+        return sum(in_sink.values()), rows
+
+    @classmethod
+    def repair(cls, path: str) -> int:
+        """Remove the rows of a results file left incomplete by a stop.
+
+        Return
+        ------
+        int
+            Number of rows kept.
+        """
+        if not os.path.exists(path):
+            return 0
+        with open(path, 'r', newline='') as f:
+            f_reader = csv.reader(f)
+            header = next(f_reader, [])
+            rows = []
+            try:
+                for row in f_reader:
+                    if len(row) != len(header):
+                        break
+                    rows.append(row)
+            except csv.Error:
+                pass
+        tempf = path + '.tmp'
+        with open(tempf, 'w', newline='') as f:
+            f_writer = csv.writer(f, quoting=csv.QUOTE_ALL)
+            if header:
+                f_writer.writerow(header)
+            f_writer.writerows(rows)
+        os.replace(tempf, path)
+        return len(rows)
@@ -0,0 +1,612 @@
+"""
+Queue of RetroPath2.0 jobs in a folder shared by workers on many nodes.
+
+Jobs are JSON files moved between the subfolders of the queue folder:
+pending/, running/ and done/. A worker claims a job by renaming it from
+pending/ into running/, under a name holding a token of the claim, which
+succeeds for one worker only, even over NFS. While the job runs, the
+worker touches its file (heartbeat): a job whose file has not been
+touched for longer than the lease is taken back into pending/ by any
+worker, its worker being assumed dead, and is given up after a number of
+attempts. A worker whose job has been taken back stops running it. Every
+move renames the file of one claim, so that a job claimed again in the
+meantime is never taken back by a late decision. File times are compared
+with the clock of the file server, not with the clocks of the nodes.
+
+Targets are read and checked once, when they are queued, as in batch
+mode. Each job holds the options given to `submit`. Workers only bring
+KNIME (`--kinstall`) and the number of jobs they run at the same time.
+"""
+import json
+import os
+import socket
+import sys
+import threading
+import time
+from argparse import Namespace
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ThreadPoolExecutor,
+    wait,
+)
+from glob import glob
+from logging import (
+    Logger,
+    getLogger
+)
+from tempfile import TemporaryDirectory
+from typing import (
+    Dict,
+    List,
+    Optional,
+    Tuple,
+)
+from uuid import uuid4
+
+from colored import attr
+
+from brs_utils import create_logger
+
+from retropath2_wrapper.Args import (
+    DEFAULTS,
+    RETCODES,
+    build_queue_args_parser,
+)
+from retropath2_wrapper.RetroPath2 import init_knime
+from retropath2_wrapper.batch import (
+    check_sources,
+    read_sources,
+    run_job,
+    set_job_outdirs,
+)
+from retropath2_wrapper.knime import KnimePool
+from retropath2_wrapper.options import (
+    build_cache,
+    build_sink_index,
+    build_staging,
+    build_store,
+    knime_options,
+    parse_std_hydrogen,
+)
+from retropath2_wrapper.progress import ProgressLogger
+from retropath2_wrapper.sink_index import SinkIndex
+
+
+QUEUE_FILE = 'queue.json'
+STATES = ['pending', 'running', 'done']
+# Options of submit which are paths, made absolute for the workers
+PATH_ARGS = [
+    'sink_file', 'rules_file', 'source_file', 'outdir', 'cache_dir', 'staging_dir', 'store',
+    'sink_index_dir', 'resume_dir', 'workflow_cache_dir', 'knime_temp_dir',
+]
+
+
+def write_json(data: Dict, path: str) -> None:
+    """Write a file at once, readers never see it partially written."""
+    tempf = os.path.join(os.path.dirname(path), f'.{os.path.basename(path)}.{uuid4().hex}.tmp')
+    with open(tempf, 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tempf, path)
+
+
+def read_json(path: str) -> Optional[Dict]:
+    """Read a job file, None if it has been moved."""
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+class JobQueue(object):
+    """Queue of jobs in a shared folder.
+
+    Attributes
+    ----------
+    path: str
+        folder of the queue
+    lease: float
+        seconds after which a job not heartbeaten is taken back
+    max_attempts: int
+        number of times a job is run before being given up
+    """
+
+    def __init__(
+            self,
+            path: str,
+            lease: float = DEFAULTS['QUEUE_LEASE'],
+            max_attempts: int = DEFAULTS['QUEUE_ATTEMPTS'],
+        ) -> None:
+        self.path = os.path.abspath(path)
+        for state in STATES:
+            os.makedirs(os.path.join(self.path, state), exist_ok=True)
+        # Settings of the first one creating the queue, shared by all workers
+        config_file = os.path.join(self.path, QUEUE_FILE)
+        if not os.path.exists(config_file):
+            write_json({'lease': lease, 'max_attempts': max_attempts}, config_file)
+        with open(config_file, 'r') as f:
+            config = json.load(f)
+        self.lease = config['lease']
+        self.max_attempts = config['max_attempts']
+
+    def __repr__(self):
+        s = []
+        s.append(f"path: {self.path}")
+        s.append(f"lease: {self.lease}")
+        s.append(f"max_attempts: {self.max_attempts}")
+        return "\n".join(s)
+
+    def job_file(self, state: str, job_id: str, claim: str = '') -> str:
+        """Path of the file of a job, the one of a running job holding
+        the token of its claim."""
+        name = f'{job_id}.{claim}' if claim else job_id
+        return os.path.join(self.path, state, name + '.json')
+
+    def job_files(self, state: str) -> List[Tuple[str, str]]:
+        """Ids and paths of the jobs in a state, in order of submission."""
+        return sorted(
+            (os.path.basename(x).split('.')[0], x)
+            for x in glob(os.path.join(self.path, state, '*.json'))
+        )
+
+    def job_ids(self, state: str) -> List[str]:
+        return [job_id for job_id, _ in self.job_files(state)]
+
+    def read(self, state: str, job_id: str, claim: str = '') -> Optional[Dict]:
+        return read_json(self.job_file(state, job_id, claim))
+
+    def now(self) -> float:
+        """Time of the file server, to compare with file times."""
+        clock = os.path.join(self.path, '.clock')
+        with open(clock, 'a'):
+            pass
+        os.utime(clock)
+        return os.stat(clock).st_mtime
+
+    def submit(self, job: Dict) -> str:
+        """Queue a job, a dictionary which can be written as JSON. Jobs
+        having a 'r_code' already are queued as done.
+
+        Return
+        ------
+        str
+            Id of the job.
+        """
+        # Ids sort in order of submission
+        job_id = '%020d_%s' % (time.time_ns(), uuid4().hex[:8])
+        job = dict(job, id=job_id, attempts=0, submitted=time.time())
+        write_json(job, self.job_file('done' if 'r_code' in job else 'pending', job_id))
+        return job_id
+
+    def claim(self, worker: str) -> Optional[Dict]:
+        """Take the oldest pending job.
+
+        Return
+        ------
+        Optional[Dict]
+            The job, with the token of the claim ('claim'), None if no job
+            is pending.
+        """
+        for job_id in self.job_ids('pending'):
+            claim = uuid4().hex[:8]
+            running = self.job_file('running', job_id, claim)
+            # Hidden name, owned by the one who renamed it: the job is seen
+            # in running/ once claimed, with a renewed time, never expired
+            # nor taken back while being claimed
+            claiming = os.path.join(os.path.dirname(running), f'.{os.path.basename(running)}.claim')
+            try:
+                os.rename(self.job_file('pending', job_id), claiming)
+            except FileNotFoundError:
+                # Claimed by another worker
+                continue
+            job = read_json(claiming)
+            if job is None:
+                self.finish(job_id, claiming, RETCODES['OSError'])
+                continue
+            job['worker'] = worker
+            job['claim'] = claim
+            job['attempts'] += 1
+            job['claimed'] = time.time()
+            write_json(job, claiming)
+            os.rename(claiming, running)
+            return job
+        return None
+
+    def heartbeat(self, job_id: str, claim: str) -> bool:
+        """Renew the lease of a running job.
+
+        Return
+        ------
+        bool
+            False if the job has been taken back from the claim.
+
+        Raise
+        -----
+        OSError
+            If the file server can not be reached, e.g. stale NFS handle.
+        """
+        try:
+            os.utime(self.job_file('running', job_id, claim))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def complete(self, job_id: str, claim: str, r_code: int) -> bool:
+        """Move a running job into done/ with its return code.
+
+        Return
+        ------
+        bool
+            False if the job has been taken back from the claim, its
+            return code is not recorded.
+        """
+        job = self.finish(job_id, self.job_file('running', job_id, claim), r_code)
+        return job is not None
+
+    def finish(self, job_id: str, running: str, r_code: int) -> Optional[Dict]:
+        """Move the file of a running job into done/ with a return code.
+
+        Return
+        ------
+        Optional[Dict]
+            The job, None if its file has been moved by someone else.
+        """
+        # Hidden name, owned by the one who renamed it
+        finishing = os.path.join(os.path.dirname(running), f'.{os.path.basename(running)}.done')
+        try:
+            os.rename(running, finishing)
+        except FileNotFoundError:
+            return None
+        job = read_json(finishing) or {'id': job_id}
+        job['r_code'] = r_code
+        job['finished'] = time.time()
+        write_json(job, self.job_file('done', job_id))
+        os.remove(finishing)
+        return job
+
+    def requeue_expired(self, logger: Logger = getLogger(__name__)) -> List[str]:
+        """Take back the running jobs whose lease has expired, jobs which
+        have been run max_attempts times are given up (OSError).
+
+        Return
+        ------
+        List[str]
+            Ids of the jobs taken back.
+        """
+        now = self.now()
+        expired = []
+        for job_id, running in self.job_files('running'):
+            try:
+                if now - os.stat(running).st_mtime <= self.lease:
+                    continue
+            except FileNotFoundError:
+                continue
+            job = read_json(running)
+            if job is None:
+                continue
+            if job['attempts'] >= self.max_attempts:
+                if self.finish(job_id, running, RETCODES['OSError']) is not None:
+                    logger.warning(f'Job {job_id} ({job.get("name")}) given up after {job["attempts"]} attempts')
+                continue
+            try:
+                # File of this claim only, a new claim has another name
+                os.rename(running, self.job_file('pending', job_id))
+            except FileNotFoundError:
+                # Taken back by another worker
+                continue
+            logger.warning(f'Job {job_id} ({job.get("name")}) of {job.get("worker")} taken back, lease expired')
+            expired.append(job_id)
+        return expired
+
+    def status(self) -> Dict:
+        """Number of jobs in each state, and of done jobs by return code."""
+        retcodes = {}
+        for key, value in RETCODES.items():
+            retcodes.setdefault(value, key)
+        status = {state: len(self.job_ids(state)) for state in STATES}
+        done = {}
+        for job_id in self.job_ids('done'):
+            job = self.read('done', job_id)
+            if job is not None:
+                name = retcodes.get(job['r_code'], 'KNIME')
+                done[name] = done.get(name, 0) + 1
+        status['r_codes'] = done
+        status['workers'] = sorted(set(
+            x['worker'] for x in (read_json(y) for _, y in self.job_files('running'))
+            if x is not None and 'worker' in x
+        ))
+        return status
+
+
+def queue_sources(
+    queue: JobQueue,
+    args: Namespace,
+    std_hydrogen: str,
+    logger: Logger = getLogger(__name__)
+) -> Tuple[int, List[Dict]]:
+    """
+    Queue one job per target of a source file or folder, targets being
+    checked as in batch mode.
+
+    Parameters
+    ----------
+    queue : JobQueue
+        The queue.
+    args : Namespace
+        Options of the jobs, see build_queue_args_parser().
+    std_hydrogen : str
+        Standardization mode of the workflow.
+    logger : Logger
+        The logger object.
+
+    Returns
+    -------
+    Tuple[int, List[Dict]] Return code and queued jobs.
+
+    """
+    options = dict(vars(args))
+    for name in PATH_ARGS:
+        if options.get(name):
+            options[name] = os.path.abspath(options[name])
+
+    try:
+        jobs = read_sources(options['source_file'], logger)
+    except FileNotFoundError as e:
+        logger.error(e)
+        return RETCODES['FileNotFound'], []
+    with TemporaryDirectory() as tempd:
+        try:
+            # Index of the submission only, unless a folder of indexes is given
+            sink_index = SinkIndex(options['sink_file'], path=options['sink_index_dir'] or tempd, logger=logger)
+        except FileNotFoundError as e:
+            logger.error(e)
+            return RETCODES['FileNotFound'], jobs
+        except ValueError as e:
+            logger.error(e)
+            return RETCODES['SinkFileMalformed'], jobs
+        try:
+            check_sources(jobs, sink_index, logger)
+        finally:
+            sink_index.close()
+
+    os.makedirs(options['outdir'], exist_ok=True)
+    set_job_outdirs(jobs, options['outdir'])
+    for job in jobs:
+        job['std_hydrogen'] = std_hydrogen
+        job['args'] = options
+        job['id'] = queue.submit(job)
+    return RETCODES['OK'], jobs
+
+
+def run_kwargs(args: Namespace, logger: Logger = getLogger(__name__)) -> Dict:
+    """Parameters of retropath2() from the options of a job."""
+    return {
+        'max_steps': args.max_steps,
+        'topx': args.topx,
+        'dmin': args.dmin,
+        'dmax': args.dmax,
+        'mwmax_source': args.mwmax_source,
+        'msc_timeout': args.msc_timeout,
+        'cache': build_cache(args),
+        'staging': build_staging(args),
+        'store': build_store(args),
+        'prefilter_rules': args.prefilter_rules,
+        'min_rule_score': args.min_rule_score,
+        'timeout': args.timeout,
+        'cpu_timeout': args.cpu_timeout,
+        'progress': ProgressLogger(logger) if args.progress else None,
+        'stop_solutions': args.stop_solutions,
+        'stop_iterations': args.stop_iterations,
+        'columnar': args.columnar,
+        'resume_dir': args.resume_dir,
+    }
+
+
+class Worker(object):
+    """Run the jobs of a queue, a bounded number at the same time.
+
+    Attributes
+    ----------
+    queue: JobQueue
+        queue to take jobs from
+    kinstall: str
+        directory to find a KNIME executable
+    jobs: int
+        number of jobs run at the same time
+    name: str
+        name of the worker, host and process
+    """
+
+    def __init__(
+            self,
+            queue: JobQueue,
+            kinstall: str = DEFAULTS['KNIME_FOLDER'],
+            jobs: int = DEFAULTS['JOBS'],
+            name: str = '',
+        ) -> None:
+        self.queue = queue
+        self.kinstall = kinstall
+        self.jobs = jobs
+        self.name = name or f'{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:6]}'
+        self._pools = {}
+        # KNIME may be installed while pools are created, not blocking heartbeats
+        self._pool_lock = threading.Lock()
+        self._lock = threading.Lock()
+        # Claims of the jobs running, by id
+        self._running = {}
+
+    def __repr__(self):
+        s = []
+        s.append(f"name: {self.name}")
+        s.append(f"kinstall: {self.kinstall}")
+        s.append(f"jobs: {self.jobs}")
+        return "\n".join(s)
+
+    def pool(self, args: Namespace, logger: Logger = getLogger(__name__)) -> KnimePool:
+        """Pool of KNIME workspaces for the options and workflow version of a
+        job, created once."""
+        options = knime_options(args)
+        key = json.dumps([args.rp2_version, options], sort_keys=True)
+        with self._pool_lock:
+            if key not in self._pools:
+                pool = KnimePool(kinstall=self.kinstall, size=self.jobs, **options)
+                self._pools[key] = init_knime(knime=pool, rp2_version=args.rp2_version, logger=logger)
+            return self._pools[key]
+
+    def execute(self, job: Dict, logger: Logger = getLogger(__name__)) -> int:
+        """Run a job, return its return code."""
+        args = Namespace(**job['args'])
+        try:
+            knime = self.pool(args, logger)
+        except Exception as e:
+            logger.error(f'{job["name"]}: {e}')
+            return RETCODES['OSError']
+        sink_index = build_sink_index(args, logger)
+
+        def cancel() -> bool:
+            # Taken back, another worker may run it into the same folder
+            with self._lock:
+                return job['id'] not in self._running
+
+        try:
+            return run_job(
+                job=job,
+                sink_file=args.sink_file,
+                rules_file=args.rules_file,
+                std_hydrogen=job['std_hydrogen'],
+                knime=knime,
+                sink_index=sink_index,
+                cancel=cancel,
+                logger=logger,
+                **run_kwargs(args, logger)
+            )
+        finally:
+            if sink_index is not None:
+                sink_index.close()
+
+    def _heartbeat(self, stop: threading.Event, logger: Logger) -> None:
+        while not stop.wait(self.queue.lease / 5):
+            with self._lock:
+                running = list(self._running.items())
+            for job_id, claim in running:
+                try:
+                    alive = self.queue.heartbeat(job_id, claim)
+                except OSError as e:
+                    # e.g. stale NFS handle, tried again at the next beat
+                    logger.warning(f'Job {job_id}: heartbeat failed: {e}')
+                    continue
+                if not alive:
+                    logger.warning(f'Job {job_id} taken back from {self.name}, stopping it')
+                    with self._lock:
+                        self._running.pop(job_id, None)
+
+    def run(
+        self,
+        exit_when_empty: bool = False,
+        poll: float = DEFAULTS['QUEUE_POLL'],
+        logger: Logger = getLogger(__name__)
+    ) -> int:
+        """Take and run jobs until the queue is empty (exit_when_empty) or
+        forever.
+
+        Return
+        ------
+        int
+            Number of jobs run.
+        """
+        logger.info('{attr1}Worker {name} ({jobs} jobs){attr2}'.format(
+            attr1=attr('bold'), name=self.name, jobs=self.jobs, attr2=attr('reset'))
+        )
+        count = 0
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(stop, logger), daemon=True)
+        heartbeat.start()
+        futures = {}
+        try:
+            with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+                while True:
+                    self.queue.requeue_expired(logger)
+                    while len(futures) < self.jobs:
+                        job = self.queue.claim(self.name)
+                        if job is None:
+                            break
+                        logger.info(f'   |- {job["name"]}: started (attempt {job["attempts"]})')
+                        with self._lock:
+                            self._running[job['id']] = job['claim']
+                        futures[executor.submit(self.execute, job, logger)] = job
+                    if not futures:
+                        if exit_when_empty and not self.queue.job_ids('running'):
+                            break
+                        time.sleep(poll)
+                        continue
+                    done, _ = wait(futures, timeout=poll, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        job = futures.pop(future)
+                        r_code = future.result()
+                        with self._lock:
+                            self._running.pop(job['id'], None)
+                        if self.queue.complete(job['id'], job['claim'], r_code):
+                            logger.info(f'   |- {job["name"]}: done ({r_code})')
+                        count += 1
+        finally:
+            stop.set()
+            heartbeat.join()
+            for pool in self._pools.values():
+                pool.shutdown()
+        return count
+
+
+def _submit(parser, args, logger: Logger) -> int:
+    if args.source_file is None:
+        parser.error("--source_file is mandatory to queue jobs.")
+    if args.source_name is not None or args.source_inchi is not None:
+        parser.error("--source_name and --source_inchi are not compliant with the queue.")
+
+    std_hydrogen = parse_std_hydrogen(parser, args, logger)
+    queue = JobQueue(args.queue_dir, lease=args.lease, max_attempts=args.max_attempts)
+    r_code, jobs = queue_sources(queue, args, std_hydrogen, logger)
+    logger.info(f'{sum("r_code" not in x for x in jobs)} jobs queued into {queue.path}')
+    return r_code
+
+
+def _worker(parser, args, logger: Logger) -> int:
+    if args.jobs < 1:
+        parser.error("--jobs should be a positive integer.")
+    worker = Worker(JobQueue(args.queue_dir), kinstall=args.kinstall, jobs=args.jobs)
+    worker.run(exit_when_empty=args.exit_when_empty, poll=args.poll, logger=logger)
+    return RETCODES['OK']
+
+
+def _status(parser, args, logger: Logger) -> int:
+    print(json.dumps(JobQueue(args.queue_dir).status(), indent=2))
+    return RETCODES['OK']
+
+
+def _requeue(parser, args, logger: Logger) -> int:
+    expired = JobQueue(args.queue_dir).requeue_expired(logger)
+    print(f'{len(expired)} jobs taken back')
+    return RETCODES['OK']
+
+
+def _cli():
+    parser = build_queue_args_parser()
+    args = parser.parse_args()
+
+    if args.log.lower() in ['silent', 'quiet'] or getattr(args, 'silent', False):
+        args.log = 'CRITICAL'
+
+    # Create logger
+    logger = create_logger(parser.prog, args.log)
+    logger.debug('args: ' + str(args))
+
+    func = {
+        'submit': _submit,
+        'worker': _worker,
+        'status': _status,
+        'requeue': _requeue,
+    }[args.command]
+    return func(parser, args, logger)
+
+
+if __name__ == '__main__':
+    sys.exit(_cli())
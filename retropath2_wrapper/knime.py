@@ -0,0 +1,1506 @@
+import argparse
+import asyncio
+import copy
+import glob
+import hashlib
+import json
+import os
+import queue
+import re
+import signal
+from zipfile import ZipFile
+import requests
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from pathlib import Path
+from getpass import getuser
+from logging import (
+    getLogger,
+    Logger,
+)
+from typing import Any, Callable, Dict, List, Optional
+from colored import attr
+from typing import Set
+from subprocess import PIPE as sp_PIPE
+from concurrent.futures import (
+    Future,
+    ThreadPoolExecutor,
+)
+
+from brs_utils  import (
+    extract_tar_gz,
+    download,
+    chown_r,
+    subprocess_call,
+    unzip
+)
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from retropath2_wrapper.Args import (
+    DEFAULTS,
+    RETCODES,
+)
+from retropath2_wrapper.preference import Preference
+from retropath2_wrapper.progress import (
+    ProgressEvent,
+    ProgressParser,
+)
+from retropath2_wrapper.report import (
+    count_rows,
+    resource_usage,
+)
+
+
+class Knime(object):
+    """Knime is useful to install executable, install packages or commandline.
+    http://download.knime.org/analytics-platform/
+
+    Attributes
+    ----------
+    kinstall: str
+        directory to found a "knime" executable
+    workflow: str
+        path of the Knime workflow
+    workspace: str
+        directory used as KNIME workspace (-data), default one if empty
+    workflow_cache: str
+        directory where workflows are extracted once and cloned for each
+        run (-workflowDir), the archive is given to KNIME if empty
+    jvm_heap: str
+        maximal heap of the JVM (e.g. "8g"), "auto" to size it from the
+        inputs and the available memory, the one of knime.ini if empty
+    jvm_gc: str
+        garbage collector of the JVM (one of JVM_GCS), default one if empty
+    jvm_gc_log: bool
+        write the GC log of the JVM into the output folder
+    max_threads: str
+        maximal number of threads of KNIME, 'auto' to share the CPUs
+        between concurrent runs, the one of KNIME if empty
+    temp_dir: str
+        directory of the temporary files of KNIME, the one of KNIME if empty
+    table_cache: str
+        tables kept in memory (one of Preference.TABLE_CACHES), 'auto' to
+        choose from the memory of each concurrent run, KNIME's if empty
+    cells_in_memory: int
+        tables with less cells are kept in memory, KNIME's if 0
+    """
+    ZENODO_API = "https://zenodo.org/api/"
+    ZENODO = {
+        "4.6.4": "7515771",
+        "4.7.0": "7564938",
+    }
+    DEFAULT_VERSION = "4.6.4"
+    MANIFEST = ".rp2_knime.json"
+    JVM_GCS = {
+        "G1": "-XX:+UseG1GC",
+        "Parallel": "-XX:+UseParallelGC",
+        "Serial": "-XX:+UseSerialGC",
+        "Shenandoah": "-XX:+UseShenandoahGC",
+        "Z": "-XX:+UseZGC",
+    }
+    JVM_GC_LOG = "knime_gc.log"
+    KILL_GRACE = 30  # seconds between SIGTERM and SIGKILL
+    # Heap estimate of the auto mode, in MB
+    JVM_HEAP_BASE = 1024
+    JVM_HEAP_MIN = 512
+    JVM_HEAP_PER_RULE = 8 / 1024
+    JVM_HEAP_PER_SINK = 2 / 1024
+    # Options of the runs given to KNIME as preferences
+    PREFERENCES = ["max_threads", "temp_dir", "table_cache", "cells_in_memory"]
+    PLUGINS = [
+        "org.eclipse.equinox.preferences",
+        "org.knime.chem.base",
+        "org.knime.datageneration",
+        "org.knime.features.chem.types.feature.group",
+        "org.knime.features.datageneration.feature.group",
+        "org.knime.features.python.feature.group",
+        "org.knime.python.nodes",
+        "org.rdkit.knime.feature.feature.group",
+        "org.rdkit.knime.nodes",
+    ]
+
+    def __init__(
+            self,
+            kinstall: str = DEFAULTS['KNIME_FOLDER'],
+            workflow: str = "",
+            workspace: str = "",
+            workflow_cache: str = "",
+            jvm_heap: str = "",
+            jvm_gc: str = "",
+            jvm_gc_log: bool = False,
+            max_threads: str = "",
+            temp_dir: str = "",
+            table_cache: str = "",
+            cells_in_memory: int = 0,
+        ) -> None:
+        if jvm_heap and jvm_heap != "auto" and not re.match(r"^\d+[kKmMgG]?$", jvm_heap):
+            raise ValueError(f"JVM heap should be a size (e.g. 8g) or 'auto': {jvm_heap}")
+        if jvm_gc and jvm_gc not in Knime.JVM_GCS:
+            raise ValueError(f"JVM garbage collector should be one of {', '.join(Knime.JVM_GCS)}: {jvm_gc}")
+        self.kinstall = kinstall
+        self.workflow = workflow
+        self.workspace = workspace
+        self.workflow_cache = workflow_cache
+        self.jvm_heap = jvm_heap
+        self.jvm_gc = jvm_gc
+        self.jvm_gc_log = jvm_gc_log
+        Preference.check(max_threads=max_threads or None, table_cache=table_cache or None)
+        self.max_threads = str(max_threads)
+        self.temp_dir = temp_dir
+        self.table_cache = table_cache
+        self.cells_in_memory = cells_in_memory
+        self.kexec = Knime.find_executable(path=self.kinstall)
+
+    def __repr__(self):
+        s = []
+        s.append(f"workflow: {self.workflow}")
+        s.append(f"kinstall: {self.kinstall}")
+        s.append(f"kexec: {self.kexec}")
+        if self.workspace:
+            s.append(f"workspace: {self.workspace}")
+        if self.workflow_cache:
+            s.append(f"workflow_cache: {self.workflow_cache}")
+        if self.jvm_heap:
+            s.append(f"jvm_heap: {self.jvm_heap}")
+        if self.jvm_gc:
+            s.append(f"jvm_gc: {self.jvm_gc}")
+        for name in Knime.PREFERENCES:
+            if getattr(self, name):
+                s.append(f"{name}: {getattr(self, name)}")
+        return "\n".join(s)
+
+    def options(self) -> Dict[str, Any]:
+        """Options of the runs, to build another Knime object running
+        workflows the same way.
+
+        Return
+        ------
+        Dict[str, Any]
+        """
+        return {
+            "workflow_cache": self.workflow_cache,
+            "jvm_heap": self.jvm_heap,
+            "jvm_gc": self.jvm_gc,
+            "jvm_gc_log": self.jvm_gc_log,
+            "max_threads": self.max_threads,
+            "temp_dir": self.temp_dir,
+            "table_cache": self.table_cache,
+            "cells_in_memory": self.cells_in_memory,
+        }
+
+    def concurrency(self) -> int:
+        """Number of workflows run at the same time by this object."""
+        return 1
+
+    @classmethod
+    def zenodo_show_repo(cls, kver: str) -> Dict[str, Any]:
+        """Show Zenodo repository informations.
+
+        Return
+        ------
+        Dict[str, Any]
+        """
+        
+        kzenodo_id = Knime.ZENODO[kver]
+        url = urllib.parse.urljoin(
+            Knime.ZENODO_API, f"records/{kzenodo_id}"
+        )
+        r = requests.get(url)
+        if r.status_code > 202:
+            raise ValueError(r.text)
+        return r.json()
+
+    @classmethod
+    def standardize_path(cls, path: str) -> str:
+        """Path are given with double backslashes on windows.
+        Knime needs a path with simple slash in commandline.
+
+        Parameters
+        ----------
+        path: str
+            a path
+
+        Return
+        ------
+        str
+        """
+        if sys.platform == 'win32':
+            path = "/".join(path.split(os.sep))
+        return path
+
+    @classmethod
+    def build_env(cls) -> Dict[str, str]:
+        """Build the environment of the KNIME subprocess.
+        The environment of the current process is left untouched
+        so that several workflows can be launched concurrently.
+
+        Return
+        ------
+        Dict[str, str]
+        """
+        env = os.environ.copy()
+        # Hack to link libGraphMolWrap.so (RDKit) against libfreetype.so.6 (from conda)
+        if "CONDA_PREFIX" in env:
+            extra = [
+                os.path.join(env["CONDA_PREFIX"], "lib"),
+                os.path.join(env["CONDA_PREFIX"], "x86_64-conda-linux-gnu/sysroot/usr/lib64"),
+            ]
+            env["LD_LIBRARY_PATH"] = ":".join(filter(None, [env.get("LD_LIBRARY_PATH"), *extra]))
+        return env
+
+    @classmethod
+    def extract_workflow(cls, workflow: str, path: str) -> str:
+        """Extract a workflow archive (.knwf) once into a cache folder.
+
+        Parameters
+        ----------
+        workflow: str
+            Path of the workflow archive.
+        path: str
+            Cache folder, one subfolder per workflow version and content.
+
+        Return
+        ------
+        str
+            Path of the workflow folder (the one holding workflow.knime).
+        """
+        h = hashlib.sha256()
+        with open(workflow, "rb") as fid:
+            for chunk in iter(lambda: fid.read(1 << 20), b""):
+                h.update(chunk)
+        name = os.path.splitext(os.path.basename(workflow))[0]
+        extracted = os.path.join(path, f"{name}-{h.hexdigest()[:16]}")
+
+        if not os.path.isdir(extracted):
+            os.makedirs(path, exist_ok=True)
+            # Extracted aside then moved, concurrent runs never see partial workflows
+            tempd = tempfile.mkdtemp(dir=path, prefix=".tmp_")
+            try:
+                with ZipFile(workflow) as zf:
+                    zf.extractall(tempd)
+                os.rename(tempd, extracted)
+            except OSError:
+                # Extracted by a concurrent run
+                shutil.rmtree(tempd, ignore_errors=True)
+                if not os.path.isdir(extracted):
+                    raise
+
+        # Shallowest folder holding a workflow.knime
+        found = sorted(
+            glob.glob(os.path.join(extracted, "**", "workflow.knime"), recursive=True),
+            key=lambda x: x.count(os.sep),
+        )
+        if found == []:
+            raise FileNotFoundError(f"No workflow.knime found in {workflow}")
+        return os.path.dirname(found[0])
+
+    @classmethod
+    def clone_file(cls, src: str, dst: str) -> None:
+        """Copy a file, sharing data blocks with src (copy-on-write)
+        where the filesystem supports it."""
+        try:
+            with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+                size = os.fstat(fsrc.fileno()).st_size
+                while size > 0:
+                    n = os.copy_file_range(fsrc.fileno(), fdst.fileno(), size)
+                    if n == 0:
+                        break
+                    size -= n
+            shutil.copystat(src, dst)
+        except (AttributeError, OSError):
+            shutil.copy2(src, dst)
+
+    def clone_workflow(self) -> str:
+        """Extract the workflow into the workflow cache if needed, then
+        clone it for a run, KNIME writing into the workflow folder.
+
+        Return
+        ------
+        str
+            Path of the cloned workflow folder, to remove after the run.
+        """
+        extracted = Knime.extract_workflow(
+            workflow=self.workflow,
+            path=self.workflow_cache,
+        )
+        jobs = os.path.join(self.workflow_cache, ".jobs")
+        os.makedirs(jobs, exist_ok=True)
+        clone = tempfile.mkdtemp(dir=jobs)
+        workflow_dir = os.path.join(clone, os.path.basename(extracted))
+        shutil.copytree(extracted, workflow_dir, copy_function=Knime.clone_file)
+        return workflow_dir
+
+    @classmethod
+    def available_memory(cls) -> int:
+        """Memory available for new processes, within the limit of the
+        cgroup if any, in bytes (0 if unknown).
+
+        Return
+        ------
+        int
+        """
+        sizes = []
+        try:
+            with open("/proc/meminfo", "r") as fid:
+                for line in fid:
+                    if line.startswith("MemAvailable:"):
+                        sizes.append(int(line.split()[1]) * 1024)
+                        break
+        except (OSError, ValueError, IndexError):
+            pass
+        if sizes == []:
+            try:
+                sizes.append(os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE"))
+            except (AttributeError, ValueError, OSError):
+                pass
+        # Limit of the job on clusters or containers (cgroup v2, then v1)
+        for limit, usage in [
+            ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory.current"),
+            ("/sys/fs/cgroup/memory/memory.limit_in_bytes", "/sys/fs/cgroup/memory/memory.usage_in_bytes"),
+        ]:
+            try:
+                with open(limit, "r") as fid:
+                    max_size = int(fid.read().strip())
+                with open(usage, "r") as fid:
+                    sizes.append(max_size - int(fid.read().strip()))
+                break
+            except (OSError, ValueError):
+                continue
+        sizes = [x for x in sizes if x > 0]
+        return min(sizes) if sizes else 0
+
+    @classmethod
+    def available_cpus(cls) -> int:
+        """CPUs this process may run on, within the quota of the cgroup if
+        any (0 if unknown).
+
+        Return
+        ------
+        int
+        """
+        try:
+            cpus = len(os.sched_getaffinity(0))
+        except AttributeError:
+            cpus = os.cpu_count() or 0
+        # Quota of the job on clusters or containers (cgroup v2, then v1)
+        for quota, period in [
+            ("/sys/fs/cgroup/cpu.max", None),
+            ("/sys/fs/cgroup/cpu/cpu.cfs_quota_us", "/sys/fs/cgroup/cpu/cpu.cfs_period_us"),
+        ]:
+            try:
+                with open(quota, "r") as fid:
+                    values = fid.read().split()
+                if period is not None:
+                    with open(period, "r") as fid:
+                        values += fid.read().split()
+                if values[0] in ["max", "-1"]:
+                    break
+                limit = max(1, int(values[0]) // int(values[1]))
+                cpus = min(cpus, limit) if cpus else limit
+                break
+            except (OSError, ValueError, IndexError, ZeroDivisionError):
+                continue
+        return cpus
+
+    def run_preference(self, preference: Optional[Preference]) -> Preference:
+        """Preferences of a run, completed with the options of this object,
+        'auto' settings being shared between concurrent runs.
+
+        Parameters
+        ----------
+        preference: Optional[Preference]
+            Preferences of the run, which take precedence.
+
+        Return
+        ------
+        Preference
+        """
+        if preference is None:
+            preference = Preference()
+        options = {}
+        for name in Knime.PREFERENCES:
+            options[name] = getattr(preference, name) or getattr(self, name) or None
+        return Preference(
+            path=preference.path,
+            rdkit_timeout_minutes=preference.rdkit_timeout_minutes,
+            **options,
+        ).for_jobs(
+            jobs=self.concurrency(),
+            cpus=Knime.available_cpus() if options["max_threads"] == "auto" else 0,
+            memory=Knime.available_memory() if options["table_cache"] == "auto" else 0,
+        )
+
+    @classmethod
+    def auto_heap(
+        cls,
+        files: Dict,
+        params: Dict,
+        jobs: int = 1,
+        logger: Logger = getLogger(__name__),
+    ) -> int:
+        """Size the heap of the JVM from the number of rules and sink
+        compounds, bounded by the memory available to each concurrent job.
+
+        Parameters
+        ----------
+        files: Dict
+            Paths of sink, rules files.
+        params: Dict
+            Parameters of the workflow (max_steps).
+        jobs: int
+            Number of workflows run at the same time.
+        logger : Logger
+            The logger object.
+
+        Return
+        ------
+        int
+            Heap size, in MB.
+        """
+        n_rules = count_rows(files["rules"])
+        n_sink = count_rows(files["sink"])
+        # Intermediate tables grow with the number of iterations
+        factor = max(1, params.get("max_steps", 3) / 3)
+        heap = cls.JVM_HEAP_BASE + factor * (
+            n_rules * cls.JVM_HEAP_PER_RULE + n_sink * cls.JVM_HEAP_PER_SINK
+        )
+        available = cls.available_memory()
+        if available:
+            # Leave room for the JVM off-heap memory and the system
+            heap = min(heap, 0.8 * available / 1024 ** 2 / max(1, jobs))
+        heap = max(cls.JVM_HEAP_MIN, int(heap))
+        logger.debug(
+            f"JVM heap: {heap} MB ({n_rules} rules, {n_sink} sink compounds, "
+            f"{available // 1024 ** 2} MB available, {jobs} jobs)"
+        )
+        return heap
+
+    def jvm_args(
+        self,
+        files: Dict,
+        params: Dict,
+        preference: Optional[Preference] = None,
+        logger: Logger = getLogger(__name__),
+    ) -> List[str]:
+        """Build the JVM options of a run, to be given last on the command line.
+
+        Parameters
+        ----------
+        files: Dict
+            Paths of sink, rules files and output folder.
+        params: Dict
+            Parameters of the workflow to process.
+        preference: Optional[Preference]
+            Preferences of the run, for the properties of the table backend.
+        logger : Logger
+            The logger object.
+
+        Return
+        ------
+        List[str]
+        """
+        args = []
+        if self.jvm_heap == "auto":
+            heap = Knime.auto_heap(files=files, params=params, jobs=self.concurrency(), logger=logger)
+            args += [f"-Xmx{heap}m"]
+        elif self.jvm_heap:
+            args += [f"-Xmx{self.jvm_heap}"]
+        if self.jvm_gc:
+            args += [Knime.JVM_GCS[self.jvm_gc]]
+        if self.jvm_gc_log:
+            gc_log = self.standardize_path(os.path.join(files["outdir"], Knime.JVM_GC_LOG))
+            args += [f"-Xlog:gc*:file={gc_log}:time,uptime"]
+        if preference is not None:
+            args += preference.vmargs()
+        if args == []:
+            return []
+        # Options of knime.ini are kept, later ones take precedence
+        return ["--launcher.appendVmargs", "-vmargs"] + args
+
+    @classmethod
+    def limit_cpu(
+        cls,
+        pid: int,
+        seconds: float,
+        logger: Logger = getLogger(__name__),
+    ) -> bool:
+        """Bound the CPU time of a process (all threads of the JVM), which
+        receives SIGXCPU then SIGKILL after KILL_GRACE seconds more.
+
+        Return
+        ------
+        bool
+            False if not supported on this platform.
+        """
+        if resource is None or not hasattr(resource, "prlimit"):
+            logger.warning("CPU time budget is not supported on this platform")
+            return False
+        soft = max(1, int(seconds))
+        resource.prlimit(pid, resource.RLIMIT_CPU, (soft, soft + cls.KILL_GRACE))
+        # No core dump of the JVM when killed
+        resource.prlimit(pid, resource.RLIMIT_CORE, (0, 0))
+        return True
+
+    @classmethod
+    def wait(
+        cls,
+        proc: subprocess.Popen,
+        timeout: Optional[float] = None,
+        stop: Optional[Callable[[], bool]] = None,
+    ) -> Optional[Any]:
+        """Wait for a process, as Popen.wait(), and collect its resource
+        usage where os.wait4() is available.
+
+        Parameters
+        ----------
+        proc: subprocess.Popen
+            Process to wait for, proc.returncode is set at its end.
+        timeout: Optional[float]
+            Maximal time to wait, in seconds.
+        stop: Optional[Callable[[], bool]]
+            Polled while waiting, stop waiting once it returns True, the
+            process still running (proc.returncode is None).
+
+        Return
+        ------
+        Optional[Any]
+            Resource usage of the process (see resource.getrusage), None if
+            not available.
+
+        Raise
+        -----
+        subprocess.TimeoutExpired
+        """
+        polling = timeout is not None or stop is not None
+        if not hasattr(os, "wait4") and not polling:
+            proc.wait()
+            return None
+        deadline = None if timeout is None else time.monotonic() + timeout
+        delay = 0.05
+        while True:
+            if hasattr(os, "wait4"):
+                pid, status, rusage = os.wait4(proc.pid, os.WNOHANG if polling else 0)
+                if pid == proc.pid:
+                    proc.returncode = os.waitstatus_to_exitcode(status)
+                    return rusage
+            elif proc.poll() is not None:
+                return None
+            if stop is not None and stop():
+                return None
+            remaining = 1 if deadline is None else deadline - time.monotonic()
+            if remaining <= 0:
+                raise subprocess.TimeoutExpired(proc.args, timeout)
+            time.sleep(min(delay, remaining))
+            delay = min(2 * delay, 1)
+
+    @classmethod
+    async def await_exit(
+        cls,
+        proc: asyncio.subprocess.Process,
+        timeout: Optional[float] = None,
+        stop: Optional[Callable[[], bool]] = None,
+    ) -> Optional[int]:
+        """Asyncio counterpart of `Knime.wait`, stop() being run in a
+        thread.
+
+        Return
+        ------
+        Optional[int]
+            Return code of the process, None if stopped while running.
+
+        Raise
+        -----
+        asyncio.TimeoutError
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+            if stop is not None:
+                remaining = 1 if remaining is None else min(remaining, 1)
+            try:
+                return await asyncio.wait_for(proc.wait(), timeout=remaining)
+            except asyncio.TimeoutError:
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise
+            # Timer may fire just before the deadline
+            if stop is not None and await asyncio.to_thread(stop):
+                return None
+
+    @classmethod
+    def signal_group(cls, proc: Any, sig: int) -> None:
+        """Send a signal to a process started in its own session and to the
+        processes it started, or to the process only if not possible.
+
+        Parameters
+        ----------
+        proc: Any
+            subprocess.Popen or asyncio.subprocess.Process.
+        sig: int
+            Signal to send.
+        """
+        try:
+            if os.name == "posix":
+                os.killpg(proc.pid, sig)
+                return
+        except (ProcessLookupError, PermissionError):
+            # Not a process group leader, or group already gone
+            pass
+        try:
+            proc.send_signal(sig)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    @classmethod
+    def terminate(
+        cls,
+        proc: subprocess.Popen,
+        grace: float = KILL_GRACE,
+        logger: Logger = getLogger(__name__),
+    ) -> None:
+        """Stop a process and the processes it started, SIGTERM first,
+        SIGKILL if still running after grace seconds.
+
+        Parameters
+        ----------
+        proc: subprocess.Popen
+            Process started in its own session (process group).
+        grace: float
+            Time given to the processes to stop, in seconds.
+        logger : Logger
+            The logger object.
+        """
+        cls.signal_group(proc, signal.SIGTERM)
+        try:
+            proc.wait(timeout=grace)
+        except subprocess.TimeoutExpired:
+            logger.warning(f"KNIME still running {grace}s after SIGTERM, killing it")
+        # Kill what is left, the JVM or processes started by the workflow
+        cls.signal_group(proc, getattr(signal, "SIGKILL", signal.SIGTERM))
+        proc.wait()
+
+    @classmethod
+    async def aterminate(
+        cls,
+        proc: asyncio.subprocess.Process,
+        grace: float = KILL_GRACE,
+        logger: Logger = getLogger(__name__),
+    ) -> None:
+        """Asyncio counterpart of `Knime.terminate`."""
+        cls.signal_group(proc, signal.SIGTERM)
+        try:
+            await asyncio.wait_for(proc.wait(), timeout=grace)
+        except asyncio.TimeoutError:
+            logger.warning(f"KNIME still running {grace}s after SIGTERM, killing it")
+        cls.signal_group(proc, getattr(signal, "SIGKILL", signal.SIGTERM))
+        await proc.wait()
+
+    @classmethod
+    def read_manifest(cls, path: str) -> Dict[str, str]:
+        """Read the paths recorded in the manifest of a KNIME install.
+
+        Return
+        ------
+        Dict[str, str]
+        """
+        try:
+            with open(os.path.join(path, Knime.MANIFEST), "r") as fid:
+                manifest = json.load(fid)
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(manifest, dict):
+            return {}
+        return manifest
+
+    @classmethod
+    def write_manifest(cls, path: str, **entries: str) -> None:
+        """Record paths found in a KNIME install, so that later lookups
+        do not walk the install again. Best effort: the install may be
+        read-only."""
+        manifest = Knime.read_manifest(path=path)
+        manifest.update(entries)
+        try:
+            fd, tempf = tempfile.mkstemp(dir=path, suffix=".tmp")
+            with os.fdopen(fd, "w") as fod:
+                json.dump(manifest, fod)
+            os.replace(tempf, os.path.join(path, Knime.MANIFEST))
+        except OSError:
+            pass
+
+    @classmethod
+    def find_executable(cls, path: str) -> str:
+        kexec = Knime.read_manifest(path=path).get("kexec", "")
+        if kexec and os.path.isfile(kexec) and os.access(kexec, os.X_OK):
+            return kexec
+        for root, _, files in os.walk(path):
+            for file in files:
+                path_file = os.path.join(root, file)
+                if os.access(path_file, os.X_OK) and os.path.isfile(path_file):
+                    if "knime" in os.path.basename(file.lower()):
+                        kexec = os.path.abspath(path_file)
+                        Knime.write_manifest(path=path, kexec=kexec)
+                        return kexec
+        return ""
+
+    @classmethod
+    def find_p2_dir(cls, path: str) -> str:
+        p2_dir = Knime.read_manifest(path=path).get("p2_dir", "")
+        if p2_dir and os.path.isdir(p2_dir):
+            return p2_dir
+        for dirpath, dirnames, _ in os.walk(path):
+            if "p2" in dirnames:
+                p2_dir = os.path.abspath(os.path.join(dirpath, "p2"))
+                Knime.write_manifest(path=path, p2_dir=p2_dir)
+                return p2_dir
+        return ""
+
+    @classmethod
+    def collect_top_level_dirs(cls, path) -> Set:
+        root = Path(path)
+        names = set()
+        for p in root.iterdir():
+            if p.is_dir():
+                names.add(p.name)
+        return names
+
+    @classmethod
+    def download_from_zenodo(cls, path: str, kver: str, logger: Logger = getLogger(__name__)):
+        """
+        Download files from a Zenodo repository
+
+        Parameters
+        ----------
+        path: str
+            An empty directory where files will be downloaded
+        kver: str
+            4.6.4 or 4.7.0
+        """
+        data = Knime.zenodo_show_repo(kver=kver)
+        if sys.platform == "win32" or sys.platform == "linux":
+            platform_tag = sys.platform
+        elif sys.platform == "darwin":
+            platform_tag = "macosx"
+        else:
+            raise RuntimeError(f"Platform {sys.platform} not supported for KNIME installation")
+        for file in data["files"]:
+            basename = file["key"]
+            if platform_tag in basename:
+                url = file["links"]["self"]
+                foutput = os.path.join(path, basename)
+                logger.info(f"Download: {url} to {foutput}")
+                download(url, foutput)
+                break
+
+    def install(self, path: str, logger: Logger = getLogger(__name__)) -> bool:
+        """
+        Install KNIME and required plugins (headless mode).
+        """
+
+        knime_files = glob.glob(os.path.join(path, "*"))
+
+        # ---------------------------------------------------------
+        # 1) Extract KNIME base installation
+        # ---------------------------------------------------------
+        dirs_before = Knime.collect_top_level_dirs(path=self.kinstall)
+        for file in knime_files:
+            basename = os.path.basename(file)
+
+            # Linux
+            if "linux" in basename and sys.platform == "linux":
+                extract_tar_gz(file, self.kinstall)
+                chown_r(self.kinstall, getuser())
+                break
+
+            # macOS
+            elif "macosx" in basename and sys.platform == "darwin":
+                match = re.search(r"\d+\.\d+\.\d+", basename)
+                if not match:
+                    raise ValueError(f"Could not determine version from filename: {file}")
+                kver = match.group()
+
+                app_path = f"{self.kinstall}/KNIME_{kver}.app"
+                if os.path.exists(app_path):
+                    shutil.rmtree(app_path)
+
+                with tempfile.TemporaryDirectory() as tempd:
+                    cmd = f'hdiutil mount -noverify {file} -mountpoint {tempd}/KNIME'
+                    subprocess_call(cmd, logger=logger)
+                    shutil.copytree(
+                        f'{tempd}/KNIME/KNIME {kver}.app',
+                        app_path
+                    )
+                    cmd = f'hdiutil unmount {tempd}/KNIME'
+                    subprocess_call(cmd, logger=logger)
+                break
+
+            # Windows
+            elif "win32" in basename and sys.platform == "win32":
+                unzip(file, self.kinstall)
+                break
+
+        dirs_after = Knime.collect_top_level_dirs(path=self.kinstall)
+        dirs_only_after = dirs_after - dirs_before
+        assert len(dirs_only_after) == 1, f"New directory not unique: {dirs_only_after}"
+
+        knime_root = os.path.abspath(os.path.join(self.kinstall, dirs_only_after.pop()))
+
+        # ---------------------------------------------------------
+        # 2) Collect local plugin repositories (ZIPs from Zenodo)
+        # ---------------------------------------------------------
+        local_repos = []
+        for file in knime_files:
+            basename = os.path.basename(file)
+            if ("org.knime.update" in basename or 
+                "TrustedCommunity" in basename or
+                "chemistry" in basename.lower()):  # allow offline chemistry repo ZIP too
+                local_repos.append(f"jar:file:{os.path.abspath(file)}!/")
+
+        # ---------------------------------------------------------
+        # 3) Add online repositories (required for chemistry & RDKit)
+        # ---------------------------------------------------------
+        online_repos = [
+            "https://update.knime.com/analytics-platform/4.6/",
+            "https://update.knime.com/analytics-platform/4.6/chemistry/",
+            # optional but useful:
+            "https://update.knime.com/community-contributions/trusted/4.6/"
+        ]
+
+        all_repos = local_repos + online_repos
+
+        # ---------------------------------------------------------
+        # 4) Run p2 director to install plugins
+        # ---------------------------------------------------------
+        # Paths recorded before this installation are outdated
+        try:
+            os.remove(os.path.join(self.kinstall, Knime.MANIFEST))
+        except OSError:
+            pass
+        self.kexec = Knime.find_executable(path=self.kinstall)
+        p2_dir = Knime.find_p2_dir(path=self.kinstall)
+
+        if not self.kexec:
+            raise FileNotFoundError(f"KNIME executable not found under {self.kinstall}")
+        if not p2_dir:
+            raise RuntimeError("p2 directory not found after installation.")
+
+        args = [
+            self.kexec,
+            "-nosplash",
+            "-consoleLog",
+            "-application", "org.eclipse.equinox.p2.director",
+            "-repository", ",".join(all_repos),
+            "-bundlepool", p2_dir,
+            "-destination", knime_root,
+            "-i", ",".join(Knime.PLUGINS)
+        ]
+
+        logger.info("Command line to install KNIME plugins:")
+        logger.info(" ".join(args))
+
+        CPE = subprocess.run(args)
+        logger.debug(CPE)
+
+        return True
+
+    def build_args(
+        self,
+        files: Dict,
+        params: Dict,
+        preference: Preference,
+        workspace: Optional[str] = None,
+        workflow_dir: str = "",
+        logger: Logger = getLogger(__name__),
+    ) -> List[str]:
+        """Build the command line of a run.
+
+        Parameters
+        ----------
+        files: Dict
+            Paths of sink, source, rules files.
+        params: Dict
+            Parameters of the workflow to process.
+        preference: Preference
+            A preference object.
+        workspace: Optional[str]
+            KNIME workspace to use instead of Knime.workspace.
+        workflow_dir: str
+            Extracted workflow to run instead of the Knime.workflow archive.
+        logger : Logger
+            The logger object.
+
+        Return
+        ------
+        List[str]
+        """
+        args = [self.kexec]
+        args += ["-nosplash"]
+        args += ["-nosave"]
+        args += ["-reset"]
+        args += ["-consoleLog"]
+        args += ["--launcher.suppressErrors"]
+        if workspace is None:
+            workspace = self.workspace
+        if workspace:
+            args += ["-data", self.standardize_path(workspace)]
+        args += ["-application", "org.knime.product.KNIME_BATCH_APPLICATION"]
+        if workflow_dir:
+            args += ["-workflowDir=%s" % (self.standardize_path(path=workflow_dir),)]
+        else:
+            args += ["-workflowFile=%s" % (self.standardize_path(path=self.workflow),)]
+
+        args += ['-workflow.variable=input.dmin,"%s",int' % (params['dmin'],)]
+        args += ['-workflow.variable=input.dmax,"%s",int' % (params['dmax'],)]
+        args += ['-workflow.variable=input.max-steps,"%s",int' % (params['max_steps'],)]
+        args += ['-workflow.variable=input.topx,"%s",int' % (params['topx'],)]
+        args += ['-workflow.variable=input.mwmax-source,"%s",int' % (params['mwmax_source'],)]
+
+        args += ['-workflow.variable=input.sourcefile,"%s",String' % (self.standardize_path(files['source']),)]
+        args += ['-workflow.variable=input.sinkfile,"%s",String' % (self.standardize_path(files['sink']),)]
+        args += ['-workflow.variable=input.rulesfile,"%s",String' % (self.standardize_path(files['rules']),)]
+        args += ['-workflow.variable=output.dir,"%s",String' % (self.standardize_path(files['outdir']),)]
+        args += ['-workflow.variable=output.solutionfile,"%s",String' % (self.standardize_path(files['results']),)]
+        args += ['-workflow.variable=output.sourceinsinkfile,"%s",String' % (self.standardize_path(files['src-in-sk']),)]
+        args += ['-workflow.variable=input.std_mode,"%s",String' % (params["std_hydrogen"],)]
+        preference = self.run_preference(preference)
+        if preference.is_init():
+            preference.to_file()
+            args += ["-preferences=" + self.standardize_path(preference.path)]
+        # Everything after -vmargs is given to the JVM
+        args += self.jvm_args(files=files, params=params, preference=preference, logger=logger)
+        return args
+
+    @classmethod
+    def cpu_exceeded(
+        cls,
+        returncode: int,
+        cpu_timeout: Optional[float],
+        cpu_time: Optional[float] = None,
+        elapsed: Optional[float] = None,
+    ) -> bool:
+        """Tell if a process has been killed for exceeding its CPU time budget.
+
+        SIGXCPU is only sent by the CPU time limit, SIGKILL by anyone (e.g.
+        the OOM killer): it is put down to the limit only if the process has
+        used its budget, measured (cpu_time) or at least possible within
+        the elapsed time on the available CPUs if not measured.
+
+        Parameters
+        ----------
+        returncode: int
+            Return code of the process.
+        cpu_timeout: Optional[float]
+            CPU time budget, in minutes.
+        cpu_time: Optional[float]
+            User and system CPU time of the process, in seconds.
+        elapsed: Optional[float]
+            Wall-clock time of the process, in seconds.
+
+        Return
+        ------
+        bool
+        """
+        if not cpu_timeout or returncode is None:
+            return False
+        if -returncode == getattr(signal, "SIGXCPU", None):
+            return True
+        if -returncode != getattr(signal, "SIGKILL", None):
+            return False
+        # Budget as set by limit_cpu()
+        budget = max(1, int(cpu_timeout * 60))
+        if cpu_time is not None:
+            return cpu_time >= budget
+        if elapsed is not None:
+            return elapsed * max(1, cls.available_cpus()) >= budget
+        return False
+
+    def call(
+        self,
+        files: Dict,
+        params: Dict,
+        preference: Preference,
+        logger: Logger = getLogger(__name__),
+        workspace: Optional[str] = None,
+        timeout: Optional[float] = None,
+        cpu_timeout: Optional[float] = None,
+        usage: Optional[Dict] = None,
+        progress: Optional[Callable[[ProgressEvent], None]] = None,
+        stop: Optional[Callable[[], bool]] = None,
+    ) -> int:
+        """Run Knime workflow.
+
+        Parameters
+        ----------
+        files: Dict
+            Paths of sink, source, rules files.
+        params: Dict
+            Parameters of the workflow to process.
+        preference: Preference
+            A preference object.
+        logger : Logger
+            The logger object.
+        workspace: Optional[str]
+            KNIME workspace to use instead of Knime.workspace.
+        timeout: Optional[float]
+            Wall-clock time budget of the run, in minutes.
+        cpu_timeout: Optional[float]
+            CPU time budget of the run (all threads), in minutes.
+        usage: Optional[Dict]
+            Filled with the return code, duration (s), CPU times (s) and
+            peak resident memory (bytes) of the KNIME process.
+        progress: Optional[Callable[[ProgressEvent], None]]
+            Called with the events parsed from the console output of KNIME
+            while it runs, the output being logged at debug level instead
+            of printed.
+        stop: Optional[Callable[[], bool]]
+            Polled while KNIME runs, KNIME is stopped once it returns True
+            (see early_stop.EarlyStop).
+
+        Return
+        ------
+        int
+            Return code of KNIME, RETCODES['TimeOut'] if a budget is
+            exceeded, RETCODES['OK'] if stopped. Outputs written so far
+            are kept.
+        """
+        logger.info('{attr1}Running KNIME...{attr2}'.format(attr1=attr('bold'), attr2=attr('reset')))
+
+        if not self.kexec or not os.path.exists(self.kexec):
+            raise FileNotFoundError(f"KNIME executable not found under {self.kinstall}")
+
+        workflow_dir = self.clone_workflow() if self.workflow_cache else ""
+        try:
+            args = self.build_args(
+                files=files,
+                params=params,
+                preference=preference,
+                workspace=workspace,
+                workflow_dir=workflow_dir,
+                logger=logger,
+            )
+            logger.debug(" ".join(args))
+
+            start = time.perf_counter()
+            output = {}
+            if progress is not None:
+                output = dict(stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            # Own process group, to stop the JVM and its children at once
+            proc = subprocess.Popen(args, env=Knime.build_env(), start_new_session=os.name == "posix", **output)
+            reader = None
+            if progress is not None:
+                reader = threading.Thread(
+                    target=ProgressParser(progress, logger).feed_stream,
+                    args=(proc.stdout,),
+                    name="knime-progress",
+                    daemon=True,
+                )
+                reader.start()
+            try:
+                if cpu_timeout:
+                    Knime.limit_cpu(proc.pid, cpu_timeout * 60, logger)
+                rusage = Knime.wait(proc, timeout=timeout * 60 if timeout else None, stop=stop)
+                returncode = proc.returncode
+                if returncode is None:
+                    logger.info('   |- Stopping KNIME')
+                    Knime.terminate(proc, logger=logger)
+                    if usage is not None:
+                        usage.update(returncode=proc.returncode, elapsed=time.perf_counter() - start, stopped=True)
+                    return RETCODES['OK']
+            except subprocess.TimeoutExpired:
+                logger.warning(f'   |- Time out after {timeout} minutes, stopping KNIME')
+                Knime.terminate(proc, logger=logger)
+                if usage is not None:
+                    usage.update(returncode=proc.returncode, elapsed=time.perf_counter() - start, timeout=True)
+                return RETCODES['TimeOut']
+            except BaseException:
+                # e.g. KeyboardInterrupt, not received by KNIME in its own session
+                Knime.terminate(proc, grace=5, logger=logger)
+                raise
+            finally:
+                if reader is not None:
+                    # Processes started by KNIME may keep the pipe open
+                    reader.join(timeout=5)
+                    if not reader.is_alive():
+                        proc.stdout.close()
+            logger.debug(proc)
+            elapsed = time.perf_counter() - start
+            if usage is not None:
+                usage.update(returncode=returncode, elapsed=elapsed)
+                if rusage is not None:
+                    usage.update(resource_usage(rusage))
+
+            cpu_time = None if rusage is None else rusage.ru_utime + rusage.ru_stime
+            if Knime.cpu_exceeded(returncode, cpu_timeout, cpu_time=cpu_time, elapsed=elapsed):
+                logger.warning(f'   |- CPU time budget of {cpu_timeout} minutes exceeded')
+                if usage is not None:
+                    usage['timeout'] = True
+                Knime.terminate(proc, grace=0, logger=logger)
+                return RETCODES['TimeOut']
+            logger.info('   |- {bold}OK{reset}'.format(bold=attr('bold'), reset=attr('reset')))
+            return returncode
+
+        except OSError as e:
+            logger.error(e)
+            return RETCODES['OSError']
+        finally:
+            if workflow_dir:
+                shutil.rmtree(os.path.dirname(workflow_dir), ignore_errors=True)
+
+    async def acall(
+        self,
+        files: Dict,
+        params: Dict,
+        preference: Preference,
+        logger: Logger = getLogger(__name__),
+        workspace: Optional[str] = None,
+        timeout: Optional[float] = None,
+        cpu_timeout: Optional[float] = None,
+        usage: Optional[Dict] = None,
+        progress: Optional[Callable[[ProgressEvent], None]] = None,
+        stop: Optional[Callable[[], bool]] = None,
+    ) -> int:
+        """Run Knime workflow from an event loop, see `Knime.call`.
+
+        KNIME is started with asyncio.create_subprocess_exec and its own
+        environment, so that many runs can be awaited concurrently. The
+        CPU times and peak memory are not reported in `usage`, the child
+        being reaped by the event loop.
+        """
+        logger.info('{attr1}Running KNIME...{attr2}'.format(attr1=attr('bold'), attr2=attr('reset')))
+
+        if not self.kexec or not os.path.exists(self.kexec):
+            raise FileNotFoundError(f"KNIME executable not found under {self.kinstall}")
+
+        workflow_dir = ""
+        try:
+            if self.workflow_cache:
+                workflow_dir = await asyncio.to_thread(self.clone_workflow)
+            args = self.build_args(
+                files=files,
+                params=params,
+                preference=preference,
+                workspace=workspace,
+                workflow_dir=workflow_dir,
+                logger=logger,
+            )
+            logger.debug(" ".join(args))
+
+            start = time.perf_counter()
+            output = {}
+            if progress is not None:
+                output = dict(stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
+            proc = await asyncio.create_subprocess_exec(
+                *args,
+                env=Knime.build_env(),
+                start_new_session=os.name == "posix",
+                **output,
+            )
+            reader = None
+            if progress is not None:
+                reader = asyncio.create_task(ProgressParser(progress, logger).afeed_stream(proc.stdout))
+            try:
+                if cpu_timeout:
+                    Knime.limit_cpu(proc.pid, cpu_timeout * 60, logger)
+                returncode = await Knime.await_exit(proc, timeout=timeout * 60 if timeout else None, stop=stop)
+                if returncode is None:
+                    logger.info('   |- Stopping KNIME')
+                    await Knime.aterminate(proc, logger=logger)
+                    if usage is not None:
+                        usage.update(returncode=proc.returncode, elapsed=time.perf_counter() - start, stopped=True)
+                    return RETCODES['OK']
+            except asyncio.TimeoutError:
+                logger.warning(f'   |- Time out after {timeout} minutes, stopping KNIME')
+                await Knime.aterminate(proc, logger=logger)
+                if usage is not None:
+                    usage.update(returncode=proc.returncode, elapsed=time.perf_counter() - start, timeout=True)
+                return RETCODES['TimeOut']
+            except BaseException:
+                # e.g. task cancelled
+                await Knime.aterminate(proc, grace=5, logger=logger)
+                raise
+            finally:
+                if reader is not None:
+                    # Processes started by KNIME may keep the pipe open
+                    done, _ = await asyncio.wait([reader], timeout=5)
+                    if not done:
+                        reader.cancel()
+            elapsed = time.perf_counter() - start
+            if usage is not None:
+                usage.update(returncode=returncode, elapsed=elapsed)
+
+            # Resource usage not collected by asyncio
+            if Knime.cpu_exceeded(returncode, cpu_timeout, elapsed=elapsed):
+                logger.warning(f'   |- CPU time budget of {cpu_timeout} minutes exceeded')
+                if usage is not None:
+                    usage['timeout'] = True
+                await Knime.aterminate(proc, grace=0, logger=logger)
+                return RETCODES['TimeOut']
+            logger.info('   |- {bold}OK{reset}'.format(bold=attr('bold'), reset=attr('reset')))
+            return returncode
+
+        except OSError as e:
+            logger.error(e)
+            return RETCODES['OSError']
+        finally:
+            if workflow_dir:
+                shutil.rmtree(os.path.dirname(workflow_dir), ignore_errors=True)
+
+
+class KnimePool(Knime):
+    """Limit of the number of concurrent KNIME runs.
+
+    At most `size` workflows run concurrently, queued runs waiting for a
+    free slot. Each slot has its own workspace (-data), so that concurrent
+    runs never share one. Runs are not sped up: a KNIME batch application
+    runs one workflow and exits, each run starts its own JVM as `Knime`
+    does. The pool can be given to `retropath2()` in place of a `Knime`
+    object.
+
+    Attributes
+    ----------
+    size: int
+        number of concurrent runs
+    workdir: str
+        directory where the workspaces are created
+
+    Other keyword arguments are options of the runs, see `Knime`.
+    """
+
+    def __init__(
+            self,
+            kinstall: str = DEFAULTS['KNIME_FOLDER'],
+            workflow: str = "",
+            size: int = DEFAULTS['KNIME_WORKERS'],
+            workdir: str = "",
+            **kwargs,
+        ) -> None:
+        super().__init__(kinstall=kinstall, workflow=workflow, **kwargs)
+        if size < 1:
+            raise ValueError(f"Number of KNIME workspaces must be positive: {size}")
+        self.size = size
+        self._tempdir = None
+        if not workdir:
+            self._tempdir = tempfile.mkdtemp(prefix="rp2_knime_pool_")
+            workdir = self._tempdir
+        self.workdir = workdir
+        self._workspaces = queue.Queue()
+        for i in range(self.size):
+            workspace = os.path.join(self.workdir, f"workspace_{i}")
+            os.makedirs(workspace, exist_ok=True)
+            self._workspaces.put(workspace)
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.size,
+            thread_name_prefix="knime-run",
+        )
+        # Threads waiting for a free slot for acall(), apart from the
+        # default executor used by the runs themselves
+        self._acquirer = ThreadPoolExecutor(thread_name_prefix="knime-slot")
+        # Slots owned by another pool, see share()
+        self._shared = False
+
+    def __repr__(self):
+        s = [super().__repr__()]
+        s.append(f"size: {self.size}")
+        s.append(f"workdir: {self.workdir}")
+        return "\n".join(s)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.shutdown()
+
+    def concurrency(self) -> int:
+        return self.size
+
+    def share(self) -> "KnimePool":
+        """Pool running its workflows in the slots of this one, e.g. to run
+        another workflow version: at most `size` runs at the same time for
+        both. Only the pool owning the slots is shut down.
+
+        Return
+        ------
+        KnimePool
+        """
+        shared = copy.copy(self)
+        shared._tempdir = None
+        shared._shared = True
+        return shared
+
+    def _run(
+        self,
+        files: Dict,
+        params: Dict,
+        preference: Preference,
+        logger: Logger = getLogger(__name__),
+        **kwargs,
+    ) -> int:
+        workspace = self._workspaces.get()
+        try:
+            return super().call(
+                files=files,
+                params=params,
+                preference=preference,
+                logger=logger,
+                workspace=workspace,
+                **kwargs,
+            )
+        finally:
+            self._workspaces.put(workspace)
+
+    def submit(
+        self,
+        files: Dict,
+        params: Dict,
+        preference: Preference,
+        logger: Logger = getLogger(__name__),
+        **kwargs,
+    ) -> Future:
+        """Queue a workflow run, see `Knime.call` for other keyword arguments.
+
+        Return
+        ------
+        Future
+            Resolved with the return code of the run.
+        """
+        return self._executor.submit(
+            self._run,
+            files=files,
+            params=params,
+            preference=preference,
+            logger=logger,
+            **kwargs,
+        )
+
+    def call(
+        self,
+        files: Dict,
+        params: Dict,
+        preference: Preference,
+        logger: Logger = getLogger(__name__),
+        workspace: Optional[str] = None,
+        **kwargs,
+    ) -> int:
+        """Run Knime workflow in the first free slot, see `Knime.call`.
+        `workspace` is ignored, slots own their workspaces."""
+        return self.submit(
+            files=files,
+            params=params,
+            preference=preference,
+            logger=logger,
+            **kwargs,
+        ).result()
+
+    async def acall(
+        self,
+        files: Dict,
+        params: Dict,
+        preference: Preference,
+        logger: Logger = getLogger(__name__),
+        workspace: Optional[str] = None,
+        **kwargs,
+    ) -> int:
+        """Run Knime workflow from an event loop on the first available
+        slot, see `Knime.acall`. `workspace` is ignored, slots own their
+        workspaces."""
+        # Workspaces are also taken by threads, waited for in a thread
+        acquire = asyncio.get_running_loop().run_in_executor(self._acquirer, self._workspaces.get)
+        try:
+            workspace = await asyncio.shield(acquire)
+        except asyncio.CancelledError:
+            # Workspace taken once cancelled, given back
+            acquire.add_done_callback(
+                lambda f: f.cancelled() or f.exception() is not None or self._workspaces.put(f.result())
+            )
+            raise
+        try:
+            return await super().acall(
+                files=files,
+                params=params,
+                preference=preference,
+                logger=logger,
+                workspace=workspace,
+                **kwargs,
+            )
+        finally:
+            self._workspaces.put(workspace)
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Wait for the queued runs and remove the workspaces created by the pool."""
+        if self._shared:
+            return
+        self._executor.shutdown(wait=wait)
+        self._acquirer.shutdown(wait=wait)
+        if self._tempdir is not None:
+            shutil.rmtree(self._tempdir, ignore_errors=True)
+            self._tempdir = None
+
+
+def install_online(args, logger: Logger = getLogger(__name__)):
+    path_knime = args.kinstall
+    kver = args.kver
+
+    tempdir = tempfile.mkdtemp()
+    os.makedirs(path_knime, exist_ok=True)
+    try:
+        Knime.download_from_zenodo(path=tempdir, kver=kver, logger=logger)
+        knime = Knime(kinstall=path_knime)
+        knime.install(path=tempdir, logger=logger)
+    except Exception as e:
+        raise RuntimeError(e)
+    finally:
+        shutil.rmtree(tempdir)
+
+def install_local(args, logger: Logger = getLogger(__name__)):
+    path_knime = args.kinstall
+    path_zenodo = args.zenodo_zip
+
+    tempdir = tempfile.mkdtemp()
+    os.makedirs(path_knime, exist_ok=True)
+    try:
+        logger.info(f"Unzip: {path_zenodo}")
+        unzip(
+            file=path_zenodo,
+            dir=tempdir,
+        )
+        knime = Knime(kinstall=path_knime)
+        logger.info(f"Install to: {path_knime}")
+        knime.install(path=tempdir, logger=logger)
+    except Exception as e:
+        raise RuntimeError(e)
+    finally:
+        shutil.rmtree(tempdir)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(required=True)
+
+    # Online
+    par_onl = subparsers.add_parser("online")
+    par_onl.add_argument(
+        "--kinstall", required=True, help="Path to install Knime"
+    )
+    par_onl.add_argument(
+        "--kver", default="4.6.4", choices=["4.6.4", "4.7.0"], help="Knime version"
+    )
+    par_onl.set_defaults(func=install_online)
+    
+    # Local
+    par_loc = subparsers.add_parser("local")
+    par_loc.add_argument(
+        "--kinstall", required=True, help="Path to install Knime"
+    )
+    zenodo_files = ", ".join([x + ".zip" for x in Knime.ZENODO.values()])
+    par_loc.add_argument(
+        "--zenodo-zip", required=True, help=f"Zenodo file obtained from \"Download all\" button from Zenodo, such as {zenodo_files}"
+    )
+    par_loc.set_defaults(func=install_local)
+
+    args = parser.parse_args()
+    args.func(args)
\ No newline at end of file
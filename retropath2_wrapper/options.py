@@ -0,0 +1,144 @@
+"""
+Objects of a run built from the parsed command line options, shared by
+the command line interfaces (single run, batch, sweep, job queue, server).
+"""
+from argparse import ArgumentParser
+from logging import (
+    Logger,
+    getLogger
+)
+from typing import Dict
+
+from retropath2_wrapper.RetroPath2 import sniff_rules
+from retropath2_wrapper.cache import ResultCache
+from retropath2_wrapper.sink_index import SinkIndex
+from retropath2_wrapper.staging import StagingCache
+from retropath2_wrapper.store import ResultStore
+
+
+def knime_options(args) -> Dict:
+    """
+    Options of the KNIME runs from --workflow_cache_dir, --jvm_*,
+    --knime_threads, --knime_temp_dir, --table_cache and --cells_in_memory.
+
+    Returns
+    -------
+    Dict Keyword arguments of Knime.
+
+    """
+    return {
+        'workflow_cache': args.workflow_cache_dir,
+        'jvm_heap': args.jvm_heap,
+        'jvm_gc': args.jvm_gc,
+        'jvm_gc_log': args.jvm_gc_log,
+        'max_threads': args.knime_threads,
+        'temp_dir': args.knime_temp_dir,
+        'table_cache': args.table_cache,
+        'cells_in_memory': args.cells_in_memory,
+    }
+
+
+def build_cache(args) -> ResultCache | None:
+    """
+    Build the result cache from --cache_dir and --cache_size.
+
+    Returns
+    -------
+    ResultCache | None The cache, None if caching is disabled.
+
+    """
+    if args.cache_dir is None:
+        return None
+    return ResultCache(
+        path=args.cache_dir,
+        max_size=args.cache_size * 1024 ** 2,
+    )
+
+
+def build_store(args) -> ResultStore | None:
+    """
+    Build the store of results from --store.
+
+    Returns
+    -------
+    ResultStore | None The store, None if results are not stored.
+
+    """
+    if args.store is None:
+        return None
+    return ResultStore(path=args.store)
+
+
+def build_staging(args) -> StagingCache | None:
+    """
+    Build the cache of prepared rules from --staging_dir, --staging_size
+    and --staging_max_age.
+
+    Returns
+    -------
+    StagingCache | None The cache, None if disabled.
+
+    """
+    if args.staging_dir is None:
+        return None
+    return StagingCache(
+        path=args.staging_dir,
+        max_size=args.staging_size * 1024 ** 2,
+        max_age=args.staging_max_age * 24 * 3600,
+    )
+
+
+def build_sink_index(
+    args,
+    logger: Logger = getLogger(__name__)
+) -> SinkIndex | None:
+    """
+    Build or load the index of the sink file from --sink_index_dir.
+
+    Returns
+    -------
+    SinkIndex | None The index, None if disabled or if the sink file can not be indexed.
+
+    """
+    if args.sink_index_dir is None:
+        return None
+    try:
+        return SinkIndex(args.sink_file, path=args.sink_index_dir, logger=logger)
+    except (OSError, ValueError) as e:
+        # Sink file will be scanned, which reports the error
+        logger.debug(e)
+        return None
+
+
+def parse_std_hydrogen(
+    parser: ArgumentParser,
+    args,
+    logger: Logger = getLogger(__name__)
+) -> str:
+    """
+    Translate --std_hydrogen into the standardization mode of the workflow.
+
+    Parameters
+    ----------
+    parser : ArgumentParser
+        The parser, used to report bad values.
+    args : Namespace
+        The parsed arguments.
+    logger : Logger
+        The logger object.
+
+    Returns
+    -------
+    str Standardization mode.
+
+    """
+    # Sniff implicit/explicit hydrogens
+    if args.std_hydrogen == "auto":
+        std_hydrogen = sniff_rules(path=args.rules_file, logger=logger)
+    elif args.std_hydrogen in ["implicit", "explicit"]:
+        std_hydrogen = args.std_hydrogen
+    else:
+        parser.error("--std_hydrogen should be one of 'auto', 'implicit' or 'explicit'.")
+    if std_hydrogen == "implicit":
+        return "Aromatized (no Hs added)"
+    return "H added + Aromatized"
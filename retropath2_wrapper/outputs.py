@@ -0,0 +1,221 @@
+"""
+Streaming reader of the results and scope files written by the workflow.
+
+Rows are read one at a time and turned into typed records: bracketed
+lists ("[RR-02-..., RR-02-...]", "[1.1.1.1, 2.5.1.11]", "[None]") are
+split into tuples, "In Sink" into a bool, "Diameter", "Score" and
+"Iteration" into numbers. Files are never loaded as a whole, gzip
+compressed files are read as they are.
+
+The rows of a transformation (one per product) are written within the
+rows of its iteration, so transformations are grouped with at most one
+iteration of rows kept in memory, usually much less for scope files
+where the rows of a transformation are contiguous.
+
+Source files given to the workflow are written here as well.
+"""
+import csv
+import gzip
+import sys
+from functools import lru_cache
+from itertools import groupby
+from typing import (
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Tuple,
+)
+
+
+class ResultRow(NamedTuple):
+    """Row of a results or scope file, one per product of a
+    transformation."""
+    initial_source: str
+    transformation_id: str
+    reaction_smiles: str
+    substrate_smiles: str
+    substrate_inchi: str
+    product_smiles: str
+    product_inchi: str
+    in_sink: bool
+    sink_names: Tuple[str, ...]
+    diameter: int
+    rule_ids: Tuple[str, ...]
+    ec_numbers: Tuple[str, ...]
+    score: float
+    iteration: int
+    # Scope files only
+    starting_source_smiles: str = ''
+
+
+class Compound(NamedTuple):
+    smiles: str
+    inchi: str
+    in_sink: bool = False
+    sink_names: Tuple[str, ...] = ()
+
+
+class Transformation(NamedTuple):
+    """Transformation of a substrate into products, by one or more rules."""
+    transformation_id: str
+    initial_source: str
+    reaction_smiles: str
+    substrate: Compound
+    products: Tuple[Compound, ...]
+    diameter: int
+    rule_ids: Tuple[str, ...]
+    ec_numbers: Tuple[str, ...]
+    score: float
+    iteration: int
+    starting_source_smiles: str = ''
+
+
+# Columns of the files, by field of ResultRow
+COLUMNS = {
+    'initial_source': 'Initial source',
+    'transformation_id': 'Transformation ID',
+    'reaction_smiles': 'Reaction SMILES',
+    'substrate_smiles': 'Substrate SMILES',
+    'substrate_inchi': 'Substrate InChI',
+    'product_smiles': 'Product SMILES',
+    'product_inchi': 'Product InChI',
+    'in_sink': 'In Sink',
+    'sink_names': 'Sink name',
+    'diameter': 'Diameter',
+    'rule_ids': 'Rule ID',
+    'ec_numbers': 'EC number',
+    'score': 'Score',
+    'iteration': 'Iteration',
+    'starting_source_smiles': 'Starting Source SMILES',
+}
+
+
+# Same lists of rules and EC numbers over many rows
+@lru_cache(maxsize=1 << 16)
+def split_list(value: str) -> Tuple[str, ...]:
+    """Split a bracketed list of the workflow, '[None]' being empty."""
+    value = value.strip()
+    if value.startswith('[') and value.endswith(']'):
+        value = value[1:-1]
+    items = tuple(x.strip() for x in value.split(','))
+    return tuple(x for x in items if x and x != 'None')
+
+
+def to_int(value: str) -> int:
+    # Written as floats by some versions of the workflow
+    return int(float(value)) if value.strip() else 0
+
+
+def to_float(value: str) -> float:
+    return float(value) if value.strip() else 0.0
+
+
+CONVERTERS = {
+    'in_sink': lambda x: x.strip() == '1',
+    'sink_names': split_list,
+    'diameter': to_int,
+    'rule_ids': split_list,
+    'ec_numbers': split_list,
+    'score': to_float,
+    'iteration': to_int,
+}
+
+
+def open_text(path: str):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', newline='')
+    return open(path, 'r', newline='')
+
+
+def iter_rows(path: str) -> Iterator[ResultRow]:
+    """Read the rows of a results or scope file.
+
+    Parameters
+    ----------
+    path: str
+        Path of the file, gzip compressed if ending with '.gz'.
+
+    Return
+    ------
+    Iterator[ResultRow]
+        Rows in file order, missing columns left empty.
+
+    Raise
+    -----
+    ValueError
+        If the file is not a results or scope file.
+    """
+    # SMILES of large compounds exceed the default limit of csv
+    csv.field_size_limit(min(sys.maxsize, 2 ** 31 - 1))
+    with open_text(path) as f:
+        f_reader = csv.reader(f)
+        header = next(f_reader, [])
+        index = {}
+        for field, column in COLUMNS.items():
+            if column in header:
+                index[field] = header.index(column)
+        if 'transformation_id' not in index or 'product_inchi' not in index:
+            raise ValueError(f'Not a results or scope file: {path}')
+        # Missing columns read from an empty value added at the end of rows
+        width = len(header)
+        fields = [(index.get(field, width), CONVERTERS.get(field)) for field in COLUMNS]
+        make = ResultRow._make
+        for row in f_reader:
+            if row == []:
+                continue
+            row.extend([''] * (width + 1 - len(row)))
+            yield make([row[i] if converter is None else converter(row[i]) for i, converter in fields])
+
+
+def iter_transformations(path: str) -> Iterator[Transformation]:
+    """Read the transformations of a results or scope file, products of a
+    transformation being gathered from its rows.
+
+    Parameters
+    ----------
+    path: str
+        Path of the file, gzip compressed if ending with '.gz'.
+
+    Return
+    ------
+    Iterator[Transformation]
+        Transformations in order of their first row.
+    """
+    for _, rows in groupby(iter_rows(path), key=lambda row: row.iteration):
+        # Rows of a transformation are within the rows of its iteration
+        groups: Dict[str, List[ResultRow]] = {}
+        for row in rows:
+            groups.setdefault(row.transformation_id, []).append(row)
+        for group in groups.values():
+            first = group[0]
+            yield Transformation(
+                transformation_id=first.transformation_id,
+                initial_source=first.initial_source,
+                reaction_smiles=first.reaction_smiles,
+                substrate=Compound(smiles=first.substrate_smiles, inchi=first.substrate_inchi),
+                products=tuple(
+                    Compound(
+                        smiles=row.product_smiles,
+                        inchi=row.product_inchi,
+                        in_sink=row.in_sink,
+                        sink_names=row.sink_names,
+                    )
+                    for row in group
+                ),
+                diameter=first.diameter,
+                rule_ids=first.rule_ids,
+                ec_numbers=first.ec_numbers,
+                score=first.score,
+                iteration=first.iteration,
+                starting_source_smiles=first.starting_source_smiles,
+            )
+
+
+def write_sources(compounds: List[Tuple[str, str]], path: str) -> str:
+    """Write compounds as a source file of the workflow."""
+    with open(path, 'w', newline='') as f:
+        f_writer = csv.writer(f)
+        f_writer.writerow(['Name', 'InChI'])
+        f_writer.writerows(compounds)
+    return path
@@ -0,0 +1,463 @@
+"""
+Enumerate and rank source-to-sink pathways of a scope or results file.
+
+Compounds and transformations are read into a bipartite graph indexed by
+integers: each transformation consumes one substrate and gives products,
+the ones in the sink needing nothing more. A pathway is a set of
+transformations, one for each compound to make, starting from the
+source, such that every compound it needs is either in the sink or made
+by one of its transformations, without cycle and within max_steps
+transformations from the source.
+
+The best score reachable from each compound within d steps is computed
+up front (dynamic programming over the graph, ignoring cycles, so an
+upper bound). Compounds which cannot reach the sink are never expanded,
+and top-k search stops expanding partial pathways whose bound is lower
+than the k-th best score found so far. The score of a pathway is the sum
+of the scores of its transformations.
+"""
+import csv
+import heapq
+import sys
+from array import array
+from itertools import count
+from typing import (
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
+
+from brs_utils import create_logger
+
+from retropath2_wrapper.Args import (
+    RETCODES,
+    build_pathways_args_parser,
+)
+from retropath2_wrapper.outputs import iter_rows
+
+
+NO_PATHWAY = float('-inf')
+
+
+class Pathway(NamedTuple):
+    score: float
+    # Transformation ids, in order of expansion from the source
+    transformations: Tuple[str, ...]
+    # Longest chain of transformations from the source
+    steps: int
+
+
+def csr(lists: List[List[int]]) -> Tuple[array, array]:
+    """Compress lists of ints into offsets and values arrays."""
+    offsets = array('L', [0])
+    values = array('L')
+    for items in lists:
+        values.extend(items)
+        offsets.append(len(values))
+    return offsets, values
+
+
+class ScopeGraph(object):
+    """Compound/transformation graph of a scope or results file.
+
+    Attributes
+    ----------
+    inchis: List[str]
+        InChI of each compound
+    in_sink: bytearray
+        1 for compounds of the sink
+    ids: List[str]
+        transformation id of each transformation
+    substrate: array
+        substrate of each transformation
+    score: array
+        score of each transformation
+    sources: List[int]
+        compounds transformed at iteration 0
+    iterations: int
+        number of iterations of the file
+    """
+
+    def __init__(self) -> None:
+        self.inchis = []
+        self.in_sink = bytearray()
+        self.ids = []
+        self.substrate = array('L')
+        self.score = array('d')
+        self.sources = []
+        self.iterations = 0
+        self._index = {}
+        # Products of transformation i: _products[_offsets[i]:_offsets[i + 1]]
+        self._offsets = array('L', [0])
+        self._products = array('L')
+        # Transformations of compound c: _trs[_trs_offsets[c]:_trs_offsets[c + 1]]
+        self._trs_offsets = array('L', [0])
+        self._trs = array('L')
+
+    def __repr__(self):
+        s = []
+        s.append(f"compounds: {len(self.inchis)}")
+        s.append(f"transformations: {len(self.ids)}")
+        s.append(f"sources: {len(self.sources)}")
+        return "\n".join(s)
+
+    def compound(self, inchi: str) -> int:
+        """Index of a compound, added if new."""
+        c = self._index.get(inchi)
+        if c is None:
+            c = self._index[inchi] = len(self.inchis)
+            self.inchis.append(inchi)
+            self.in_sink.append(0)
+        return c
+
+    def products(self, t: int) -> array:
+        return self._products[self._offsets[t]:self._offsets[t + 1]]
+
+    def transformations(self, c: int) -> array:
+        """Transformations of which compound c is the substrate."""
+        return self._trs[self._trs_offsets[c]:self._trs_offsets[c + 1]]
+
+    @classmethod
+    def from_file(cls, path: str) -> 'ScopeGraph':
+        """Build the graph of a scope or results file, see
+        outputs.iter_rows()."""
+        graph = cls()
+        index = {}
+        products = []
+        sources = {}
+        for row in iter_rows(path):
+            t = index.get(row.transformation_id)
+            if t is None:
+                t = index[row.transformation_id] = len(graph.ids)
+                graph.ids.append(row.transformation_id)
+                substrate = graph.compound(row.substrate_inchi)
+                graph.substrate.append(substrate)
+                graph.score.append(row.score)
+                products.append([])
+                if row.iteration == 0:
+                    sources.setdefault(substrate, None)
+                graph.iterations = max(graph.iterations, row.iteration + 1)
+            p = graph.compound(row.product_inchi)
+            if row.in_sink:
+                graph.in_sink[p] = 1
+            if p not in products[t]:
+                products[t].append(p)
+        graph._offsets, graph._products = csr(products)
+        del products
+        consumers = [[] for _ in graph.inchis]
+        for t, substrate in enumerate(graph.substrate):
+            consumers[substrate].append(t)
+        graph._trs_offsets, graph._trs = csr(consumers)
+        graph.sources = list(sources)
+        return graph
+
+    def best_scores(self, max_steps: int) -> List[array]:
+        """Upper bounds of the score of pathways from each compound.
+
+        Return
+        ------
+        List[array]
+            best[d][c], best score of a pathway resolving compound c within
+            d steps, NO_PATHWAY if none, cycles being ignored.
+        """
+        n = len(self.inchis)
+        best = [array('d', [0.0 if self.in_sink[c] else NO_PATHWAY for c in range(n)])]
+        for _ in range(max_steps):
+            previous = best[-1]
+            current = array('d', previous)
+            for t, substrate in enumerate(self.substrate):
+                if self.in_sink[substrate]:
+                    continue
+                score = self.score[t]
+                for p in self.products(t):
+                    score += previous[p]
+                    if score == NO_PATHWAY:
+                        break
+                if score > current[substrate]:
+                    current[substrate] = score
+            best.append(current)
+        return best
+
+    def scope(self, max_steps: Optional[int] = None) -> List[int]:
+        """Transformations of the pathways from the sources, the ones the
+        scope file of the workflow holds.
+
+        Parameters
+        ----------
+        max_steps: Optional[int]
+            Maximal number of transformations from the source to the
+            sink, the number of iterations of the graph if None.
+
+        Return
+        ------
+        List[int]
+            Transformations, in order.
+        """
+        max_steps = self.iterations if max_steps is None else max_steps
+        best = self.best_scores(max_steps)
+        kept = set()
+        # Most steps left with which each compound has been expanded
+        expanded = {}
+        stack = [(s, max_steps) for s in self.sources]
+        while stack:
+            c, left = stack.pop()
+            if left <= expanded.get(c, 0):
+                continue
+            expanded[c] = left
+            for t in self.transformations(c):
+                products = self.products(t)
+                if any(best[left - 1][p] == NO_PATHWAY for p in products):
+                    continue
+                kept.add(t)
+                stack += [(p, left - 1) for p in products if not self.in_sink[p]]
+        return sorted(kept)
+
+
+class PathwaySearch(object):
+    """Depth-first search of the pathways of a graph from a source.
+
+    Attributes
+    ----------
+    graph: ScopeGraph
+        graph to search
+    max_steps: int
+        maximal number of transformations from the source to the sink
+    best: List[array]
+        upper bounds, see ScopeGraph.best_scores()
+    """
+
+    def __init__(self, graph: ScopeGraph, max_steps: Optional[int] = None) -> None:
+        self.graph = graph
+        self.max_steps = graph.iterations if max_steps is None else max_steps
+        self.best = graph.best_scores(self.max_steps)
+
+    def search(
+            self,
+            source: int,
+            threshold: Callable[[], float],
+        ) -> Iterator[Tuple[float, Dict[int, int]]]:
+        """Yield (score, chosen) for each pathway whose bound is not below
+        threshold(), chosen giving the transformation making each compound
+        of the pathway."""
+        graph = self.graph
+        best = self.best
+        chosen = {}
+        steps_left = {}
+
+        # Pending compounds: (compound, steps left, ancestors), last first
+        def expand(pending: tuple, score: float):
+            # Skip compounds needing nothing
+            while pending:
+                c, left, ancestors = pending[-1]
+                if graph.in_sink[c]:
+                    pending = pending[:-1]
+                elif c in chosen:
+                    if steps_left[c] > left:
+                        # Resolved deeper in the pathway, not reusable here
+                        return
+                    pending = pending[:-1]
+                else:
+                    break
+            if not pending:
+                yield score, dict(chosen)
+                return
+            bound = score + sum(best[left][c] for c, left, _ in pending if c not in chosen)
+            if bound == NO_PATHWAY or bound < threshold():
+                return
+            c, left, ancestors = pending[-1]
+            rest = pending[:-1]
+            ancestors = ancestors | {c}
+            for t in graph.transformations(c):
+                products = graph.products(t)
+                if any(p in ancestors or best[left - 1][p] == NO_PATHWAY for p in products):
+                    continue
+                chosen[c] = t
+                steps_left[c] = left
+                yield from expand(
+                    rest + tuple((p, left - 1, ancestors) for p in reversed(products)),
+                    score + graph.score[t],
+                )
+                del chosen[c]
+                del steps_left[c]
+
+        yield from expand(((source, self.max_steps, frozenset()),), 0.0)
+
+    def pathway(self, source: int, score: float, chosen: Dict[int, int]) -> Pathway:
+        graph = self.graph
+        transformations = []
+        steps = 0
+        stack = [(source, 0)]
+        seen = set()
+        while stack:
+            c, depth = stack.pop()
+            if c not in chosen or c in seen:
+                steps = max(steps, depth)
+                continue
+            seen.add(c)
+            t = chosen[c]
+            transformations.append(graph.ids[t])
+            stack += [(p, depth + 1) for p in reversed(graph.products(t))]
+        return Pathway(score=score, transformations=tuple(transformations), steps=steps)
+
+
+def iter_pathways(
+    graph: ScopeGraph,
+    source: Optional[int] = None,
+    max_steps: Optional[int] = None,
+) -> Iterator[Pathway]:
+    """Enumerate the pathways of a graph, in search order.
+
+    Parameters
+    ----------
+    graph: ScopeGraph
+        Graph of a scope or results file.
+    source: Optional[int]
+        Compound to start from, every source of the graph if None.
+    max_steps: Optional[int]
+        Maximal number of transformations from the source to the sink,
+        the number of iterations of the file if None.
+
+    Return
+    ------
+    Iterator[Pathway]
+    """
+    search = PathwaySearch(graph, max_steps)
+    for s in graph.sources if source is None else [source]:
+        for score, chosen in search.search(s, lambda: NO_PATHWAY):
+            yield search.pathway(s, score, chosen)
+
+
+def top_pathways(
+    graph: ScopeGraph,
+    k: int,
+    source: Optional[int] = None,
+    max_steps: Optional[int] = None,
+) -> List[Pathway]:
+    """Find the k best pathways of a graph, by score, then by number of
+    transformations. Partial pathways which can not beat the k-th best one
+    are not expanded.
+
+    Parameters
+    ----------
+    graph: ScopeGraph
+        Graph of a scope or results file.
+    k: int
+        Number of pathways.
+    source: Optional[int]
+        Compound to start from, every source of the graph if None.
+    max_steps: Optional[int]
+        See iter_pathways().
+
+    Return
+    ------
+    List[Pathway]
+        Best pathways first.
+    """
+    search = PathwaySearch(graph, max_steps)
+    heap = []
+    tie = count()
+
+    def threshold() -> float:
+        return heap[0][0] if len(heap) >= k else NO_PATHWAY
+
+    for s in graph.sources if source is None else [source]:
+        for score, chosen in search.search(s, threshold):
+            pathway = search.pathway(s, score, chosen)
+            entry = (score, -len(pathway.transformations), next(tie), pathway)
+            if len(heap) < k:
+                heapq.heappush(heap, entry)
+            elif entry[:2] > heap[0][:2]:
+                heapq.heapreplace(heap, entry)
+    return [x[-1] for x in sorted(heap, reverse=True)]
+
+
+def write_scope(results: str, path: str) -> int:
+    """Write the scope of a results file, as the workflow does: rows of
+    the transformations of the pathways from the source, with the SMILES
+    of the source.
+
+    Parameters
+    ----------
+    results: str
+        Path of a results file.
+    path: str
+        Path of the scope file, not written if no pathway is found.
+
+    Return
+    ------
+    int
+        Number of transformations of the scope.
+    """
+    graph = ScopeGraph.from_file(results)
+    kept = set(graph.ids[t] for t in graph.scope())
+    if not kept:
+        return 0
+    with open(results, 'r', newline='') as f:
+        f_reader = csv.reader(f)
+        header = next(f_reader)
+        i_trs = header.index('Transformation ID')
+        i_iteration = header.index('Iteration')
+        i_smiles = header.index('Substrate SMILES')
+        rows = [row for row in f_reader if row[i_trs] in kept]
+    source_smiles = next(
+        (row[i_smiles] for row in rows if row[i_iteration].strip() == '0'), ''
+    )
+    with open(path, 'w', newline='') as f:
+        f_writer = csv.writer(f, quoting=csv.QUOTE_ALL, lineterminator='\n')
+        f_writer.writerow(header[:i_iteration] + ['Starting Source SMILES'] + header[i_iteration:])
+        for row in rows:
+            f_writer.writerow(row[:i_iteration] + [source_smiles] + row[i_iteration:])
+    return len(kept)
+
+
+def write_pathways(pathways: List[Pathway], path: str) -> str:
+    with open(path, 'w', newline='') as f:
+        f_writer = csv.writer(f)
+        f_writer.writerow(['Rank', 'Score', 'Steps', 'Transformations', 'Transformation IDs'])
+        for rank, pathway in enumerate(pathways, 1):
+            f_writer.writerow([
+                rank,
+                pathway.score,
+                pathway.steps,
+                len(pathway.transformations),
+                ';'.join(pathway.transformations),
+            ])
+    return path
+
+
+def _cli():
+    parser = build_pathways_args_parser()
+    args = parser.parse_args()
+    if args.top is not None and args.top < 1:
+        parser.error("--top should be a positive integer.")
+
+    logger = create_logger(parser.prog, args.log)
+
+    try:
+        graph = ScopeGraph.from_file(args.scope_file)
+    except FileNotFoundError as e:
+        logger.error(e)
+        return RETCODES['FileNotFound']
+    logger.info(f'{len(graph.inchis)} compounds, {len(graph.ids)} transformations')
+
+    if args.top is None:
+        pathways = sorted(
+            iter_pathways(graph, max_steps=args.max_steps),
+            key=lambda x: (-x.score, len(x.transformations)),
+        )
+    else:
+        pathways = top_pathways(graph, args.top, max_steps=args.max_steps)
+    if pathways == []:
+        logger.warning('No pathway has been found')
+        return RETCODES['NoSolution']
+    path = write_pathways(pathways, args.outfile)
+    logger.info(f'{len(pathways)} pathways written into {path}')
+    return RETCODES['OK']
+
+
+if __name__ == '__main__':
+    sys.exit(_cli())
@@ -1,17 +1,100 @@
 import datetime
 import tempfile
+from typing import List
 
 
 class Preference(object):
+    """Preferences of a KNIME run, written into the file given with
+    -preferences, and JVM system properties for the table backend.
+
+    Attributes
+    ----------
+    path: str
+        path of the preference file (.epf)
+    rdkit_timeout_minutes: int
+        timeout of the RDKit MCS aggregation
+    max_threads: int | str
+        maximal number of threads of KNIME, 'auto' to share the CPUs
+        between concurrent jobs (see for_jobs())
+    temp_dir: str
+        directory of the temporary files of KNIME
+    table_cache: str
+        tables kept in memory: 'LRU' (recently used tables), 'SMALL' (small
+        tables only), 'auto' to choose from the memory of each job
+    cells_in_memory: int
+        tables with less cells are kept in memory
+    """
+    TABLE_CACHES = ["LRU", "SMALL"]
+    # Memory of a job below which only small tables are kept in memory, in bytes
+    TABLE_CACHE_LRU_MEMORY = 4 * 1024 ** 3
+
     def __init__(self, *args, **kwargs) -> None:
         self.path = kwargs.get("path", tempfile.NamedTemporaryFile(suffix=".epf").name)
         self.rdkit_timeout_minutes = kwargs.get("rdkit_timeout_minutes")
+        self.max_threads = kwargs.get("max_threads")
+        self.temp_dir = kwargs.get("temp_dir")
+        self.table_cache = kwargs.get("table_cache")
+        self.cells_in_memory = kwargs.get("cells_in_memory")
+        Preference.check(max_threads=self.max_threads, table_cache=self.table_cache)
+
+    @classmethod
+    def check(cls, max_threads=None, table_cache=None) -> None:
+        """Raise ValueError if settings are not valid."""
+        if max_threads not in [None, "auto"] and (not str(max_threads).isdigit() or int(max_threads) < 1):
+            raise ValueError(f"KNIME max threads should be a positive integer or 'auto': {max_threads}")
+        if table_cache not in [None, "auto"] + cls.TABLE_CACHES:
+            raise ValueError(f"Table cache should be one of {', '.join(cls.TABLE_CACHES)} or 'auto': {table_cache}")
 
     def is_init(self) -> bool:
-        if self.rdkit_timeout_minutes:
+        if self.rdkit_timeout_minutes or self.max_threads or self.temp_dir:
             return True
         return False
 
+    def for_jobs(self, jobs: int, cpus: int = 0, memory: int = 0) -> "Preference":
+        """Resolve 'auto' settings for one of jobs running at the same time.
+
+        Parameters
+        ----------
+        jobs: int
+            Number of concurrent jobs.
+        cpus: int
+            CPUs available to all jobs (0 if unknown).
+        memory: int
+            Memory available to all jobs, in bytes (0 if unknown).
+
+        Return
+        ------
+        Preference
+            Preferences of one job, same path.
+        """
+        jobs = max(1, jobs)
+        max_threads = self.max_threads
+        if max_threads == "auto":
+            max_threads = max(1, cpus // jobs) if cpus else None
+        table_cache = self.table_cache
+        if table_cache == "auto":
+            if memory:
+                table_cache = "LRU" if memory / jobs >= self.TABLE_CACHE_LRU_MEMORY else "SMALL"
+            else:
+                table_cache = None
+        return Preference(
+            path=self.path,
+            rdkit_timeout_minutes=self.rdkit_timeout_minutes,
+            max_threads=max_threads,
+            temp_dir=self.temp_dir,
+            table_cache=table_cache,
+            cells_in_memory=self.cells_in_memory,
+        )
+
+    def vmargs(self) -> List[str]:
+        """JVM system properties of the table backend."""
+        args = []
+        if self.table_cache in self.TABLE_CACHES:
+            args += [f"-Dknime.table.cache={self.table_cache}"]
+        if self.cells_in_memory:
+            args += [f"-Dorg.knime.container.cellsinmemory={int(self.cells_in_memory)}"]
+        return args
+
     def to_file(self) -> None:
         now = datetime.datetime.now(datetime.timezone.utc)
         with open(self.path, "w") as fod:
@@ -24,3 +107,12 @@ class Preference(object):
                 fod.write("/instance/org.rdkit.knime.nodes/mcsAggregation.timeout=")
                 fod.write(str(int(self.rdkit_timeout_minutes) * 60))
                 fod.write("\n")
+            if self.max_threads and self.max_threads != "auto":
+                fod.write("/instance/org.knime.workbench.core/knime.maxThreads=")
+                fod.write(str(int(self.max_threads)))
+                fod.write("\n")
+            if self.temp_dir:
+                fod.write("/instance/org.knime.workbench.core/knime.tempDir=")
+                # Backslashes of Windows paths are escaped in preference files
+                fod.write(self.temp_dir.replace("\\", "\\\\"))
+                fod.write("\n")
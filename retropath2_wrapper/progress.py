@@ -0,0 +1,212 @@
+"""
+Progress of a run, parsed from the KNIME console output (-consoleLog).
+
+KNIME logs each node execution ("<node> <id> Start execute", "<node> <id>
+End execute (<n> secs)"), the RetroPath2.0 iterations being the executions
+of its "Recursive Loop Start" node. Lines are turned into ProgressEvent
+objects given to a callback as soon as they are written, so that callers
+know how far a run is, or that it stalls, before KNIME exits.
+"""
+import queue
+import re
+import threading
+import time
+from logging import (
+    Logger,
+    getLogger
+)
+from typing import (
+    Any,
+    BinaryIO,
+    Callable,
+    Iterator,
+    NamedTuple,
+    Optional,
+)
+
+from colored import attr
+
+
+class ProgressEvent(NamedTuple):
+    """Event of a run.
+
+    kind is one of 'start', 'node_start', 'node_end', 'iteration',
+    'warning', 'error', 'done' (parsed from KNIME), or 'exit' (end of the
+    call, data holding its return value, see stream_progress()).
+    """
+    kind: str
+    elapsed: float
+    line: str = ''
+    node: str = ''
+    node_id: str = ''
+    iteration: int = 0
+    nodes: int = 0
+    job: str = ''
+    data: Any = None
+
+
+class ProgressParser(object):
+    """Turn KNIME console lines into events.
+
+    Attributes
+    ----------
+    callback: Callable[[ProgressEvent], None]
+        called with each event
+    iteration: int
+        current iteration of the workflow
+    nodes: int
+        number of node executions done
+    last_output: float
+        time of the last line read (time.monotonic)
+    """
+    ITERATION_NODE = 'Recursive Loop Start'
+    NODE = re.compile(r' (?P<node_id>\d+(?::\d+)+) (?P<what>Start execute|End execute)')
+    # Columns of the console layout (level, thread, logger class, message)
+    COLUMNS = re.compile(r'\s{2,}|\t| : |LocalNodeExecutionJob ')
+    LEVEL = re.compile(r'^\s*(?P<level>DEBUG|INFO|WARN|ERROR|FATAL)\b')
+
+    def __init__(
+            self,
+            callback: Callable[[ProgressEvent], None],
+            logger: Logger = getLogger(__name__),
+        ) -> None:
+        self.callback = callback
+        self.logger = logger
+        self.iteration = 0
+        self.nodes = 0
+        self.start = time.monotonic()
+        self.last_output = self.start
+
+    def event(self, kind: str, line: str = '', **kwargs) -> ProgressEvent:
+        return ProgressEvent(
+            kind=kind,
+            elapsed=time.monotonic() - self.start,
+            line=line,
+            iteration=self.iteration,
+            nodes=self.nodes,
+            **kwargs
+        )
+
+    def parse(self, line: str) -> Optional[ProgressEvent]:
+        """Parse a line of the console output.
+
+        Return
+        ------
+        Optional[ProgressEvent]
+            None if the line tells nothing about the progress.
+        """
+        line = line.rstrip()
+        if 'Executing workflow' in line:
+            return self.event('start', line)
+        if 'Workflow execution done' in line:
+            return self.event('done', line)
+
+        m = ProgressParser.NODE.search(line)
+        if m is not None:
+            # Node name is the end of the column before its id
+            node = ProgressParser.COLUMNS.split(line[:m.start()])[-1].strip()
+            if m.group('what') == 'Start execute':
+                if ProgressParser.ITERATION_NODE in node:
+                    self.iteration += 1
+                    return self.event('iteration', line, node=node, node_id=m.group('node_id'))
+                return self.event('node_start', line, node=node, node_id=m.group('node_id'))
+            self.nodes += 1
+            return self.event('node_end', line, node=node, node_id=m.group('node_id'))
+
+        m = ProgressParser.LEVEL.match(line)
+        if m is not None and m.group('level') == 'WARN':
+            return self.event('warning', line)
+        if m is not None and m.group('level') in ['ERROR', 'FATAL']:
+            return self.event('error', line)
+        return None
+
+    def feed(self, line: str) -> Optional[ProgressEvent]:
+        """Parse a line and give the event, if any, to the callback."""
+        self.last_output = time.monotonic()
+        self.logger.debug(line.rstrip())
+        event = self.parse(line)
+        if event is not None:
+            try:
+                self.callback(event)
+            except Exception as e:
+                # A faulty callback must not stop reading, KNIME would block on a full pipe
+                self.logger.warning(f'Progress callback failed: {e}')
+        return event
+
+    def feed_stream(self, stream: BinaryIO) -> None:
+        """Read a stream line by line until its end."""
+        for raw in iter(stream.readline, b''):
+            self.feed(raw.decode('utf-8', errors='replace'))
+
+    async def afeed_stream(self, stream) -> None:
+        """Read an asyncio stream line by line until its end."""
+        while True:
+            raw = await stream.readline()
+            if not raw:
+                break
+            self.feed(raw.decode('utf-8', errors='replace'))
+
+
+class ProgressLogger(object):
+    """Callback logging the main events of a run (start, iterations,
+    errors, end), node executions at debug level."""
+
+    def __init__(self, logger: Logger = getLogger(__name__)) -> None:
+        self.logger = logger
+
+    def __call__(self, event: ProgressEvent) -> None:
+        prefix = '   |- [{elapsed}]{job}'.format(
+            elapsed=time.strftime('%H:%M:%S', time.gmtime(event.elapsed)),
+            job=f' {event.job}:' if event.job else '',
+        )
+        if event.kind == 'start':
+            self.logger.info(f'{prefix} workflow started')
+        elif event.kind == 'iteration':
+            self.logger.info('{prefix} {attr1}iteration {n}{attr2} ({nodes} nodes executed)'.format(
+                prefix=prefix, attr1=attr('bold'), n=event.iteration, attr2=attr('reset'), nodes=event.nodes,
+            ))
+        elif event.kind == 'error':
+            self.logger.warning(f'{prefix} {event.line}')
+        elif event.kind == 'done':
+            self.logger.info(f'{prefix} workflow done ({event.nodes} nodes executed)')
+        elif event.kind in ['node_start', 'node_end']:
+            self.logger.debug(f'{prefix} {event.kind} {event.node} {event.node_id}')
+
+
+def stream_progress(
+    func: Callable,
+    *args,
+    **kwargs
+) -> Iterator[ProgressEvent]:
+    """Run func(*args, progress=<callback>, **kwargs) in a thread and
+    yield its events as they come, e.g. func=retropath2 or Knime.call.
+    The last event is of kind 'exit', its data being the return value
+    of func. Exceptions raised by func are raised again.
+
+    Return
+    ------
+    Iterator[ProgressEvent]
+    """
+    events = queue.Queue()
+    result = {}
+    start = time.monotonic()
+
+    def run():
+        try:
+            result['value'] = func(*args, progress=events.put, **kwargs)
+        except BaseException as e:
+            result['error'] = e
+        finally:
+            events.put(None)
+
+    thread = threading.Thread(target=run, name='rp2-progress', daemon=True)
+    thread.start()
+    while True:
+        event = events.get()
+        if event is None:
+            break
+        yield event
+    thread.join()
+    if 'error' in result:
+        raise result['error']
+    yield ProgressEvent(kind='exit', elapsed=time.monotonic() - start, data=result.get('value'))
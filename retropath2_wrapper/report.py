@@ -0,0 +1,154 @@
+"""
+Timings and resource usage of a RetroPath2.0 run.
+
+A report gathers the duration of each phase of `retropath2()` (input
+checks, preparation of the files, KNIME execution, checks of the results),
+the CPU time and peak memory of the KNIME process, the sizes of the input
+files and the number of rows of the output files. It is written as JSON
+into the output folder, next to results.csv.
+"""
+import json
+import os
+import platform
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import (
+    Dict,
+    Iterator,
+    List,
+    Optional,
+)
+
+
+REPORT_FILE = 'run_report.json'
+REPORT_VERSION = 1
+# Versions of files whose rows are remembered
+ROW_COUNTS_SIZE = 64
+
+
+def count_rows(path: str) -> int:
+    """Count the data rows of a csv file (header excluded), once for
+    each version of the file (the same sink and rules are given to many
+    runs)."""
+    stat = os.stat(path)
+    return _count_rows(os.path.realpath(path), stat.st_size, stat.st_mtime_ns)
+
+
+@lru_cache(maxsize=ROW_COUNTS_SIZE)
+def _count_rows(path: str, size: int, mtime_ns: int) -> int:
+    count = 0
+    last = b'\n'
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            count += chunk.count(b'\n')
+            last = chunk[-1:]
+    # Last line without end of line
+    if last != b'\n':
+        count += 1
+    return max(0, count - 1)
+
+
+def resource_usage(rusage) -> Dict:
+    """Translate the resource usage of a child process (os.wait4).
+
+    Return
+    ------
+    Dict
+        CPU times in seconds, peak resident memory in bytes.
+    """
+    maxrss = rusage.ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    if platform.system() != 'Darwin':
+        maxrss *= 1024
+    return {
+        'cpu_user': rusage.ru_utime,
+        'cpu_system': rusage.ru_stime,
+        'peak_rss': maxrss,
+    }
+
+
+class RunReport(object):
+    """Measurements of a run.
+
+    Attributes
+    ----------
+    phases: Dict[str, float]
+        duration of each phase, in seconds
+    inputs: Dict[str, Dict]
+        size (bytes) and rows of the input files, by role
+    outputs: Dict[str, Dict]
+        size (bytes) and rows of the output files, by name
+    knime: Dict
+        return code, duration and resource usage of the KNIME process
+    params: Dict
+        parameters of the workflow
+    """
+
+    def __init__(self) -> None:
+        self.phases = {}
+        self.inputs = {}
+        self.outputs = {}
+        self.knime = {}
+        self.params = {}
+        self.started = time.time()
+
+    def __repr__(self):
+        return json.dumps(self.to_dict(), indent=2)
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Time a phase of the run, durations of a repeated phase add up."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0) + time.perf_counter() - start
+
+    def add_input(self, role: str, path: str, rows: bool = False) -> None:
+        self.inputs[role] = self.describe(path, rows)
+
+    def add_outputs(self, outdir: str, names: List[str]) -> None:
+        """Describe the output files written into outdir, rows are
+        counted for csv files."""
+        for name in names:
+            path = os.path.join(outdir, name)
+            if os.path.isfile(path):
+                self.outputs[name] = self.describe(path, rows=name.endswith('.csv'))
+
+    @classmethod
+    def describe(cls, path: str, rows: bool = False) -> Dict:
+        desc = {'path': os.path.abspath(path)}
+        try:
+            desc['size'] = os.path.getsize(path)
+            if rows:
+                desc['rows'] = count_rows(path)
+        except OSError:
+            pass
+        return desc
+
+    def to_dict(self, r_code: Optional[int] = None) -> Dict:
+        return {
+            'version': REPORT_VERSION,
+            'r_code': r_code,
+            'started': self.started,
+            'elapsed': time.time() - self.started,
+            'phases': self.phases,
+            'knime': self.knime,
+            'params': self.params,
+            'inputs': self.inputs,
+            'outputs': self.outputs,
+        }
+
+    def write(self, outdir: str, r_code: Optional[int] = None) -> str:
+        """Write the report into outdir.
+
+        Return
+        ------
+        str
+            Path of the report.
+        """
+        path = os.path.join(outdir, REPORT_FILE)
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(r_code), f, indent=2)
+        return path
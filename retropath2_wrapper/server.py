@@ -0,0 +1,728 @@
+"""
+Serve RetroPath2.0 runs through a local HTTP API.
+
+A long-running process keeps what is costly to set up between jobs: the
+KNIME install and workspaces (shared by all workflow versions), the indexes
+of the sink files, and the caches of prepared rules and of results. Each
+job still starts its own KNIME process. Jobs are submitted as
+JSON, wait in a bounded queue and are run by a fixed number of threads.
+Each job gets its own output folder, named after its id.
+
+Endpoints
+---------
+POST /jobs
+    Submit a job: {"inchi": ..., "name": ..., "sink": ..., "rules": ...,
+    "params": {"max_steps": 3, ...}}. Only "inchi" is mandatory, "sink"
+    and "rules" are names of the files given when starting the server.
+    Answers 202 with the job, 400 if the job is not valid, 503 if the
+    queue is full.
+GET /jobs
+    All jobs.
+GET /jobs/<id>
+    One job, with its state (queued, running, done) and return code.
+GET /jobs/<id>/results, GET /jobs/<id>/scope
+    Results or scope file of a done job, as CSV or as JSON lines of typed
+    rows with ?format=jsonl.
+GET /jobs/<id>/report
+    Run report of a done job.
+DELETE /jobs/<id>
+    Forget a done job and remove its output folder, 409 if it is not done.
+GET /health
+    Number of jobs by state and of free places in the queue.
+"""
+import json
+import shutil
+import sys
+import threading
+import time
+from argparse import Namespace
+from glob import glob
+from http.server import (
+    BaseHTTPRequestHandler,
+    ThreadingHTTPServer,
+)
+from os import (
+    makedirs,
+    path as os_path,
+)
+from queue import (
+    Full,
+    Queue,
+)
+from logging import (
+    Logger,
+    getLogger
+)
+from tempfile import mkdtemp
+from typing import (
+    Dict,
+    List,
+    Optional,
+)
+from urllib.parse import (
+    parse_qs,
+    urlparse,
+)
+from uuid import uuid4
+
+from colored import attr
+
+from brs_utils import create_logger
+
+from retropath2_wrapper.Args import (
+    DEFAULTS,
+    RETCODES,
+    RP2_VERSIONS,
+    build_server_args_parser,
+)
+from retropath2_wrapper.RetroPath2 import (
+    check_inchi,
+    init_knime,
+)
+from retropath2_wrapper.batch import run_job
+from retropath2_wrapper.jobqueue import run_kwargs
+from retropath2_wrapper.knime import (
+    Knime,
+    KnimePool,
+)
+from retropath2_wrapper.options import (
+    knime_options,
+    parse_std_hydrogen,
+)
+from retropath2_wrapper.outputs import iter_rows
+from retropath2_wrapper.report import REPORT_FILE
+from retropath2_wrapper.sink_index import SinkIndex
+
+
+# Parameters which can be set by a job, with their type
+JOB_PARAMS = {
+    'topx': int,
+    'dmin': int,
+    'dmax': int,
+    'max_steps': int,
+    'mwmax_source': int,
+    'min_rule_score': float,
+    'msc_timeout': int,
+    'timeout': float,
+    'cpu_timeout': float,
+    'stop_solutions': int,
+    'stop_iterations': int,
+    'rp2_version': str,
+}
+DEFAULT_NAME = 'default'
+MAX_NAME_LENGTH = 200
+# Bytes of a request body, a job is a small JSON object
+MAX_BODY = 64 * 1024
+
+
+def parse_files(specs: List[str], default: str) -> Dict[str, str]:
+    """
+    Parse named files.
+
+    Parameters
+    ----------
+    specs : List[str]
+        Files as 'name=path'.
+    default : str
+        Path of the file named 'default'.
+
+    Returns
+    -------
+    Dict[str, str] Absolute paths by name.
+
+    Raises
+    ------
+    ValueError
+        If a file is malformed or a name is given twice.
+
+    """
+    files = {DEFAULT_NAME: os_path.abspath(default)}
+    for spec in specs:
+        name, sep, path = spec.partition('=')
+        name = name.strip()
+        if not sep or not name or not path:
+            raise ValueError(f'{spec}: expected NAME=PATH')
+        if name in files:
+            raise ValueError(f'{spec}: {name} is given twice')
+        files[name] = os_path.abspath(path)
+    return files
+
+
+def parse_params(params: Dict) -> Dict:
+    """
+    Check the parameters of a job.
+
+    Parameters
+    ----------
+    params : Dict
+        Parameters of a job request.
+
+    Returns
+    -------
+    Dict Parameters with their type.
+
+    Raises
+    ------
+    ValueError
+        If a parameter can not be set or a value is malformed.
+
+    """
+    if not isinstance(params, dict):
+        raise ValueError('params: expected an object')
+    checked = {}
+    for name, value in params.items():
+        if name not in JOB_PARAMS:
+            raise ValueError(f'{name}: expected a parameter among {", ".join(JOB_PARAMS)}')
+        kind = JOB_PARAMS[name]
+        if (
+            isinstance(value, bool)
+            or not isinstance(value, (int, float, str))
+            or (kind is int and isinstance(value, float))
+            or (kind is str and not isinstance(value, str))
+        ):
+            raise ValueError(f'{name}: {kind.__name__} expected')
+        try:
+            checked[name] = kind(value)
+        except ValueError:
+            raise ValueError(f'{name}: {kind.__name__} expected')
+    # Names a workflow file, one of the shipped versions only
+    if 'rp2_version' in checked and checked['rp2_version'] not in RP2_VERSIONS:
+        raise ValueError(f'rp2_version: expected one of {", ".join(RP2_VERSIONS)}')
+    return checked
+
+
+class RetroPath2Service(object):
+    """Run submitted jobs with shared KNIME workspace pools and sink indexes.
+
+    Attributes
+    ----------
+    outdir: str
+        folder of the job output folders
+    sinks: Dict[str, str]
+        sink files by name
+    rules: Dict[str, str]
+        rules files by name
+    std_hydrogen: Dict[str, str]
+        standardization mode of the workflow by rules name
+    jobs: int
+        number of jobs run at the same time
+    queue_size: int
+        number of jobs waiting to be run
+    retention: int
+        number of done jobs kept, with their output folders
+    """
+
+    def __init__(
+            self,
+            sinks: Dict[str, str],
+            rules: Dict[str, str],
+            std_hydrogen: Dict[str, str],
+            outdir: str,
+            knime: Knime | None = None,
+            jobs: int = DEFAULTS['JOBS'],
+            queue_size: int = DEFAULTS['SERVER_QUEUE'],
+            retention: int = DEFAULTS['SERVER_RETENTION'],
+            rp2_version: str | None = DEFAULTS['RP2_VERSION'],
+            sink_index_dir: str | None = None,
+            logger: Logger = getLogger(__name__),
+            **kwargs
+        ) -> None:
+        self.outdir = os_path.abspath(outdir)
+        self.sinks = sinks
+        self.rules = rules
+        self.std_hydrogen = std_hydrogen
+        self.jobs = jobs
+        self.queue_size = queue_size
+        self.retention = retention
+        self.rp2_version = rp2_version
+        self.logger = logger
+        self._knime = knime
+        self._sink_index_dir = sink_index_dir
+        # Indexes of the service only, unless a folder of indexes is given
+        self._tempdir = None
+        # Other parameters of retropath2()
+        self._kwargs = kwargs
+        self._queue = Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        # Installing KNIME does not hold the lock of the jobs
+        self._pool_lock = threading.Lock()
+        self._jobs = {}
+        # Slots of the runs, shared by the pools of all workflow versions
+        self._slots = None
+        self._pools = {}
+        self._sink_indexes = {}
+        self._threads = []
+
+    def __repr__(self):
+        s = []
+        s.append(f"outdir: {self.outdir}")
+        s.append(f"sinks: {', '.join(self.sinks)}")
+        s.append(f"rules: {', '.join(self.rules)}")
+        s.append(f"jobs: {self.jobs}")
+        s.append(f"queue_size: {self.queue_size}")
+        return "\n".join(s)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def pool(self, rp2_version: str | None) -> KnimePool:
+        """Pool of KNIME workspaces of a workflow version, created once."""
+        with self._pool_lock:
+            if self._slots is None:
+                knime = self._knime
+                pool = KnimePool(
+                    kinstall=DEFAULTS['KNIME_FOLDER'] if knime is None else knime.kinstall,
+                    size=self.jobs,
+                    **({} if knime is None else knime.options()),
+                )
+                self._slots = init_knime(knime=pool, rp2_version=None, logger=self.logger)
+            if rp2_version not in self._pools:
+                self._pools[rp2_version] = init_knime(knime=self._slots.share(), rp2_version=rp2_version, logger=self.logger)
+            return self._pools[rp2_version]
+
+    def start(self) -> None:
+        """Index the sink files, set up KNIME and start running jobs.
+
+        Raises
+        ------
+        FileNotFoundError
+            If a sink file does not exist.
+        ValueError
+            If a sink file is malformed.
+        """
+        makedirs(self.outdir, exist_ok=True)
+        sink_index_dir = self._sink_index_dir
+        if sink_index_dir is None:
+            self._tempdir = mkdtemp(prefix='rp2_sink_index_')
+            sink_index_dir = self._tempdir
+        for name, sink_file in self.sinks.items():
+            self._sink_indexes[name] = SinkIndex(sink_file, path=sink_index_dir, logger=self.logger)
+        # Install KNIME before the first job comes
+        self.pool(self.rp2_version)
+        for i in range(self.jobs):
+            thread = threading.Thread(target=self._run, name=f'rp2-job-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def close(self) -> None:
+        """Run the queued jobs, then shut the pools down."""
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        if self._slots is not None:
+            self._slots.shutdown()
+            self._slots = None
+        self._pools = {}
+        for sink_index in self._sink_indexes.values():
+            sink_index.close()
+        self._sink_indexes = {}
+        if self._tempdir is not None:
+            shutil.rmtree(self._tempdir, ignore_errors=True)
+            self._tempdir = None
+
+    def submit(self, request: Dict) -> Dict:
+        """Check and queue a job. Targets already in the sink are done at
+        once (SrcInSink).
+
+        Parameters
+        ----------
+        request : Dict
+            'inchi', and optional 'name', 'sink', 'rules' and 'params'.
+
+        Returns
+        -------
+        Dict The job.
+
+        Raises
+        ------
+        ValueError
+            If the request is not valid.
+        queue.Full
+            If too many jobs are waiting.
+
+        """
+        if not isinstance(request, dict):
+            raise ValueError('Expected a JSON object')
+        unknown = set(request) - {'inchi', 'name', 'sink', 'rules', 'params'}
+        if unknown:
+            raise ValueError(f'Unknown fields: {", ".join(sorted(unknown))}')
+        inchi = request.get('inchi')
+        if not isinstance(inchi, str) or inchi.strip() == '':
+            raise ValueError('inchi: expected an InChI')
+        sink = request.get('sink', DEFAULT_NAME)
+        if sink not in self.sinks:
+            raise ValueError(f'sink: expected one of {", ".join(self.sinks)}')
+        rules = request.get('rules', DEFAULT_NAME)
+        if rules not in self.rules:
+            raise ValueError(f'rules: expected one of {", ".join(self.rules)}')
+        name = request.get('name')
+        if name is not None and (
+            not isinstance(name, str)
+            or not name.isprintable()
+            or len(name) > MAX_NAME_LENGTH
+        ):
+            raise ValueError(f'name: expected a printable string of {MAX_NAME_LENGTH} characters at most')
+        params = parse_params(request.get('params', {}))
+        inchi = check_inchi(inchi.strip(), self.logger)
+        if inchi in RETCODES.values():
+            raise ValueError('inchi: malformed InChI')
+
+        job_id = uuid4().hex[:12]
+        job = {
+            'id': job_id,
+            'name': name.strip() if name and name.strip() else job_id,
+            'inchi': inchi,
+            'sink': sink,
+            'rules': rules,
+            'params': params,
+            'outdir': os_path.join(self.outdir, job_id),
+            'state': 'queued',
+            'submitted': time.time(),
+        }
+        if self._sink_indexes[sink].lookup(inchi) is not None:
+            self.logger.warning(f'        {job["name"]}: source has been found in sink')
+            job.update(state='done', r_code=RETCODES['SrcInSink'], finished=job['submitted'])
+            with self._lock:
+                self._jobs[job_id] = job
+            self._expire()
+            return dict(job)
+
+        with self._lock:
+            self._jobs[job_id] = job
+            queued = dict(job)
+        try:
+            self._queue.put_nowait(job_id)
+        except Full:
+            with self._lock:
+                del self._jobs[job_id]
+            raise
+        self.logger.info(f'   |- {job["name"]}: queued ({job_id})')
+        return queued
+
+    def job(self, job_id: str) -> Optional[Dict]:
+        """The job of an id, None if unknown."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return None if job is None else dict(job)
+
+    def delete(self, job_id: str) -> Optional[Dict]:
+        """Forget a done job and remove its output folder.
+
+        Returns
+        -------
+        Optional[Dict] The job, None if unknown.
+
+        Raises
+        ------
+        ValueError
+            If the job is not done.
+
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            if job['state'] != 'done':
+                raise ValueError(f'Job {job_id} is {job["state"]}')
+            del self._jobs[job_id]
+        shutil.rmtree(job['outdir'], ignore_errors=True)
+        return dict(job)
+
+    def _expire(self) -> None:
+        """Forget the oldest done jobs beyond the retention, and remove
+        their output folders."""
+        with self._lock:
+            done = sorted(
+                (x for x in self._jobs.values() if x['state'] == 'done'),
+                key=lambda x: x['finished'],
+            )
+            expired = done[:max(0, len(done) - self.retention)]
+            for job in expired:
+                del self._jobs[job['id']]
+        for job in expired:
+            shutil.rmtree(job['outdir'], ignore_errors=True)
+
+    def all_jobs(self) -> List[Dict]:
+        """All jobs, in order of submission."""
+        with self._lock:
+            return sorted((dict(x) for x in self._jobs.values()), key=lambda x: x['submitted'])
+
+    def health(self) -> Dict:
+        """Number of jobs by state and of free places in the queue."""
+        with self._lock:
+            states = [x['state'] for x in self._jobs.values()]
+        health = {state: states.count(state) for state in ['queued', 'running', 'done']}
+        health['free'] = self.queue_size - self._queue.qsize()
+        health['workers'] = self.jobs
+        return health
+
+    def _run(self) -> None:
+        while True:
+            job_id = self._queue.get()
+            if job_id is None:
+                return
+            with self._lock:
+                job = self._jobs[job_id]
+                job.update(state='running', started=time.time())
+                job = dict(job)
+            self.logger.info(f'   |- {job["name"]}: started ({job_id})')
+            kwargs = dict(self._kwargs)
+            kwargs.update(job['params'])
+            rp2_version = kwargs.pop('rp2_version', self.rp2_version)
+            try:
+                r_code = run_job(
+                    job=job,
+                    sink_file=self.sinks[job['sink']],
+                    rules_file=self.rules[job['rules']],
+                    std_hydrogen=self.std_hydrogen[job['rules']],
+                    knime=self.pool(rp2_version),
+                    sink_index=self._sink_indexes[job['sink']],
+                    logger=self.logger,
+                    **kwargs
+                )
+            except Exception as e:
+                # Setting up KNIME may fail for a workflow version
+                self.logger.error(f'{job["name"]}: {e}')
+                r_code = RETCODES['OSError']
+            with self._lock:
+                self._jobs[job_id].update(state='done', r_code=r_code, finished=time.time())
+            self.logger.info(f'   |- {job["name"]}: done ({r_code})')
+            self._expire()
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """Handler of the requests to a RetroPath2Service, set as the
+    `service` attribute of the server."""
+
+    def log_message(self, format, *args) -> None:
+        self.server.service.logger.debug(format % args)
+
+    def send_json(self, code: int, data, headers: Dict = {}) -> None:
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, code: int, message: str, headers: Dict = {}) -> None:
+        self.send_json(code, {'error': message}, headers)
+
+    def send_file(self, path: str, content_type: str) -> None:
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(os_path.getsize(path)))
+        self.end_headers()
+        with open(path, 'rb') as f:
+            shutil.copyfileobj(f, self.wfile)
+
+    def send_rows(self, path: str) -> None:
+        """Typed rows of a results or scope file, as JSON lines."""
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        # Size unknown before all rows are converted
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        for row in iter_rows(path):
+            self.wfile.write(json.dumps(row._asdict()).encode('utf-8') + b'\n')
+
+    def do_POST(self) -> None:
+        service = self.server.service
+        if urlparse(self.path).path.rstrip('/') != '/jobs':
+            self.send_error_json(404, f'Not found: {self.path}')
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            self.send_error_json(400, 'Bad Content-Length')
+            return
+        if length > MAX_BODY:
+            self.send_error_json(413, f'Request body larger than {MAX_BODY} bytes')
+            # Body not read, the connection can not be reused
+            self.close_connection = True
+            return
+        try:
+            request = json.loads(self.rfile.read(max(0, length)) or b'null')
+            job = service.submit(request)
+        except ValueError as e:
+            self.send_error_json(400, str(e))
+            return
+        except Full:
+            self.send_error_json(503, 'Too many jobs waiting, try again later', {'Retry-After': '60'})
+            return
+        self.send_json(202, job, {'Location': f'/jobs/{job["id"]}'})
+
+    def do_DELETE(self) -> None:
+        service = self.server.service
+        parts = [x for x in urlparse(self.path).path.split('/') if x]
+        if len(parts) != 2 or parts[0] != 'jobs':
+            self.send_error_json(404, f'Not found: {self.path}')
+            return
+        try:
+            job = service.delete(parts[1])
+        except ValueError as e:
+            self.send_error_json(409, str(e))
+            return
+        if job is None:
+            self.send_error_json(404, f'Unknown job: {parts[1]}')
+            return
+        self.send_json(200, job)
+
+    def do_GET(self) -> None:
+        service = self.server.service
+        url = urlparse(self.path)
+        parts = [x for x in url.path.split('/') if x]
+        if parts == ['health']:
+            self.send_json(200, service.health())
+            return
+        if parts == ['jobs']:
+            self.send_json(200, service.all_jobs())
+            return
+        if len(parts) not in [2, 3] or parts[0] != 'jobs':
+            self.send_error_json(404, f'Not found: {self.path}')
+            return
+        job = service.job(parts[1])
+        if job is None:
+            self.send_error_json(404, f'Unknown job: {parts[1]}')
+            return
+        if len(parts) == 2:
+            self.send_json(200, job)
+            return
+
+        if parts[2] not in ['results', 'scope', 'report']:
+            self.send_error_json(404, f'Not found: {self.path}')
+            return
+        if job['state'] != 'done':
+            self.send_error_json(409, f'Job {job["id"]} is {job["state"]}')
+            return
+        if parts[2] == 'results':
+            files = [os_path.join(job['outdir'], 'results.csv')]
+        elif parts[2] == 'scope':
+            files = sorted(glob(os_path.join(job['outdir'], '*_scope.csv')), key=os_path.getmtime)
+        else:
+            files = [os_path.join(job['outdir'], REPORT_FILE)]
+        if not files or not os_path.isfile(files[-1]):
+            self.send_error_json(404, f'No {parts[2]} for job {job["id"]}')
+            return
+        if parts[2] == 'report':
+            self.send_file(files[-1], 'application/json')
+        elif parse_qs(url.query).get('format') == ['jsonl']:
+            self.send_rows(files[-1])
+        else:
+            self.send_file(files[-1], 'text/csv')
+
+
+def serve(
+    service: RetroPath2Service,
+    host: str = DEFAULTS['SERVER_HOST'],
+    port: int = DEFAULTS['SERVER_PORT'],
+) -> ThreadingHTTPServer:
+    """
+    Build the HTTP server of a started service, requests being answered
+    once serve_forever() is called.
+
+    Parameters
+    ----------
+    service : RetroPath2Service
+        The service.
+    host : str
+        Address to listen on.
+    port : int
+        Port to listen on, 0 for any free port.
+
+    Returns
+    -------
+    ThreadingHTTPServer The server.
+
+    """
+    server = ThreadingHTTPServer((host, port), RequestHandler)
+    server.daemon_threads = True
+    server.service = service
+    return server
+
+
+def _cli():
+    parser = build_server_args_parser()
+    args = parser.parse_args()
+
+    if args.source_file is not None or args.source_name is not None or args.source_inchi is not None:
+        parser.error("--source_file, --source_name and --source_inchi are not compliant with the server, targets are submitted to it.")
+    if args.resume_dir is not None:
+        parser.error("--resume_dir is not compliant with the server.")
+    if args.jobs < 1:
+        parser.error("--jobs should be a positive integer.")
+    if args.queue_size < 1:
+        parser.error("--queue_size should be a positive integer.")
+    if args.retention < 1:
+        parser.error("--retention should be a positive integer.")
+    try:
+        sinks = parse_files(args.sinks, args.sink_file)
+        rules = parse_files(args.rules, args.rules_file)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.log.lower() in ['silent', 'quiet'] or args.silent:
+        args.log = 'CRITICAL'
+
+    # Create logger
+    logger = create_logger(parser.prog, args.log)
+    logger.debug('args: ' + str(args))
+
+    std_hydrogen = {
+        name: parse_std_hydrogen(
+            parser, Namespace(std_hydrogen=args.std_hydrogen, rules_file=path), logger
+        )
+        for name, path in rules.items()
+    }
+    kwargs = run_kwargs(args, logger)
+    del kwargs['resume_dir']
+
+    service = RetroPath2Service(
+        sinks=sinks,
+        rules=rules,
+        std_hydrogen=std_hydrogen,
+        outdir=args.outdir,
+        knime=Knime(kinstall=args.kinstall, **knime_options(args)),
+        jobs=args.jobs,
+        queue_size=args.queue_size,
+        retention=args.retention,
+        rp2_version=args.rp2_version,
+        sink_index_dir=args.sink_index_dir,
+        logger=logger,
+        **kwargs
+    )
+    try:
+        service.start()
+    except FileNotFoundError as e:
+        logger.error(e)
+        return RETCODES['FileNotFound']
+    except ValueError as e:
+        logger.error(e)
+        return RETCODES['SinkFileMalformed']
+
+    server = serve(service, host=args.host, port=args.port)
+    logger.info('{attr1}Serving on http://{host}:{port} ({jobs} jobs){attr2}'.format(
+        attr1=attr('bold'), host=args.host, port=server.server_address[1], jobs=args.jobs, attr2=attr('reset'))
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        logger.info('Stopping, running and queued jobs are finished first')
+        service.close()
+    return RETCODES['OK']
+
+
+if __name__ == '__main__':
+    sys.exit(_cli())
@@ -0,0 +1,278 @@
+"""
+Persistent index of the compounds of a sink file.
+
+The index is an open-addressing hash table written once per sink file
+(identified by its path, size and modification time) and memory-mapped
+afterwards, so that checking whether a source is in the sink does not
+read the sink again. Keys are stored along with their hash, which only
+selects the slots to compare. Indexes of previous versions of a sink
+file, and indexes not used for a while, are removed when an index is
+built.
+"""
+import csv
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import time
+from glob import glob
+from logging import (
+    Logger,
+    getLogger
+)
+from typing import (
+    Dict,
+    Iterable,
+    Optional,
+)
+
+from retropath2_wrapper.Args import DEFAULTS
+
+
+MAGIC = b'RP2SINK2'
+HEADER = struct.Struct('<8sQQQ')  # magic, number of slots, of ids, of keys
+SLOT = struct.Struct('<QQ')       # key hash, key number
+OFFSET = struct.Struct('<Q')
+
+
+class SinkIndex(object):
+    """Hash index from normalized InChI (and InChIKey, if the sink has
+    such a column) to sink compound id.
+
+    Attributes
+    ----------
+    sink_file: str
+        path of the indexed sink file
+    index_file: str
+        path of the index
+    max_age: float
+        indexes not used since max_age seconds are removed when an index
+        is built
+    """
+
+    def __init__(
+            self,
+            sink_file: str,
+            path: str = DEFAULTS['SINK_INDEX_FOLDER'],
+            max_age: float = DEFAULTS['SINK_INDEX_AGE'],
+            logger: Logger = getLogger(__name__),
+        ) -> None:
+        self.sink_file = os.path.realpath(sink_file)
+        self.max_age = max_age
+        stat = os.stat(self.sink_file)
+        # Indexes of a sink file share a prefix, see evict()
+        prefix = hashlib.sha256(self.sink_file.encode()).hexdigest()[:16]
+        version = hashlib.sha256(f'{stat.st_size}|{stat.st_mtime_ns}'.encode()).hexdigest()[:16]
+        self.index_file = os.path.join(path, f'{prefix}_{version}.idx')
+        if not os.path.exists(self.index_file):
+            logger.debug(f'Build sink index: {self.index_file}')
+            os.makedirs(path, exist_ok=True)
+            SinkIndex.build(self.sink_file, self.index_file)
+            self.evict(logger)
+        else:
+            try:
+                # Mark index as recently used
+                os.utime(self.index_file)
+            except OSError:
+                pass
+        with open(self.index_file, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._n_slots, self._n_ids, self._n_keys = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f'Not a sink index: {self.index_file}')
+        self._key_offsets = HEADER.size + self._n_slots * SLOT.size
+        self._key_ids = self._key_offsets + (self._n_keys + 1) * OFFSET.size
+        self._id_offsets = self._key_ids + self._n_keys * OFFSET.size
+        self._keys = self._id_offsets + (self._n_ids + 1) * OFFSET.size
+        key_end, = OFFSET.unpack_from(self._mm, self._key_offsets + self._n_keys * OFFSET.size)
+        self._ids = self._keys + key_end
+
+    def __repr__(self):
+        s = []
+        s.append(f"sink_file: {self.sink_file}")
+        s.append(f"index_file: {self.index_file}")
+        return "\n".join(s)
+
+    def __len__(self) -> int:
+        return self._n_ids
+
+    def __contains__(self, key: str) -> bool:
+        return self.lookup(key) is not None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._mm.close()
+
+    @classmethod
+    def normalize(cls, key: str) -> str:
+        return key.strip().strip('"').strip()
+
+    @classmethod
+    def hash(cls, key: str) -> int:
+        h = int.from_bytes(
+            hashlib.blake2b(cls.normalize(key).encode(), digest_size=8).digest(),
+            'little'
+        )
+        # 0 marks empty slots
+        return h or 1
+
+    def evict(self, logger: Logger = getLogger(__name__)) -> int:
+        """Remove the indexes of previous versions of the sink file, and
+        the ones not used since max_age.
+
+        Return
+        ------
+        int
+            Number of removed indexes.
+        """
+        folder = os.path.dirname(self.index_file)
+        prefix = os.path.basename(self.index_file).split('_')[0]
+        now = time.time()
+        count = 0
+        for index_file in glob(os.path.join(folder, '*.idx')):
+            if index_file == self.index_file:
+                continue
+            try:
+                if (
+                    not os.path.basename(index_file).startswith(prefix + '_')
+                    and now - os.stat(index_file).st_mtime <= self.max_age
+                ):
+                    continue
+                # Runs having it open keep reading it
+                os.remove(index_file)
+            except OSError:
+                continue
+            logger.debug(f'Sink index removed: {index_file}')
+            count += 1
+        return count
+
+    @classmethod
+    def build(cls, sink_file: str, index_file: str) -> None:
+        """Write the index of a sink file.
+
+        Parameters
+        ----------
+        sink_file: str
+            Path of the sink file, with Name and InChI as first columns.
+        index_file: str
+            Path of the index.
+
+        Raise
+        -----
+        ValueError
+            If the sink file is malformed.
+        """
+        ids = []
+        keys = {}
+        with open(sink_file, 'r') as f:
+            f_reader = csv.reader(f, delimiter=',', quotechar='"')
+            header = next(f_reader, [])
+            try:
+                i_key = [x.strip().lower() for x in header].index('inchikey')
+            except ValueError:
+                i_key = None
+            if len(header) == 1:
+                raise ValueError(f'Sink file is malformed: {header}')
+            if len(header) > 1 and header[1].strip().lower() != 'inchi':
+                # No header
+                f_reader = [header] + list(f_reader)
+            for row in f_reader:
+                try:
+                    values = [row[1]]
+                    if i_key is not None:
+                        values.append(row[i_key])
+                except IndexError:
+                    raise ValueError(f'Sink file is malformed: {row}')
+                ids.append(row[0])
+                for value in values:
+                    key = cls.normalize(value)
+                    if key != '':
+                        keys.setdefault(key, len(ids) - 1)
+
+        n_slots = 1
+        while n_slots < 2 * len(keys) + 1:
+            n_slots *= 2
+        table = bytearray(n_slots * SLOT.size)
+        mask = n_slots - 1
+        for k, key in enumerate(keys):
+            h = cls.hash(key)
+            slot = h & mask
+            while SLOT.unpack_from(table, slot * SLOT.size)[0] != 0:
+                slot = (slot + 1) & mask
+            SLOT.pack_into(table, slot * SLOT.size, h, k)
+
+        def pack(strings):
+            encoded = [x.encode() for x in strings]
+            offsets = [0]
+            for x in encoded:
+                offsets.append(offsets[-1] + len(x))
+            return b''.join(OFFSET.pack(x) for x in offsets), b''.join(encoded)
+
+        key_offsets, key_bytes = pack(keys)
+        id_offsets, id_bytes = pack(ids)
+
+        # Written aside then moved, concurrent readers never see partial indexes
+        fd, tempf = tempfile.mkstemp(dir=os.path.dirname(index_file), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(HEADER.pack(MAGIC, n_slots, len(ids), len(keys)))
+                f.write(table)
+                f.write(key_offsets)
+                f.write(b''.join(OFFSET.pack(x) for x in keys.values()))
+                f.write(id_offsets)
+                f.write(key_bytes)
+                f.write(id_bytes)
+            os.replace(tempf, index_file)
+        except BaseException:
+            os.remove(tempf)
+            raise
+
+    def lookup(self, key: str) -> Optional[str]:
+        """Find a compound by InChI or InChIKey.
+
+        Parameters
+        ----------
+        key: str
+            InChI or InChIKey.
+
+        Return
+        ------
+        Optional[str]
+            Id of the compound in the sink, None if absent.
+        """
+        key = SinkIndex.normalize(key)
+        encoded = key.encode()
+        h = SinkIndex.hash(key)
+        mask = self._n_slots - 1
+        slot = h & mask
+        while True:
+            slot_h, k = SLOT.unpack_from(self._mm, HEADER.size + slot * SLOT.size)
+            if slot_h == 0:
+                return None
+            if slot_h == h:
+                # Same hash, different keys are told apart by the key itself
+                start, end = struct.unpack_from(
+                    '<QQ', self._mm, self._key_offsets + k * OFFSET.size
+                )
+                if self._mm[self._keys + start:self._keys + end] == encoded:
+                    i, = OFFSET.unpack_from(self._mm, self._key_ids + k * OFFSET.size)
+                    start, end = struct.unpack_from(
+                        '<QQ', self._mm, self._id_offsets + i * OFFSET.size
+                    )
+                    return self._mm[self._ids + start:self._ids + end].decode()
+            slot = (slot + 1) & mask
+
+    def lookup_many(self, keys: Iterable[str]) -> Dict[str, Optional[str]]:
+        """Find many compounds at once, see lookup().
+
+        Return
+        ------
+        Dict[str, Optional[str]]
+        """
+        return {key: self.lookup(key) for key in keys}
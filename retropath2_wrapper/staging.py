@@ -0,0 +1,224 @@
+"""
+Cache of KNIME-ready input files shared across runs.
+
+Preparing the rules for KNIME (decompression, filtering on diameters and
+score) gives the same file for every job using the same rules and the
+same parameters. Prepared files are kept in a folder shared by all
+processes, keyed on the content of the original file and on the
+preparation parameters, and hard linked into the staging folder of each
+run so that eviction never affects a running job.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from glob import glob
+from logging import (
+    Logger,
+    getLogger
+)
+from typing import (
+    Callable,
+    Dict,
+)
+
+from retropath2_wrapper.Args import DEFAULTS
+from retropath2_wrapper.cache import hash_file
+
+
+STAGING_VERSION = 1
+
+
+class StagingCache(object):
+    """Content-addressed cache of prepared input files.
+
+    Attributes
+    ----------
+    path: str
+        directory where prepared files are stored
+    max_size: int
+        maximal size of the cache, in bytes
+    max_age: int
+        prepared files not used since max_age seconds are evicted
+    """
+
+    def __init__(
+            self,
+            path: str = DEFAULTS['STAGING_FOLDER'],
+            max_size: int = DEFAULTS['STAGING_SIZE'],
+            max_age: int = DEFAULTS['STAGING_AGE'],
+        ) -> None:
+        self.path = os.path.abspath(path)
+        self.max_size = max_size
+        self.max_age = max_age
+        os.makedirs(os.path.join(self.path, 'digests'), exist_ok=True)
+
+    def __repr__(self):
+        s = []
+        s.append(f"path: {self.path}")
+        s.append(f"max_size: {self.max_size}")
+        s.append(f"max_age: {self.max_age}")
+        return "\n".join(s)
+
+    def digest(self, path: str) -> str:
+        """Digest of a file content, remembered across processes
+        on the path, size and modification time of the file.
+
+        Return
+        ------
+        str
+        """
+        path = os.path.realpath(path)
+        stat = os.stat(path)
+        memo = os.path.join(
+            self.path,
+            'digests',
+            hashlib.sha256(f'{path}|{stat.st_size}|{stat.st_mtime_ns}'.encode()).hexdigest()
+        )
+        try:
+            with open(memo, 'r') as f:
+                digest = f.read().strip()
+            # Mark memo as recently used, evicted with the entries otherwise
+            os.utime(memo)
+            return digest
+        except FileNotFoundError:
+            pass
+        digest = hash_file(path)
+        fd, tempf = tempfile.mkstemp(dir=os.path.dirname(memo), suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            f.write(digest)
+        os.replace(tempf, memo)
+        return digest
+
+    def key(self, path: str, variant: Dict) -> str:
+        content = {
+            'version': STAGING_VERSION,
+            'digest': self.digest(path),
+            'variant': variant,
+        }
+        return hashlib.sha256(
+            json.dumps(content, sort_keys=True, default=str).encode()
+        ).hexdigest()
+
+    def stage(
+        self,
+        path: str,
+        indir: str,
+        variant: Dict,
+        build: Callable[[str], str],
+        logger: Logger = getLogger(__name__)
+    ) -> str:
+        """Provide the prepared version of a file into indir.
+
+        Parameters
+        ----------
+        path: str
+            Path of the original file.
+        indir: str
+            Staging folder of the run.
+        variant: Dict
+            Parameters of the preparation.
+        build: Callable[[str], str]
+            Prepare the file into the given folder and return its path.
+            Returning a path outside of this folder means that the file
+            does not need to be prepared, and nothing is cached.
+        logger : Logger
+            The logger object.
+
+        Return
+        ------
+        str
+            Path of the prepared file.
+        """
+        key = self.key(path, variant)
+        entry = os.path.join(self.path, key + '.csv')
+        dst = os.path.join(indir, key + '.csv')
+
+        for _ in range(2):
+            if os.path.exists(entry):
+                logger.info(f'   |- Staged file found in cache: {entry}')
+            else:
+                tempd = tempfile.mkdtemp(dir=self.path, prefix='.tmp_')
+                try:
+                    built = build(tempd)
+                    if os.path.dirname(os.path.abspath(built)) != tempd:
+                        return built
+                    # Concurrent builders write the same content, last one wins
+                    os.replace(built, entry)
+                finally:
+                    shutil.rmtree(tempd, ignore_errors=True)
+                self.evict(keep=entry, logger=logger)
+            try:
+                # Mark entry as recently used
+                os.utime(entry)
+                self.link(entry, dst)
+                return dst
+            except FileNotFoundError:
+                # Evicted by a concurrent process in the meantime
+                continue
+
+        raise RuntimeError(f'Could not stage {path}')
+
+    @classmethod
+    def link(cls, src: str, dst: str) -> None:
+        """Hard link src to dst, copy if not possible."""
+        try:
+            os.link(src, dst)
+        except FileNotFoundError:
+            raise
+        except OSError:
+            shutil.copyfile(src, dst)
+
+    def evict(
+        self,
+        keep: str = '',
+        logger: Logger = getLogger(__name__)
+    ) -> int:
+        """Remove prepared files not used since max_age, then least
+        recently used ones until the cache fits in max_size. Digests
+        not used since max_age (e.g. of files changed since) are removed
+        too.
+
+        Parameters
+        ----------
+        keep: str
+            Path of an entry never to evict.
+
+        Return
+        ------
+        int
+            Number of evicted entries.
+        """
+        now = time.time()
+        entries = []
+        for entry in glob(os.path.join(self.path, '*.csv')):
+            try:
+                stat = os.stat(entry)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry))
+        total = sum(x[1] for x in entries)
+
+        count = 0
+        for mtime, size, entry in sorted(entries):
+            if entry == keep:
+                continue
+            if total <= self.max_size and now - mtime <= self.max_age:
+                continue
+            logger.debug(f'Evict staged file: {entry}')
+            try:
+                os.remove(entry)
+            except FileNotFoundError:
+                pass
+            total -= size
+            count += 1
+
+        for memo in glob(os.path.join(self.path, 'digests', '*')):
+            try:
+                if now - os.stat(memo).st_mtime > self.max_age:
+                    os.remove(memo)
+            except FileNotFoundError:
+                continue
+        return count
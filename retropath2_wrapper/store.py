@@ -0,0 +1,457 @@
+"""
+SQLite store of the results of many runs.
+
+The results (and scope membership) of each run are loaded into a single
+database, so that questions across runs ("which runs produced this
+compound?", "which rules fire most?") are answered from indexes instead
+of reading every output folder again.
+
+Compounds are stored once, by InChI, with their InChIKey when RDKit is
+available. Each row of a results file becomes a product of a
+transformation, the rule ids and EC numbers of a transformation being
+rows of their own tables. Rows are inserted in bulk, in one transaction
+per run, and the database may be shared by concurrent runs (batch jobs).
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+from glob import glob
+from logging import (
+    Logger,
+    getLogger
+)
+from typing import (
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+)
+
+from retropath2_wrapper.Args import DEFAULTS
+from retropath2_wrapper.outputs import iter_rows
+from retropath2_wrapper.report import REPORT_FILE
+
+try:
+    from rdkit import RDLogger
+    from rdkit.Chem.inchi import InchiToInchiKey
+    RDLogger.DisableLog('rdApp.*')
+except ImportError:
+    InchiToInchiKey = None
+
+
+STORE_VERSION = 1
+# Rows inserted at once
+BATCH_SIZE = 10000
+# Below the limit of host parameters of old SQLite versions
+MAX_PARAMS = 900
+# Parameters of the workflow kept with each run, indexed together
+PARAMS = ['workflow', 'max_steps', 'topx', 'dmin', 'dmax', 'mwmax_source', 'std_hydrogen']
+
+SCHEMA = f'''
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    outdir TEXT NOT NULL UNIQUE,
+    source_inchi TEXT,
+    r_code INTEGER,
+    ingested REAL,
+    {", ".join(x + " " + ("TEXT" if x in ["workflow", "std_hydrogen"] else "INTEGER") for x in PARAMS)}
+);
+CREATE TABLE IF NOT EXISTS compounds (
+    id INTEGER PRIMARY KEY,
+    inchi TEXT NOT NULL UNIQUE,
+    inchikey TEXT,
+    smiles TEXT
+);
+CREATE TABLE IF NOT EXISTS transformations (
+    id INTEGER PRIMARY KEY,
+    run_id INTEGER NOT NULL,
+    transformation_id TEXT NOT NULL,
+    substrate_id INTEGER NOT NULL,
+    reaction_smiles TEXT,
+    diameter INTEGER,
+    score REAL,
+    iteration INTEGER,
+    in_scope INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS products (
+    transformation_id INTEGER NOT NULL,
+    compound_id INTEGER NOT NULL,
+    in_sink INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS rules (
+    transformation_id INTEGER NOT NULL,
+    rule_id TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS ec_numbers (
+    transformation_id INTEGER NOT NULL,
+    ec_number TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_params ON runs ({", ".join(PARAMS)});
+CREATE INDEX IF NOT EXISTS runs_source ON runs (source_inchi);
+CREATE INDEX IF NOT EXISTS compounds_inchikey ON compounds (inchikey);
+CREATE INDEX IF NOT EXISTS transformations_run ON transformations (run_id, transformation_id);
+CREATE INDEX IF NOT EXISTS transformations_substrate ON transformations (substrate_id);
+CREATE INDEX IF NOT EXISTS products_transformation ON products (transformation_id);
+CREATE INDEX IF NOT EXISTS products_compound ON products (compound_id);
+CREATE INDEX IF NOT EXISTS rules_transformation ON rules (transformation_id);
+CREATE INDEX IF NOT EXISTS rules_rule ON rules (rule_id);
+CREATE INDEX IF NOT EXISTS ec_numbers_transformation ON ec_numbers (transformation_id);
+CREATE INDEX IF NOT EXISTS ec_numbers_ec_number ON ec_numbers (ec_number);
+PRAGMA user_version = {STORE_VERSION};
+'''
+
+
+def inchikey(inchi: str) -> Optional[str]:
+    """InChIKey of an InChI, None without RDKit."""
+    if InchiToInchiKey is None:
+        return None
+    return InchiToInchiKey(inchi) or None
+
+
+def chunks(items: List, size: int) -> Iterable[List]:
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class ResultStore(object):
+    """Database of the results of many runs.
+
+    Attributes
+    ----------
+    path: str
+        path of the SQLite database
+    timeout: float
+        seconds to wait for a concurrent writer
+    """
+
+    def __init__(
+            self,
+            path: str = DEFAULTS['STORE_FILE'],
+            timeout: float = 600,
+        ) -> None:
+        self.path = os.path.abspath(path)
+        self.timeout = timeout
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        conn = self.connect()
+        try:
+            conn.executescript(SCHEMA)
+        finally:
+            conn.close()
+
+    def __repr__(self):
+        s = []
+        s.append(f"path: {self.path}")
+        s.append(f"timeout: {self.timeout}")
+        return "\n".join(s)
+
+    def connect(self) -> sqlite3.Connection:
+        """Open a connection, one for each thread or process. Transactions
+        are left to the caller (autocommit mode)."""
+        conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        return conn
+
+    def ingest(
+        self,
+        outdir: str,
+        params: Optional[Dict] = None,
+        r_code: Optional[int] = None,
+        results: str = 'results.csv',
+        logger: Logger = getLogger(__name__)
+    ) -> Optional[int]:
+        """Load the results of a run, replacing the ones of a previous
+        ingestion of the same folder. Transformations found in a scope file
+        (*_scope.csv) of the folder are flagged as such.
+
+        Parameters
+        ----------
+        outdir: str
+            Output folder of the run.
+        params: Optional[Dict]
+            Parameters of the workflow, see PARAMS.
+        r_code: Optional[int]
+            Return code of the run.
+        results: str
+            Name of the results file in outdir.
+        logger : Logger
+            The logger object.
+
+        Return
+        ------
+        Optional[int]
+            Number of rows loaded, None if the database could not be written.
+        """
+        outdir = os.path.abspath(outdir)
+        params = params or {}
+        path = os.path.join(outdir, results)
+        conn = self.connect()
+        try:
+            # Write lock held until commit, ids below are not taken by others
+            conn.execute('BEGIN IMMEDIATE')
+            self._delete(conn, outdir)
+            run_id = conn.execute(
+                f'INSERT INTO runs (outdir, r_code, ingested, {", ".join(PARAMS)}) '
+                f'VALUES ({", ".join("?" * (len(PARAMS) + 3))})',
+                [outdir, r_code, time.time()] + [params.get(x) for x in PARAMS],
+            ).lastrowid
+            rows = 0
+            if os.path.exists(path):
+                rows = self._load(conn, run_id, path)
+            for scope in sorted(glob(os.path.join(outdir, '*_scope.csv'))):
+                self._flag_scope(conn, run_id, scope)
+            conn.execute('COMMIT')
+        except (sqlite3.Error, ValueError) as e:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            logger.warning(f'Results not stored into {self.path}: {e}')
+            return None
+        finally:
+            conn.close()
+        logger.debug(f'{rows} rows stored into {self.path}')
+        return rows
+
+    @classmethod
+    def _delete(cls, conn: sqlite3.Connection, outdir: str) -> None:
+        row = conn.execute('SELECT id FROM runs WHERE outdir = ?', (outdir,)).fetchone()
+        if row is None:
+            return
+        trs = 'SELECT id FROM transformations WHERE run_id = ?'
+        for table in ['products', 'rules', 'ec_numbers']:
+            conn.execute(f'DELETE FROM {table} WHERE transformation_id IN ({trs})', row)
+        conn.execute('DELETE FROM transformations WHERE run_id = ?', row)
+        conn.execute('DELETE FROM runs WHERE id = ?', row)
+
+    @classmethod
+    def _compound_ids(
+        cls,
+        conn: sqlite3.Connection,
+        compounds: Dict[str, str],
+        ids: Dict[str, int],
+    ) -> None:
+        """Insert compounds (SMILES by InChI) missing from ids, then read
+        their ids into ids."""
+        new = [x for x in compounds if x not in ids]
+        if not new:
+            return
+        conn.executemany(
+            'INSERT OR IGNORE INTO compounds (inchi, inchikey, smiles) VALUES (?, ?, ?)',
+            ((x, inchikey(x), compounds[x]) for x in new),
+        )
+        for chunk in chunks(new, MAX_PARAMS):
+            ids.update(
+                (inchi, i) for i, inchi in conn.execute(
+                    f'SELECT id, inchi FROM compounds WHERE inchi IN ({", ".join("?" * len(chunk))})',
+                    chunk,
+                )
+            )
+
+    def _load(self, conn: sqlite3.Connection, run_id: int, path: str) -> int:
+        next_id = conn.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM transformations').fetchone()[0]
+        trs_ids = {}
+        compound_ids = {}
+        source_inchi = None
+        rows = 0
+        batch = []
+
+        def flush():
+            compounds = {}
+            for row in batch:
+                compounds.setdefault(row.substrate_inchi, row.substrate_smiles)
+                compounds.setdefault(row.product_inchi, row.product_smiles)
+            self._compound_ids(conn, compounds, compound_ids)
+            transformations = []
+            rules = []
+            ec_numbers = []
+            products = []
+            for row in batch:
+                t = trs_ids.get(row.transformation_id)
+                if t is None:
+                    t = trs_ids[row.transformation_id] = next_id + len(trs_ids)
+                    transformations.append((
+                        t, run_id, row.transformation_id, compound_ids[row.substrate_inchi],
+                        row.reaction_smiles, row.diameter, row.score, row.iteration,
+                    ))
+                    rules += [(t, x) for x in row.rule_ids]
+                    ec_numbers += [(t, x) for x in row.ec_numbers]
+                products.append((t, compound_ids[row.product_inchi], int(row.in_sink)))
+            conn.executemany(
+                'INSERT INTO transformations (id, run_id, transformation_id, substrate_id, '
+                'reaction_smiles, diameter, score, iteration) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                transformations,
+            )
+            conn.executemany('INSERT INTO rules VALUES (?, ?)', rules)
+            conn.executemany('INSERT INTO ec_numbers VALUES (?, ?)', ec_numbers)
+            conn.executemany('INSERT INTO products VALUES (?, ?, ?)', products)
+            batch.clear()
+
+        for row in iter_rows(path):
+            if source_inchi is None and row.iteration == 0:
+                source_inchi = row.substrate_inchi
+            batch.append(row)
+            rows += 1
+            if len(batch) >= BATCH_SIZE:
+                flush()
+        flush()
+        conn.execute('UPDATE runs SET source_inchi = ? WHERE id = ?', (source_inchi, run_id))
+        return rows
+
+    @classmethod
+    def _flag_scope(cls, conn: sqlite3.Connection, run_id: int, path: str) -> None:
+        names = list({row.transformation_id: None for row in iter_rows(path)})
+        for chunk in chunks(names, MAX_PARAMS):
+            conn.execute(
+                'UPDATE transformations SET in_scope = 1 WHERE run_id = ? '
+                f'AND transformation_id IN ({", ".join("?" * len(chunk))})',
+                [run_id] + chunk,
+            )
+
+    def runs(self, **params) -> List[Dict]:
+        """Runs of the store, filtered on the values of parameters."""
+        unknown = set(params) - set(PARAMS) - {'outdir', 'source_inchi', 'r_code'}
+        if unknown:
+            raise ValueError(f'Unknown parameters: {", ".join(sorted(unknown))}')
+        where = ' AND '.join(f'{x} = ?' for x in params) or '1'
+        return self.query(f'SELECT * FROM runs WHERE {where} ORDER BY id', list(params.values()))
+
+    def producers(self, compound: str) -> List[Dict]:
+        """Runs and transformations producing a compound, given by InChI or
+        InChIKey."""
+        return self.query(
+            'SELECT r.outdir, r.source_inchi, t.transformation_id, t.iteration, t.score, '
+            'p.in_sink, t.in_scope FROM compounds c '
+            'JOIN products p ON p.compound_id = c.id '
+            'JOIN transformations t ON t.id = p.transformation_id '
+            'JOIN runs r ON r.id = t.run_id '
+            'WHERE c.inchi = ? OR c.inchikey = ? ORDER BY r.id, t.id',
+            [compound, compound],
+        )
+
+    def top(self, column: str, limit: Optional[int] = None) -> List[Dict]:
+        """Rule ids ('rule_id') or EC numbers ('ec_number') by number of
+        transformations, with the number of runs they occur in."""
+        table = {'rule_id': 'rules', 'ec_number': 'ec_numbers'}[column]
+        return self.query(
+            f'SELECT x.{column}, COUNT(*) AS transformations, COUNT(DISTINCT t.run_id) AS runs '
+            f'FROM {table} x JOIN transformations t ON t.id = x.transformation_id '
+            f'GROUP BY x.{column} ORDER BY transformations DESC, x.{column} LIMIT ?',
+            [-1 if limit is None else limit],
+        )
+
+    def stats(self) -> Dict:
+        """Number of rows of each table."""
+        stats = {'path': self.path}
+        conn = self.connect()
+        try:
+            for table in ['runs', 'compounds', 'transformations', 'products', 'rules', 'ec_numbers']:
+                stats[table] = conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+        finally:
+            conn.close()
+        return stats
+
+    def query(self, sql: str, params: Iterable = ()) -> List[Dict]:
+        """Run a read-only query, rows as dictionaries."""
+        conn = self.connect()
+        try:
+            conn.execute('PRAGMA query_only = ON')
+            cursor = conn.execute(sql, list(params))
+            names = [x[0] for x in cursor.description or []]
+            return [dict(zip(names, row)) for row in cursor]
+        finally:
+            conn.close()
+
+
+def read_params(outdir: str) -> Tuple[Dict, Optional[int]]:
+    """Parameters and return code of a run from its report, if any."""
+    try:
+        with open(os.path.join(outdir, REPORT_FILE), 'r') as f:
+            report = json.load(f)
+    except (OSError, ValueError):
+        return {}, None
+    return report.get('params', {}), report.get('r_code')
+
+
+def _ingest(args) -> int:
+    store = ResultStore(path=args.store)
+    for outdir in args.outdir:
+        params, r_code = read_params(outdir)
+        rows = store.ingest(outdir, params=params, r_code=r_code)
+        if rows is None:
+            return 1
+        print(f'{outdir}: {rows} rows')
+    return 0
+
+
+def _print(rows: List[Dict]) -> None:
+    for row in rows:
+        print(json.dumps(row))
+
+
+def _stats(args) -> int:
+    print(json.dumps(ResultStore(path=args.store).stats(), indent=2))
+    return 0
+
+
+def _runs(args) -> int:
+    params = dict(x.split('=', 1) for x in args.param)
+    _print(ResultStore(path=args.store).runs(**params))
+    return 0
+
+
+def _producers(args) -> int:
+    _print(ResultStore(path=args.store).producers(args.compound))
+    return 0
+
+
+def _rules(args) -> int:
+    _print(ResultStore(path=args.store).top('rule_id', args.top))
+    return 0
+
+
+def _ec(args) -> int:
+    _print(ResultStore(path=args.store).top('ec_number', args.top))
+    return 0
+
+
+def _sql(args) -> int:
+    _print(ResultStore(path=args.store).query(args.query))
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='retropath2_wrapper.store')
+    subparsers = parser.add_subparsers(required=True)
+
+    for name, func, help in [
+        ("ingest", _ingest, "Load the results of output folders"),
+        ("stats", _stats, "Show the number of stored rows"),
+        ("runs", _runs, "List runs, filtered on parameters"),
+        ("producers", _producers, "List runs and transformations producing a compound"),
+        ("rules", _rules, "Rank rule ids by number of transformations"),
+        ("ec", _ec, "Rank EC numbers by number of transformations"),
+        ("sql", _sql, "Run a read-only SQL query"),
+    ]:
+        par = subparsers.add_parser(name, help=help)
+        par.add_argument(
+            "--store", default=DEFAULTS['STORE_FILE'], help="SQLite database of the results"
+        )
+        if name == "ingest":
+            par.add_argument("outdir", nargs='+', help="Output folders of runs")
+        elif name == "runs":
+            par.add_argument(
+                "--param", nargs='*', default=[], metavar='NAME=VALUE', help="Parameter values of the runs"
+            )
+        elif name == "producers":
+            par.add_argument("compound", help="InChI or InChIKey")
+        elif name in ["rules", "ec"]:
+            par.add_argument("--top", type=int, default=20, help="Number of rows")
+        elif name == "sql":
+            par.add_argument("query", help="SQL query")
+        par.set_defaults(func=func)
+
+    args = parser.parse_args()
+    sys.exit(args.func(args))
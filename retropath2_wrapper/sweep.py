@@ -0,0 +1,503 @@
+"""
+Run the RetroPath2.0 workflow on one target for each point of a parameter grid.
+
+The grid gives the values of some parameters (topx, dmin, dmax, max_steps,
+workflow version...), every combination being a point. Identical points
+are run once. Inputs are checked and the sink indexed once, rules are
+prepared once for each (dmin, dmax, min_rule_score) variant through a
+staging cache, and points are processed by a bounded pool of KNIME workspaces
+(shared by all workflow versions). Each point gets its own output folder and
+a table comparing the runtimes and numbers of solutions of the points is
+written into the sweep output folder.
+"""
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from csv import writer as csv_writer
+from itertools import product
+from os import (
+    makedirs,
+    path as os_path,
+)
+from re import sub
+from logging import (
+    Logger,
+    getLogger
+)
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import (
+    Dict,
+    List,
+    Tuple,
+)
+from colored import attr
+
+from brs_utils import create_logger
+
+from retropath2_wrapper.Args import (
+    DEFAULTS,
+    RETCODES,
+    RP2_VERSIONS,
+    build_sweep_args_parser,
+)
+from retropath2_wrapper.RetroPath2 import (
+    check_input,
+    check_results,
+    init_knime,
+    retropath2,
+)
+from retropath2_wrapper.early_stop import EarlyStop
+from retropath2_wrapper.knime import (
+    Knime,
+    KnimePool,
+)
+from retropath2_wrapper.options import (
+    build_cache,
+    build_staging,
+    build_store,
+    knime_options,
+    parse_std_hydrogen,
+)
+from retropath2_wrapper.progress import ProgressLogger
+from retropath2_wrapper.report import REPORT_FILE
+from retropath2_wrapper.sink_index import SinkIndex
+from retropath2_wrapper.staging import StagingCache
+
+
+SWEEP_FILE = 'sweep.csv'
+# Parameters which can be swept, with their type
+SWEEP_PARAMS = {
+    'topx': int,
+    'dmin': int,
+    'dmax': int,
+    'max_steps': int,
+    'mwmax_source': int,
+    'min_rule_score': float,
+    'msc_timeout': int,
+    'rp2_version': str,
+}
+
+
+def parse_grid(specs: List[str]) -> Dict[str, List]:
+    """
+    Parse the values of the swept parameters.
+
+    Parameters
+    ----------
+    specs : List[str]
+        Values as 'param=v1,v2,...'.
+
+    Returns
+    -------
+    Dict[str, List] Values by parameter.
+
+    Raises
+    ------
+    ValueError
+        If a parameter can not be swept or a value is malformed.
+
+    """
+    grid = {}
+    for spec in specs:
+        name, sep, values = spec.partition('=')
+        name = name.strip()
+        if not sep or name not in SWEEP_PARAMS:
+            raise ValueError(f'{spec}: expected PARAM=V1,V2 with PARAM among {", ".join(SWEEP_PARAMS)}')
+        try:
+            grid.setdefault(name, []).extend(
+                SWEEP_PARAMS[name](x.strip()) for x in values.split(',') if x.strip()
+            )
+        except ValueError:
+            raise ValueError(f'{spec}: {name} expects {SWEEP_PARAMS[name].__name__} values')
+        if grid[name] == []:
+            raise ValueError(f'{spec}: no value')
+    for version in grid.get('rp2_version', []):
+        if version not in RP2_VERSIONS:
+            raise ValueError(f'rp2_version={version}: expected one of {", ".join(RP2_VERSIONS)}')
+    return grid
+
+
+def expand_grid(grid: Dict[str, List]) -> List[Dict]:
+    """
+    List the points of a grid, identical points once.
+
+    Parameters
+    ----------
+    grid : Dict[str, List]
+        Values by parameter, as returned by parse_grid().
+
+    Returns
+    -------
+    List[Dict] Points with 'name' and 'params' keys, in grid order.
+
+    """
+    names = list(grid)
+    points = []
+    seen = set()
+    for values in product(*[grid[name] for name in names]):
+        params = dict(zip(names, values))
+        key = json.dumps(params, sort_keys=True)
+        if key in seen:
+            continue
+        seen.add(key)
+        name = '_'.join(f'{k}-{v}' for k, v in params.items()) or 'default'
+        points.append({'name': sub(r'[^\w.-]+', '_', name), 'params': params})
+    return points
+
+
+def read_point(point: Dict, logger: Logger = getLogger(__name__)) -> None:
+    """
+    Read the runtimes and the number of solutions of a processed point.
+
+    Parameters
+    ----------
+    point : Dict
+        Point with 'outdir' key, 'elapsed', 'knime_elapsed', 'rows' and
+        'solutions' keys are set.
+    logger : Logger
+        The logger object.
+
+    """
+    try:
+        with open(os_path.join(point['outdir'], REPORT_FILE)) as f:
+            report = json.load(f)
+        point['knime_elapsed'] = report['knime'].get('elapsed')
+    except (OSError, ValueError, KeyError) as e:
+        logger.debug(f'{point["name"]}: no run report ({e})')
+        point['knime_elapsed'] = None
+    point['solutions'], point['rows'] = EarlyStop.count_solutions(
+        os_path.join(point['outdir'], 'results.csv')
+    )
+
+
+def run_point(
+    point: Dict,
+    sink_file: str,
+    source_file: str,
+    rules_file: str,
+    std_hydrogen: str,
+    knime: Knime,
+    logger: Logger = getLogger(__name__),
+    **kwargs
+) -> int:
+    """
+    Run the workflow for one point of a sweep.
+
+    Parameters
+    ----------
+    point : Dict
+        The point, with 'name', 'params' and 'outdir' keys.
+    sink_file : str
+        Path to file containing the sink.
+    source_file : str
+        Path to file containing the source.
+    rules_file : str
+        Path to file containing the rules.
+    std_hydrogen : str
+        Standardization mode of the workflow.
+    knime : Knime
+        The Knime object running the workflow version of the point.
+    logger : Logger
+        The logger object.
+    kwargs
+        Other parameters of retropath2().
+
+    Returns
+    -------
+    int Return code.
+
+    """
+    params = {k: v for k, v in point['params'].items() if k != 'rp2_version'}
+    progress = kwargs.pop('progress', None)
+    if progress is not None:
+        # Tell points apart in progress events
+        kwargs['progress'] = lambda event: progress(event._replace(job=point['name']))
+
+    start = perf_counter()
+    try:
+        r_code, result_files = retropath2(
+            sink_file=sink_file,
+            source_file=source_file,
+            rules_file=rules_file,
+            outdir=point['outdir'],
+            std_hydrogen=std_hydrogen,
+            knime=knime,
+            rp2_version=None,
+            logger=logger,
+            **dict(kwargs, **params)
+        )
+    except Exception as e:
+        # A failing point must not stop the whole sweep
+        logger.error(f'{point["name"]}: {e}')
+        r_code = RETCODES['OSError']
+    else:
+        if r_code == RETCODES['OK']:
+            r_code = check_results(result_files, logger)
+    point['elapsed'] = perf_counter() - start
+    read_point(point, logger)
+    return r_code
+
+
+def write_table(
+    points: List[Dict],
+    outdir: str,
+    logger: Logger = getLogger(__name__)
+) -> str:
+    """
+    Write the comparison of the points into the sweep output folder.
+
+    Parameters
+    ----------
+    points : List[Dict]
+        Processed points.
+    outdir : str
+        Sweep output folder.
+    logger : Logger
+        The logger object.
+
+    Returns
+    -------
+    str Path of the table.
+
+    """
+    retcodes = {}
+    for key, value in RETCODES.items():
+        retcodes.setdefault(value, key)
+    names = []
+    for point in points:
+        names += [x for x in point['params'] if x not in names]
+
+    table_file = os_path.join(outdir, SWEEP_FILE)
+    with open(table_file, 'w', newline='') as f:
+        f_writer = csv_writer(f, quotechar='"')
+        f_writer.writerow(
+            ['Name'] + names
+            + ['Outdir', 'Return code', 'Status', 'Elapsed (s)', 'KNIME elapsed (s)', 'Results rows', 'Solutions']
+        )
+        for point in points:
+            f_writer.writerow(
+                [point['name']] + [point['params'].get(x, '') for x in names]
+                + [
+                    point['outdir'],
+                    point['r_code'],
+                    retcodes.get(point['r_code'], 'KNIME'),
+                    '' if point.get('elapsed') is None else round(point['elapsed'], 3),
+                    '' if point.get('knime_elapsed') is None else round(point['knime_elapsed'], 3),
+                    point.get('rows', ''),
+                    point.get('solutions', ''),
+                ]
+            )
+
+    for point in points:
+        logger.info('   |- {name}: {status}, {solutions} solutions, {elapsed:.1f}s'.format(
+            name=point['name'],
+            status=retcodes.get(point['r_code'], 'KNIME'),
+            solutions=point.get('solutions', 0),
+            elapsed=point.get('elapsed') or 0,
+        ))
+
+    return table_file
+
+
+def retropath2_sweep(
+    sink_file: str,
+    source_file: str,
+    rules_file: str,
+    outdir: str,
+    grid: Dict[str, List],
+    std_hydrogen: str,
+    knime: Knime | None = None,
+    jobs: int = DEFAULTS['JOBS'],
+    rp2_version: str = DEFAULTS['RP2_VERSION'],
+    staging: StagingCache | None = None,
+    sink_index_dir: str | None = None,
+    logger: Logger = getLogger(__name__),
+    **kwargs
+) -> Tuple[int, List[Dict]]:
+    """
+    Run the workflow on one target for each point of a parameter grid.
+
+    Parameters
+    ----------
+    sink_file : str
+        Path to file containing the sink.
+    source_file : str
+        Path to file containing the source.
+    rules_file : str
+        Path to file containing the rules.
+    outdir : str
+        Sweep output folder, one subfolder is created per point.
+    grid : Dict[str, List]
+        Values of the swept parameters, see parse_grid().
+    std_hydrogen : str
+        Standardization mode of the workflow.
+    knime : Knime | None
+        The Knime object whose installation and options are used by the
+        pool of `jobs` slots shared by all workflow versions.
+    jobs : int
+        Number of points processed concurrently.
+    rp2_version : str
+        Version of the RetroPath2.0 workflow, if not swept.
+    staging : StagingCache | None
+        Cache of prepared rules, a temporary one is used if None.
+    sink_index_dir : str | None
+        Folder of persistent sink indexes, a temporary index shared by
+        all points is used if None.
+    logger : Logger
+        The logger object.
+    kwargs
+        Other parameters of retropath2() (topx, dmin...), for all points.
+
+    Returns
+    -------
+    Tuple[int, List[Dict]] Return code and processed points.
+
+    """
+    logger.debug(f'grid: {grid}')
+    logger.debug(f'jobs: {jobs}')
+
+    points = expand_grid(grid)
+    logger.info('{attr1}Sweeping {n} points{attr2}'.format(
+        attr1=attr('bold'), n=len(points), attr2=attr('reset'))
+    )
+
+    with TemporaryDirectory() as tempd:
+        try:
+            # Index of the sweep only, unless a folder of indexes is given
+            sink_index = SinkIndex(sink_file, path=sink_index_dir or tempd, logger=logger)
+        except FileNotFoundError as e:
+            logger.error(e)
+            return RETCODES['FileNotFound'], points
+        except ValueError as e:
+            logger.error(e)
+            return RETCODES['SinkFileMalformed'], points
+
+        pool = None
+        try:
+            # Same target for all points, checked once
+            r_code, _ = check_input(source_file, sink_file, logger, sink_index)
+            if r_code != RETCODES['OK']:
+                return r_code, points
+
+            makedirs(outdir, exist_ok=True)
+            for point in points:
+                point['outdir'] = os_path.join(outdir, point['name'])
+
+            # One set of `jobs` slots and one installation for all workflow versions
+            pool = KnimePool(
+                kinstall=DEFAULTS['KNIME_FOLDER'] if knime is None else knime.kinstall,
+                size=jobs,
+                **({} if knime is None else knime.options()),
+            )
+            pool = init_knime(knime=pool, rp2_version=None, logger=logger)
+            pools = {}
+            for point in points:
+                version = point['params'].get('rp2_version', rp2_version)
+                if version not in pools:
+                    pools[version] = init_knime(knime=pool.share(), rp2_version=version, logger=logger)
+
+            if staging is None:
+                staging = StagingCache(path=os_path.join(tempd, 'staging'))
+            with ThreadPoolExecutor(max_workers=jobs) as executor:
+                futures = [
+                    executor.submit(
+                        run_point,
+                        point=point,
+                        sink_file=sink_file,
+                        source_file=source_file,
+                        rules_file=rules_file,
+                        std_hydrogen=std_hydrogen,
+                        knime=pools[point['params'].get('rp2_version', rp2_version)],
+                        staging=staging,
+                        sink_index=sink_index,
+                        logger=logger,
+                        **kwargs
+                    )
+                    for point in points
+                ]
+                for point, future in zip(points, futures):
+                    point['r_code'] = future.result()
+        finally:
+            sink_index.close()
+            if pool is not None:
+                pool.shutdown()
+
+    logger.info('{attr1}Summary{attr2}'.format(attr1=attr('bold'), attr2=attr('reset')))
+    table_file = write_table(points, outdir, logger)
+    logger.info('   |--path: ' + table_file)
+
+    for point in points:
+        if point['r_code'] not in [RETCODES['OK'], RETCODES['SrcInSink'], RETCODES['NoSolution']]:
+            return point['r_code'], points
+    return RETCODES['OK'], points
+
+
+def _cli():
+    parser = build_sweep_args_parser()
+    args = parser.parse_args()
+
+    if args.source_file is None:
+        parser.error("--source_file is mandatory in sweep mode.")
+    if args.jobs < 1:
+        parser.error("--jobs should be a positive integer.")
+    try:
+        grid = parse_grid(args.grid)
+    except ValueError as e:
+        parser.error(f"--grid: {e}")
+
+    if args.log.lower() in ['silent', 'quiet'] or args.silent:
+        args.log = 'CRITICAL'
+
+    # Create logger
+    logger = create_logger(parser.prog, args.log)
+    logger.debug('args: ' + str(args))
+
+    std_hydrogen = parse_std_hydrogen(parser, args, logger)
+
+    # Parameters not swept keep their value for all points
+    params = {
+        'max_steps': args.max_steps,
+        'topx': args.topx,
+        'dmin': args.dmin,
+        'dmax': args.dmax,
+        'mwmax_source': args.mwmax_source,
+        'msc_timeout': args.msc_timeout,
+        'min_rule_score': args.min_rule_score,
+    }
+    for name in grid:
+        params.pop(name, None)
+
+    r_code, points = retropath2_sweep(
+        sink_file=args.sink_file,
+        source_file=args.source_file,
+        rules_file=args.rules_file,
+        outdir=args.outdir,
+        grid=grid,
+        std_hydrogen=std_hydrogen,
+        knime=Knime(kinstall=args.kinstall, **knime_options(args)),
+        jobs=args.jobs,
+        rp2_version=args.rp2_version,
+        staging=build_staging(args),
+        sink_index_dir=args.sink_index_dir,
+        cache=build_cache(args),
+        store=build_store(args),
+        prefilter_rules=args.prefilter_rules,
+        timeout=args.timeout,
+        cpu_timeout=args.cpu_timeout,
+        progress=ProgressLogger(logger) if args.progress else None,
+        stop_solutions=args.stop_solutions,
+        stop_iterations=args.stop_iterations,
+        columnar=args.columnar,
+        logger=logger,
+        **params
+    )
+
+    if args.quiet:
+        r_code = RETCODES['OK']
+
+    return r_code
+
+
+if __name__ == '__main__':
+    sys.exit(_cli())
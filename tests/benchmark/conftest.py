@@ -0,0 +1,125 @@
+"""
+Benchmarks of the wrapper-side costs, KNIME being replaced by fake_knime.py.
+
+They are skipped unless RP2_BENCHMARK is set, and use the following
+environment variables:
+
+- RP2_BENCHMARK_ROWS: sizes of the synthetic sinks and rule sets,
+  comma-separated (default: 10000,100000)
+- RP2_BENCHMARK_OUT: path of a JSON file where timings are written
+- RP2_BENCHMARK_BASELINE: path of timings written by a previous session,
+  a benchmark fails if slower than its baseline by more than
+  RP2_BENCHMARK_TOLERANCE (default: 0.5, i.e. 50%)
+"""
+import csv
+import gzip
+import itertools
+import json
+import os
+import statistics
+import time
+
+import pytest
+
+
+SIZES = [int(x) for x in os.environ.get("RP2_BENCHMARK_ROWS", "10000,100000").split(",")]
+TOLERANCE = float(os.environ.get("RP2_BENCHMARK_TOLERANCE", 0.5))
+
+TIMINGS = {}
+
+
+class Bench(object):
+    """Time a function, record the timing, check it against the baseline."""
+
+    def __init__(self, baseline: dict) -> None:
+        self.baseline = baseline
+
+    def __call__(self, name, func, *args, repeat=3, **kwargs):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = func(*args, **kwargs)
+            timings.append(time.perf_counter() - start)
+        TIMINGS[name] = {"min": min(timings), "median": statistics.median(timings), "repeat": repeat}
+        previous = self.baseline.get(name)
+        if previous is not None:
+            limit = previous["min"] * (1 + TOLERANCE)
+            assert min(timings) <= limit, f"{name}: {min(timings):.3f}s, baseline {previous['min']:.3f}s"
+        return result
+
+
+def pytest_generate_tests(metafunc):
+    if "rows" in metafunc.fixturenames:
+        metafunc.parametrize("rows", SIZES)
+
+
+def pytest_sessionfinish(session, exitstatus):
+    path = os.environ.get("RP2_BENCHMARK_OUT")
+    if path and TIMINGS:
+        with open(path, "w") as fod:
+            json.dump(TIMINGS, fod, indent=2, sort_keys=True)
+
+
+@pytest.fixture(scope="session")
+def bench():
+    baseline = {}
+    path = os.environ.get("RP2_BENCHMARK_BASELINE")
+    if path:
+        with open(path) as fid:
+            baseline = json.load(fid)
+    return Bench(baseline)
+
+
+@pytest.fixture(scope="session")
+def make_rules(tmp_path_factory, rulesd12_csv):
+    """Build synthetic rule sets of n rows from the recorded rules,
+    spread over diameters 2 to 16 with various scores."""
+    path = tmp_path_factory.mktemp("rules")
+    with gzip.open(rulesd12_csv, "rt") as fid:
+        f_reader = csv.reader(fid)
+        header = next(f_reader)
+        rows = list(f_reader)
+    i_id, i_diameter, i_score = [header.index(x) for x in ["Rule ID", "Diameter", "Score"]]
+    built = {}
+
+    def make(n: int) -> str:
+        if n not in built:
+            built[n] = str(path / f"rules_{n}.csv.gz")
+            with gzip.open(built[n], "wt", newline="", compresslevel=1) as fod:
+                f_writer = csv.writer(fod)
+                f_writer.writerow(header)
+                for i, row in zip(range(n), itertools.cycle(rows)):
+                    row = list(row)
+                    diameter = 2 * (i % 8 + 1)
+                    row[i_id] = f"RR-{i:08d}-{diameter}"
+                    row[i_diameter] = diameter
+                    row[i_score] = (i % 100) / 10
+                    f_writer.writerow(row)
+        return built[n]
+
+    return make
+
+
+@pytest.fixture(scope="session")
+def make_sink(tmp_path_factory, lycopene_sink_csv):
+    """Build synthetic sinks of n compounds, the recorded sink first."""
+    path = tmp_path_factory.mktemp("sink")
+    with open(lycopene_sink_csv) as fid:
+        f_reader = csv.reader(fid)
+        header = next(f_reader)
+        rows = list(f_reader)
+    built = {}
+
+    def make(n: int) -> str:
+        if n not in built:
+            built[n] = str(path / f"sink_{n}.csv")
+            with open(built[n], "w", newline="") as fod:
+                f_writer = csv.writer(fod, quoting=csv.QUOTE_ALL)
+                f_writer.writerow(header)
+                for row in rows[:n]:
+                    f_writer.writerow(row)
+                for i in range(len(rows), n):
+                    f_writer.writerow([f"SYN{i:08d}", f"InChI=1S/C{i % 40 + 1}H{i}/c{i}"])
+        return built[n]
+
+    return make
@@ -0,0 +1,72 @@
+"""
+Stand-in for the KNIME executable, used by the benchmarks and some tests.
+
+It reads the workflow variables given on the command line like the
+RetroPath2.0 workflow does, logs node executions like KNIME for each
+iteration, and writes recorded outputs (by default the
+ones of tests/data/lycopene/out/r20220104, or the folder given by
+RP2_FAKE_KNIME_OUTPUTS) where the workflow would write them. Results are
+written iteration by iteration, RP2_FAKE_KNIME_DELAY seconds apart
+(default: 0).
+"""
+import csv
+import os
+import re
+import shutil
+import sys
+import time
+
+
+OUTPUTS = os.environ.get(
+    "RP2_FAKE_KNIME_OUTPUTS",
+    os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        "data", "lycopene", "out", "r20220104",
+    )
+)
+
+
+def main(argv) -> int:
+    variables = {}
+    for arg in argv:
+        m = re.match(r'^-workflow\.variable=([^,]+),"(.*)",\w+$', arg)
+        if m:
+            variables[m.group(1)] = m.group(2)
+    outdir = variables["output.dir"]
+    os.makedirs(outdir, exist_ok=True)
+
+    delay = float(os.environ.get("RP2_FAKE_KNIME_DELAY", 0))
+
+    print("INFO  main BatchExecutor ===== Executing workflow =====")
+    shutil.copyfile(
+        os.path.join(OUTPUTS, "source-in-sink.csv"),
+        os.path.join(outdir, variables["output.sourceinsinkfile"]),
+    )
+    # Recorded lines written as they are, grouped by iteration
+    with open(os.path.join(OUTPUTS, "results.csv"), newline="") as fid:
+        header = fid.readline()
+        lines = fid.readlines()
+    i_iteration = next(csv.reader([header])).index("Iteration")
+    iterations = [int(row[i_iteration]) for row in csv.reader(lines)]
+    with open(os.path.join(outdir, variables["output.solutionfile"]), "w", newline="") as fod:
+        fod.write(header)
+        steps = int(variables.get("input.max-steps", 3))
+        for i in range(steps):
+            for node in ["Recursive Loop Start (2 ports) 0:1081:781", "Joiner 0:1081:12", "Recursive Loop End (2 ports) 0:1081:783"]:
+                print(f"INFO  KNIME-Worker-1 LocalNodeExecutionJob  {node} Start execute")
+                print(f"INFO  KNIME-Worker-1 LocalNodeExecutionJob  {node} End execute (0 secs)")
+            sys.stdout.flush()
+            fod.writelines([line for line, n in zip(lines, iterations) if n == i])
+            fod.flush()
+            time.sleep(delay)
+        fod.writelines([line for line, n in zip(lines, iterations) if n >= steps])
+    sys.stdout.flush()
+    for name in os.listdir(OUTPUTS):
+        if name.endswith("_scope.csv") or name.endswith("_scope.json"):
+            shutil.copyfile(os.path.join(OUTPUTS, name), os.path.join(outdir, name))
+    print("INFO  main BatchExecutor Workflow execution done")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
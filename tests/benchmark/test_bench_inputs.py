@@ -0,0 +1,53 @@
+import os
+import tempfile
+
+import pytest
+from retropath2_wrapper.RetroPath2 import (
+    filter_rules,
+    format_files_for_knime,
+    sniff_rules,
+)
+from retropath2_wrapper.staging import StagingCache
+
+
+BENCHMARK = "RP2_BENCHMARK" not in os.environ
+pytestmark = pytest.mark.skipif(BENCHMARK, reason="Benchmark")
+
+
+class TestBenchInputs:
+    def test_sniff_rules(self, bench, make_rules, rows):
+        rules = make_rules(rows)
+        assert bench(f"sniff_rules[{rows}]", sniff_rules, path=rules) == "explicit"
+
+    def test_filter_rules(self, bench, make_rules, rows, tmp_path):
+        rules = make_rules(rows)
+        path = bench(f"filter_rules[{rows}]", filter_rules, rules, str(tmp_path), dmin=4, dmax=8)
+        with open(path) as fid:
+            assert sum(1 for _ in fid) - 1 == 3 * rows // 8
+
+    def test_format_files(self, bench, make_rules, make_sink, lycopene_source_csv, rows, tmp_path):
+        rules = make_rules(rows)
+        sink = make_sink(rows)
+
+        def format_files():
+            with tempfile.TemporaryDirectory() as tempd:
+                return format_files_for_knime(
+                    sink, lycopene_source_csv, rules, tempd, str(tmp_path), dmin=4, dmax=8,
+                )
+
+        bench(f"format_files[{rows}]", format_files)
+
+    def test_format_files_staged(self, bench, make_rules, make_sink, lycopene_source_csv, rows, tmp_path):
+        rules = make_rules(rows)
+        sink = make_sink(rows)
+        staging = StagingCache(path=str(tmp_path / "staging"))
+
+        def format_files():
+            with tempfile.TemporaryDirectory() as tempd:
+                return format_files_for_knime(
+                    sink, lycopene_source_csv, rules, tempd, str(tmp_path), dmin=4, dmax=8, staging=staging,
+                )
+
+        # First run prepares the rules, next ones only link them
+        format_files()
+        bench(f"format_files_staged[{rows}]", format_files)
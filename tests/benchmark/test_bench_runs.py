@@ -0,0 +1,100 @@
+import csv
+import os
+import shutil
+
+import pytest
+from retropath2_wrapper.Args import RETCODES
+from retropath2_wrapper.RetroPath2 import (
+    check_scope,
+    check_src_in_sink_2,
+    retropath2,
+)
+from retropath2_wrapper.batch import retropath2_batch
+from retropath2_wrapper.knime import (
+    Knime,
+    KnimePool,
+)
+from retropath2_wrapper.report import count_rows
+
+
+BENCHMARK = "RP2_BENCHMARK" not in os.environ
+pytestmark = pytest.mark.skipif(BENCHMARK, reason="Benchmark")
+
+TARGETS = 16
+
+
+class TestBenchRuns:
+    def test_retropath2(self, bench, fake_knime, make_rules, make_sink, lycopene_source_csv, rows, tmp_path):
+        rules = make_rules(rows)
+        sink = make_sink(rows)
+        knime = Knime(kinstall=fake_knime)
+        r_code, files = bench(
+            f"retropath2[{rows}]",
+            retropath2,
+            sink_file=sink,
+            source_file=lycopene_source_csv,
+            rules_file=rules,
+            outdir=str(tmp_path),
+            std_hydrogen="implicit",
+            knime=knime,
+            dmin=4,
+            dmax=8,
+        )
+        assert r_code == RETCODES["OK"]
+
+    def test_parse_results(self, bench, lycopene_r20220104_results_csv, rows, tmp_path):
+        # Recorded results repeated up to the number of rows
+        with open(lycopene_r20220104_results_csv) as fid:
+            f_reader = csv.reader(fid)
+            header = next(f_reader)
+            records = list(f_reader)
+        results = str(tmp_path / "results.csv")
+        with open(results, "w", newline="") as fod:
+            f_writer = csv.writer(fod, quoting=csv.QUOTE_ALL)
+            f_writer.writerow(header)
+            for i in range(rows):
+                f_writer.writerow(records[i % len(records)])
+        shutil.copyfile(results, str(tmp_path / "target_scope.csv"))
+        (tmp_path / "source-in-sink.csv").write_text('"source","InChI"\n')
+
+        def parse():
+            return (
+                check_src_in_sink_2(str(tmp_path / "source-in-sink.csv")),
+                check_scope(str(tmp_path)),
+                count_rows(results),
+            )
+
+        assert bench(f"parse_results[{rows}]", parse) == (RETCODES["OK"], RETCODES["OK"], rows)
+
+    @pytest.mark.parametrize("jobs", [1, 4])
+    def test_batch(self, bench, fake_knime, make_rules, make_sink, lycopene_source_csv, jobs, tmp_path):
+        rules = make_rules(10000)
+        sink = make_sink(10000)
+        with open(lycopene_source_csv) as fid:
+            inchi = list(csv.reader(fid))[1][1]
+        sources = tmp_path / "sources.csv"
+        with open(sources, "w", newline="") as fod:
+            f_writer = csv.writer(fod, quoting=csv.QUOTE_ALL)
+            f_writer.writerow(["Name", "InChI"])
+            for i in range(TARGETS):
+                f_writer.writerow([f"target_{i}", inchi])
+
+        def run(i=[0]):
+            i[0] += 1
+            with KnimePool(kinstall=fake_knime, size=jobs) as pool:
+                return retropath2_batch(
+                    sink_file=sink,
+                    source_path=str(sources),
+                    rules_file=rules,
+                    outdir=str(tmp_path / f"out_{i[0]}"),
+                    std_hydrogen="implicit",
+                    knime=pool,
+                    jobs=jobs,
+                    sink_index_dir=str(tmp_path / "sink_index"),
+                    dmin=4,
+                    dmax=8,
+                )
+
+        r_code, batch = bench(f"batch[{TARGETS} targets, {jobs} jobs]", run)
+        assert r_code == RETCODES["OK"]
+        assert len(batch) == TARGETS
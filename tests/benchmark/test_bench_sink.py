@@ -0,0 +1,31 @@
+import os
+
+import pytest
+from retropath2_wrapper.Args import RETCODES
+from retropath2_wrapper.RetroPath2 import check_src_in_sink_1
+from retropath2_wrapper.sink_index import SinkIndex
+
+
+BENCHMARK = "RP2_BENCHMARK" not in os.environ
+pytestmark = pytest.mark.skipif(BENCHMARK, reason="Benchmark")
+
+LYCOPENE = "InChI=1S/C40H56/c1-33(2)19-13-23-37(7)27-17-31-39(9)29-15-25-35(5)21-11-12-22-36(6)26-16-30-40(10)32-18-28-38(8)24-14-20-34(3)4/h11-12,15-22,25-32H,13-14,23-24H2,1-10H3"
+
+
+class TestBenchSink:
+    def test_scan(self, bench, make_sink, rows):
+        sink = make_sink(rows)
+        r_code = bench(f"sink_scan[{rows}]", check_src_in_sink_1, LYCOPENE, sink)
+        assert r_code == RETCODES["OK"]
+
+    def test_index_build(self, bench, make_sink, rows, tmp_path):
+        sink = make_sink(rows)
+        index_file = str(tmp_path / "sink.idx")
+        bench(f"sink_index_build[{rows}]", SinkIndex.build, sink, index_file)
+
+    def test_index_lookup(self, bench, make_sink, rows, tmp_path):
+        sink = make_sink(rows)
+        with SinkIndex(sink, path=str(tmp_path)) as index:
+            keys = [LYCOPENE] + [f"InChI=1S/C{i % 40 + 1}H{i}/c{i}" for i in range(0, rows, max(1, rows // 1000))]
+            found = bench(f"sink_index_lookup_many[{rows}]", index.lookup_many, keys)
+        assert found[LYCOPENE] is None
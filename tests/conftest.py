@@ -1,4 +1,5 @@
 import os
+import sys
 
 import pytest
 
@@ -10,6 +11,22 @@ dataset_dir = os.path.join(cur_dir, "data")
 def data_dir():
     return dataset_dir
 
+@pytest.fixture(scope="session")
+def fake_knime(tmp_path_factory):
+    """KNIME install folder whose executable is benchmark/fake_knime.py."""
+    if sys.platform == "win32":
+        pytest.skip("Shell script as executable")
+    path = tmp_path_factory.mktemp("kinstall")
+    kexec = path / "knime"
+    kexec.write_text(
+        '#!/bin/sh\nexec "%s" "%s" "$@"\n' % (
+            sys.executable,
+            os.path.join(cur_dir, "benchmark", "fake_knime.py"),
+        )
+    )
+    kexec.chmod(0o755)
+    return str(path)
+
 @pytest.fixture(scope="session")
 def preference_path(data_dir):
     return os.path.join(data_dir, "preference.epf")
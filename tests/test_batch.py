@@ -0,0 +1,102 @@
+import csv
+import os
+
+from retropath2_wrapper.Args import RETCODES
+from retropath2_wrapper.RetroPath2 import init_knime
+from retropath2_wrapper.__main__ import _cli
+from retropath2_wrapper.batch import (
+    check_sources,
+    read_sources,
+    run_job,
+    set_job_outdirs,
+    write_summary,
+)
+from retropath2_wrapper.knime import Knime
+from retropath2_wrapper.sink_index import SinkIndex
+
+
+LYCOPENE = "InChI=1S/C40H56/c1-33(2)19-13-23-37(7)27-17-31-39(9)29-15-25-35(5)21-11-12-22-36(6)26-16-30-40(10)32-18-28-38(8)24-14-20-34(3)4/h11-12,15-22,25-32H,13-14,23-24H2,1-10H3"
+ATP = "InChI=1S/C10H16N5O13P3/c11-8-5-9(13-2-12-8)15(3-14-5)10-7(17)6(16)4(26-10)1-25-30(21,22)28-31(23,24)27-29(18,19)20/h2-4,6-7,10,16-17H,1H2,(H,21,22)(H,23,24)(H2,11,12,13)(H2,18,19,20)"
+
+
+class TestBatch:
+    def write_sources(self, path, rows):
+        with open(path, "w") as fod:
+            fod.write("Name,InChI\n")
+            for name, inchi in rows:
+                fod.write('"%s","%s"\n' % (name, inchi))
+        return str(path)
+
+    def test_read_sources_file(self, tmp_path):
+        path = self.write_sources(tmp_path / "sources.csv", [("lycopene", LYCOPENE), ("atp", ATP)])
+        jobs = read_sources(path)
+        assert [x["name"] for x in jobs] == ["lycopene", "atp"]
+        assert jobs[0]["inchi"] == LYCOPENE
+
+    def test_read_sources_dir(self, tmp_path):
+        self.write_sources(tmp_path / "a.csv", [("lycopene", LYCOPENE)])
+        self.write_sources(tmp_path / "b.csv", [("atp", ATP)])
+        (tmp_path / "c.csv").write_text("Foo,Bar\n")
+        jobs = read_sources(str(tmp_path))
+        assert [x["name"] for x in jobs] == ["lycopene", "atp", "c.csv"]
+        assert jobs[-1]["r_code"] == RETCODES["InChI"]
+
+    def test_check_sources(self, tmp_path, lycopene_sink_csv):
+        path = self.write_sources(
+            tmp_path / "sources.csv",
+            [("lycopene", LYCOPENE + " "), ("atp", ATP), ("bad", "InChI=foo")],
+        )
+        jobs = read_sources(path)
+        with SinkIndex(lycopene_sink_csv, path=str(tmp_path / "index")) as sink_index:
+            check_sources(jobs, sink_index)
+        assert "r_code" not in jobs[0]
+        assert jobs[0]["inchi"] == LYCOPENE
+        assert jobs[1]["r_code"] == RETCODES["SrcInSink"]
+        assert jobs[2]["r_code"] == RETCODES["InChI"]
+
+    def test_outdirs_and_summary(self, tmp_path):
+        jobs = [
+            {"name": "cis,cis-muconate", "inchi": LYCOPENE},
+            {"name": "cis,cis-muconate", "inchi": LYCOPENE},
+            {"name": "bad", "inchi": "", "r_code": RETCODES["InChI"]},
+        ]
+        set_job_outdirs(jobs, str(tmp_path))
+        assert os.path.basename(jobs[0]["outdir"]) == "cis_cis-muconate"
+        assert os.path.basename(jobs[1]["outdir"]) == "cis_cis-muconate_1"
+        assert "outdir" not in jobs[2]
+        jobs[0]["r_code"] = RETCODES["OK"]
+        jobs[1]["r_code"] = RETCODES["NoSolution"]
+        summary = write_summary(jobs, str(tmp_path))
+        with open(summary) as fid:
+            rows = list(csv.reader(fid))
+        assert rows[0] == ["Name", "InChI", "Outdir", "Return code", "Status"]
+        assert [x[4] for x in rows[1:]] == ["OK", "NoSolution", "InChI"]
+
+    def test_run_job(self, fake_knime, lycopene_sink_csv, rulesd12_csv, tmp_path):
+        job = {"name": 'lyco"pene,\nred', "inchi": LYCOPENE, "outdir": str(tmp_path / "lycopene")}
+        r_code = run_job(
+            job=job,
+            sink_file=lycopene_sink_csv,
+            rules_file=rulesd12_csv,
+            std_hydrogen="Aromatized (no Hs added)",
+            knime=init_knime(Knime(kinstall=fake_knime), rp2_version="r20220104"),
+            max_steps=3,
+        )
+        assert r_code == RETCODES["OK"]
+        # One target, quotes and commas kept
+        sources = read_sources(os.path.join(job["outdir"], "source.csv"))
+        assert sources == [{"name": 'lyco"pene, red', "inchi": LYCOPENE}]
+
+    def test_cli(self, fake_knime, lycopene_sink_csv, rulesd12_csv, tmp_path, monkeypatch):
+        sources = self.write_sources(tmp_path / "sources.csv", [("lycopene", LYCOPENE), ("atp", ATP)])
+        monkeypatch.setattr("sys.argv", [
+            "retropath2_wrapper", "batch", lycopene_sink_csv, rulesd12_csv, str(tmp_path / "out"),
+            "--source_file", sources,
+            "--kinstall", fake_knime,
+            "--rp2_version", "r20220104",
+            "--std_hydrogen", "implicit",
+            "--jobs", "2",
+        ])
+        assert _cli() == RETCODES["OK"]
+        with open(tmp_path / "out" / "summary.csv") as fid:
+            assert [x[4] for x in list(csv.reader(fid))[1:]] == ["OK", "SrcInSink"]
@@ -0,0 +1,84 @@
+import os
+import shutil
+import time
+
+from retropath2_wrapper.cache import ResultCache, hash_file
+
+
+class TestCache:
+    def make_outdir(self, path, content="x" * 100):
+        os.makedirs(path, exist_ok=True)
+        for name in ["results.csv", "source-in-sink.csv", "target_scope.csv"]:
+            with open(os.path.join(path, name), "w") as fod:
+                fod.write(content)
+        os.makedirs(os.path.join(path, "svg"), exist_ok=True)
+        with open(os.path.join(path, "svg", "a.svg"), "w") as fod:
+            fod.write(content)
+        return str(path)
+
+    def test_hash_file(self, sink_csv):
+        assert hash_file(sink_csv) == hash_file(sink_csv)
+        assert len(hash_file(sink_csv)) == 64
+
+    def test_key(self, lycopene_sink_csv, lycopene_source_csv, rulesd12_csv):
+        files = dict(sink=lycopene_sink_csv, source=lycopene_source_csv, rules=rulesd12_csv)
+        key = ResultCache.key(files=files, params=dict(dmin=0, dmax=1000))
+        assert key == ResultCache.key(files=files, params=dict(dmax=1000, dmin=0))
+        assert key != ResultCache.key(files=files, params=dict(dmin=12, dmax=1000))
+        files["source"] = lycopene_sink_csv
+        assert key != ResultCache.key(files=files, params=dict(dmin=0, dmax=1000))
+
+    def test_put_get(self, tmp_path):
+        cache = ResultCache(path=str(tmp_path / "cache"))
+        outdir = self.make_outdir(tmp_path / "out")
+        outputs = ["results.csv", "source-in-sink.csv", "target_scope.csv", "svg", "missing.csv"]
+        assert cache.get("a" * 64, str(tmp_path / "new")) is None
+        cache.put("a" * 64, outdir, outputs, r_code=0)
+        newdir = str(tmp_path / "new")
+        assert cache.get("a" * 64, newdir) == 0
+        assert sorted(os.listdir(newdir)) == ["results.csv", "source-in-sink.csv", "svg", "target_scope.csv"]
+        assert os.path.isfile(os.path.join(newdir, "svg", "a.svg"))
+        stats = cache.stats()
+        assert stats["entries"] == 1
+        assert stats["size"] == 400
+        cache.clear()
+        assert cache.stats()["entries"] == 0
+
+    def test_evict(self, tmp_path):
+        cache = ResultCache(path=str(tmp_path / "cache"), max_size=1000)
+        outdir = self.make_outdir(tmp_path / "out")
+        outputs = ["results.csv", "source-in-sink.csv", "target_scope.csv", "svg"]
+        cache.put("a" * 64, outdir, outputs, r_code=0)
+        cache.put("b" * 64, outdir, outputs, r_code=0)
+        # Use the first entry, the second one becomes the least recently used
+        os.utime(os.path.join(cache.entry("b" * 64), "meta.json"), (time.time() - 100,) * 2)
+        assert cache.get("a" * 64, str(tmp_path / "new")) == 0
+        cache.put("c" * 64, outdir, outputs, r_code=10)
+        assert cache.stats()["entries"] == 2
+        assert cache.get("b" * 64, str(tmp_path / "new")) is None
+        assert cache.get("c" * 64, str(tmp_path / "new")) == 10
+
+    def test_get_stale(self, tmp_path, monkeypatch):
+        cache = ResultCache(path=str(tmp_path / "cache"))
+        outdir = self.make_outdir(tmp_path / "out")
+        cache.put("a" * 64, outdir, ["results.csv", "target_scope.csv"], r_code=0)
+        cache.put("b" * 64, outdir, ["results.csv"], r_code=10)
+
+        # Scope of a previous run is not left next to the results of the entry
+        newdir = tmp_path / "new"
+        assert cache.get("a" * 64, str(newdir)) == 0
+        (newdir / "other_scope.csv").write_text("x")
+        (newdir / "other_scope.json").write_text("{}")
+        assert cache.get("b" * 64, str(newdir)) == 10
+        assert sorted(os.listdir(newdir)) == ["results.csv"]
+
+        # Entry evicted while being copied
+        copyfile = shutil.copyfile
+
+        def evicted(src, dst):
+            copyfile(src, dst)
+            cache.clear()
+
+        monkeypatch.setattr(shutil, "copyfile", evicted)
+        assert cache.get("a" * 64, str(tmp_path / "other")) is None
+        assert os.listdir(tmp_path / "other") == []
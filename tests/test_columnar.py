@@ -0,0 +1,77 @@
+import csv
+import os
+import shutil
+
+from retropath2_wrapper.Args import RETCODES
+from retropath2_wrapper.RetroPath2 import retropath2
+from retropath2_wrapper.columnar import (
+    ColumnarTable,
+    columnar_path,
+    export_outputs,
+    write_columns,
+)
+from retropath2_wrapper.knime import Knime
+
+
+class TestColumnar:
+    def test_write_columns(self, tmp_path, lycopene_r20220104_results_csv):
+        csv_file = str(tmp_path / "results.csv")
+        shutil.copyfile(lycopene_r20220104_results_csv, csv_file)
+        path = write_columns(csv_file)
+        assert path == columnar_path(csv_file) == str(tmp_path / "results.columns.zip")
+        assert os.path.getsize(path) < os.path.getsize(csv_file) / 2
+
+        with open(csv_file) as fid:
+            f_reader = csv.reader(fid)
+            header = next(f_reader)
+            rows = list(f_reader)
+        with ColumnarTable(path) as table:
+            assert table.columns == header
+            assert len(table) == len(rows)
+            assert table["Product InChI"] == [x[header.index("Product InChI")] for x in rows]
+            assert table.column("Score", type=float)[:3] == [float(x[header.index("Score")]) for x in rows[:3]]
+            # Repeated values are dictionary encoded
+            dictionary = table.dictionary("Substrate InChI")
+            assert len(dictionary) < len(rows)
+            assert [dictionary[x] for x in table.codes("Substrate InChI")] == table["Substrate InChI"]
+            assert list(table.rows())[0] == dict(zip(header, rows[0]))
+
+    def test_chunks(self, tmp_path, lycopene_r20220104_results_csv):
+        csv_file = str(tmp_path / "results.csv")
+        shutil.copyfile(lycopene_r20220104_results_csv, csv_file)
+        whole = write_columns(csv_file, path=str(tmp_path / "whole.columns.zip"))
+        chunked = write_columns(csv_file, path=str(tmp_path / "chunked.columns.zip"), chunk_rows=100)
+        with ColumnarTable(whole) as expected, ColumnarTable(chunked) as table:
+            assert len(table) == len(expected)
+            for name in expected.columns:
+                assert table[name] == expected[name]
+            # Dictionaries of the chunks merged
+            dictionary = table.dictionary("Substrate InChI")
+            assert len(dictionary) == len(set(dictionary))
+            assert [dictionary[x] for x in table.codes("Substrate InChI")] == expected["Substrate InChI"]
+
+    def test_empty(self, tmp_path):
+        csv_file = tmp_path / "results.csv"
+        csv_file.write_text('"a","b"\n')
+        with ColumnarTable(write_columns(str(csv_file))) as table:
+            assert len(table) == 0
+            assert table["a"] == []
+        assert export_outputs(str(tmp_path), ["results.csv", "missing.csv", "svg"]) == ["results.columns.zip"]
+
+    def test_retropath2(self, fake_knime, lycopene_sink_csv, lycopene_source_csv, rulesd12_csv, tmp_path):
+        outdir = str(tmp_path / "out")
+        r_code, result = retropath2(
+            sink_file=lycopene_sink_csv,
+            source_file=lycopene_source_csv,
+            rules_file=rulesd12_csv,
+            outdir=outdir,
+            std_hydrogen="implicit",
+            knime=Knime(kinstall=fake_knime),
+            rp2_version=None,
+            columnar=True,
+        )
+        assert r_code == RETCODES["OK"]
+        for name in ["results", "source-in-sink", "target_scope"]:
+            assert os.path.exists(os.path.join(outdir, name + ".columns.zip"))
+        with ColumnarTable(os.path.join(outdir, "results.columns.zip")) as table:
+            assert len(table) == 2168
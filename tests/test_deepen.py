@@ -0,0 +1,92 @@
+import csv
+import filecmp
+import glob
+import os
+import shutil
+
+import pytest
+
+from retropath2_wrapper.Args import RETCODES
+from retropath2_wrapper.RetroPath2 import (
+    check_results,
+    retropath2,
+)
+from retropath2_wrapper.deepen import (
+    last_iteration,
+    merge_results,
+    read_frontier,
+)
+from retropath2_wrapper.knime import Knime
+from retropath2_wrapper.outputs import write_sources
+
+
+@pytest.fixture
+def prior_dir(tmp_path, lycopene_r20220104_results_csv):
+    # Outputs of a run at max_steps=3
+    path = tmp_path / "prior"
+    shutil.copytree(os.path.dirname(lycopene_r20220104_results_csv), str(path))
+    return str(path)
+
+
+class TestDeepen:
+    def test_frontier(self, tmp_path, lycopene_r20220104_results_csv):
+        assert last_iteration(lycopene_r20220104_results_csv) == 2
+        frontier = read_frontier(lycopene_r20220104_results_csv)
+        assert len(frontier) == 400
+        assert frontier[0][0] == "frontier_0"
+        with open(lycopene_r20220104_results_csv) as fid:
+            rows = list(csv.DictReader(fid))
+        expanded = set(row["Substrate InChI"] for row in rows)
+        in_sink = set(row["Product InChI"] for row in rows if row["In Sink"] == "1")
+        assert not expanded & set(x[1] for x in frontier)
+        assert not in_sink & set(x[1] for x in frontier)
+
+        path = write_sources(frontier, str(tmp_path / "frontier.csv"))
+        with open(path) as fid:
+            assert next(csv.reader(fid)) == ["Name", "InChI"]
+
+    def test_merge_results(self, tmp_path, lycopene_r20220104_results_csv):
+        path = str(tmp_path / "results.csv")
+        shutil.copyfile(lycopene_r20220104_results_csv, path)
+        assert merge_results(lycopene_r20220104_results_csv, path, offset=3) == 2 * 2168
+        with open(path) as fid:
+            rows = list(csv.DictReader(fid))
+        assert set(row["Iteration"] for row in rows) == set(str(i) for i in range(6))
+        assert len(set(row["Transformation ID"] for row in rows)) == len(set(
+            row["Transformation ID"] for row in rows[:2168]
+        )) * 2
+        assert rows[-1]["Transformation ID"].startswith("TRS_0_5_")
+
+    def test_retropath2(self, fake_knime, lycopene_sink_csv, lycopene_source_csv, rulesd12_csv, lycopene_r20220104_results_csv, prior_dir, tmp_path):
+        kwargs = dict(
+            sink_file=lycopene_sink_csv,
+            source_file=lycopene_source_csv,
+            rules_file=rulesd12_csv,
+            std_hydrogen="implicit",
+            knime=Knime(kinstall=fake_knime),
+            rp2_version=None,
+            resume_dir=prior_dir,
+        )
+
+        # Iterations left
+        outdir = str(tmp_path / "out")
+        r_code, result = retropath2(outdir=outdir, max_steps=5, **kwargs)
+        assert r_code == RETCODES["OK"]
+        assert last_iteration(os.path.join(outdir, result["results"])) == 5
+        # Scope of the source, not of the frontier compounds
+        assert glob.glob(os.path.join(outdir, "*_scope.csv")) == [os.path.join(outdir, "target_scope.csv")]
+        assert check_results(result) == RETCODES["OK"]
+
+        # Nothing left
+        outdir = str(tmp_path / "out_3")
+        r_code, result = retropath2(outdir=outdir, max_steps=3, **kwargs)
+        assert r_code == RETCODES["OK"]
+        assert filecmp.cmp(os.path.join(outdir, result["results"]), lycopene_r20220104_results_csv)
+        assert os.path.exists(os.path.join(outdir, "target_scope.csv"))
+        assert check_results(result) == RETCODES["OK"]
+
+        # In place
+        r_code, result = retropath2(outdir=prior_dir, max_steps=4, **kwargs)
+        assert r_code == RETCODES["OK"]
+        assert last_iteration(os.path.join(prior_dir, result["results"])) == 5
+        assert check_results(result) == RETCODES["OK"]
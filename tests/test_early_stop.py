@@ -0,0 +1,82 @@
+import csv
+import json
+import os
+
+import pytest
+
+from retropath2_wrapper.Args import RETCODES
+from retropath2_wrapper.RetroPath2 import (
+    check_results,
+    retropath2,
+)
+from retropath2_wrapper.early_stop import EarlyStop
+from retropath2_wrapper.knime import Knime
+from retropath2_wrapper.progress import ProgressEvent
+from retropath2_wrapper.report import REPORT_FILE
+
+
+@pytest.fixture
+def slow_knime(fake_knime, monkeypatch):
+    # KNIME writing recorded results iteration by iteration, 1s apart
+    monkeypatch.setenv("RP2_FAKE_KNIME_DELAY", "1")
+    return Knime(kinstall=fake_knime)
+
+
+class TestEarlyStop:
+    def test_count_solutions(self, tmp_path, lycopene_r20220104_results_csv):
+        assert EarlyStop.count_solutions(lycopene_r20220104_results_csv) == (3, 2168)
+        assert EarlyStop.count_solutions(str(tmp_path / "missing.csv")) == (0, 0)
+
+        # Last row being written
+        path = tmp_path / "results.csv"
+        with open(lycopene_r20220104_results_csv) as fid:
+            text = fid.read()
+        path.write_text(text[:len(text) // 2])
+        solutions, rows = EarlyStop.count_solutions(str(path))
+        assert rows < 2168
+        assert EarlyStop.repair(str(path)) == rows
+        with open(path) as fid:
+            assert len(list(csv.reader(fid))) == rows + 1
+
+    def test_iterations(self):
+        early_stop = EarlyStop(results="", iterations=2)
+        callback = early_stop.watch()
+        for i in [1, 2]:
+            callback(ProgressEvent(kind="iteration", elapsed=0, iteration=i))
+            assert not early_stop()
+        callback(ProgressEvent(kind="iteration", elapsed=0, iteration=3))
+        assert early_stop()
+        assert early_stop.reason == "2 iterations done"
+
+    @pytest.mark.parametrize("stop", [dict(stop_iterations=1), dict(stop_solutions=3)])
+    def test_retropath2(self, slow_knime, lycopene_sink_csv, lycopene_source_csv, rulesd12_csv, stop, tmp_path):
+        outdir = str(tmp_path / "out")
+        r_code, result = retropath2(
+            sink_file=lycopene_sink_csv,
+            source_file=lycopene_source_csv,
+            rules_file=rulesd12_csv,
+            outdir=outdir,
+            std_hydrogen="implicit",
+            knime=slow_knime,
+            rp2_version=None,
+            max_steps=10,
+            **stop
+        )
+        assert r_code == RETCODES["OK"]
+        with open(os.path.join(outdir, REPORT_FILE)) as fid:
+            report = json.load(fid)
+        assert report["knime"]["stopped"]
+        assert report["knime"]["elapsed"] < 9
+        with open(os.path.join(outdir, result["results"])) as fid:
+            iterations = set(row["Iteration"] for row in csv.DictReader(fid))
+        if "stop_iterations" in stop:
+            assert report["knime"]["early_stop"] == "1 iterations done"
+            # Rows of the iteration stopped may be there
+            assert "0" in iterations and "2" not in iterations
+            assert check_results(result) == RETCODES["NoSolution"]
+        else:
+            assert report["knime"]["early_stop"] == "3 solutions found"
+            assert "2" in iterations
+            # Scope written from the results, KNIME being stopped before
+            assert check_results(result) == RETCODES["OK"]
+            assert os.path.exists(os.path.join(outdir, "target_scope.csv"))
@@ -3,11 +3,23 @@ Created on Jul 15 2020
 
 @author: Joan Hérisson
 """
+import csv
+import gzip
 import os
+import shutil
+import tarfile
 import tempfile
+import zipfile
 
 from retropath2_wrapper.Args import RETCODES
-from retropath2_wrapper.RetroPath2 import check_inchi_from_file, check_input
+from retropath2_wrapper.RetroPath2 import (
+    check_inchi_from_file,
+    check_input,
+    extract_to_csv,
+    filter_rules,
+    format_files_for_knime,
+    sniff_rules,
+)
 
 
 class TestHelpers:
@@ -39,3 +51,56 @@ class TestHelpers:
             fod.close()
             assert check_inchi_from_file(fod.name) != ""
             os.remove(fod.name)
+
+    def test_filter_rules(self, rulesd12_csv, tmp_path):
+        def count(path):
+            with open(path) as fid:
+                return sum(1 for _ in csv.reader(fid)) - 1
+        assert count(filter_rules(rulesd12_csv, str(tmp_path), dmin=0, dmax=1000)) == 29298
+        assert count(filter_rules(rulesd12_csv, str(tmp_path), dmin=14, dmax=1000)) == 0
+        assert count(filter_rules(rulesd12_csv, str(tmp_path), dmin=12, dmax=12, min_score=1)) == 15587
+        assert filter_rules(rulesd12_csv, str(tmp_path), min_score=1).endswith("rules_d12.filtered.csv")
+
+    def test_filter_rules_no_column(self, sink_csv, tmp_path):
+        assert filter_rules(sink_csv, str(tmp_path), dmin=0, dmax=1000) is None
+
+    def test_format_files_for_knime_filter(self, lycopene_sink_csv, lycopene_source_csv, rulesd12_csv, tmp_path):
+        files = format_files_for_knime(
+            lycopene_sink_csv, lycopene_source_csv, rulesd12_csv,
+            str(tmp_path), str(tmp_path),
+            dmin=16, dmax=16,
+        )
+        assert os.path.dirname(files["rules"]) == str(tmp_path)
+        with open(files["rules"]) as fid:
+            assert fid.read().splitlines()[0].startswith("Rule ID,Rule,EC number")
+
+    def make_archives(self, rulesd12_csv, tmp_path):
+        plain = str(tmp_path / "rules.csv")
+        with gzip.open(rulesd12_csv, "rb") as fid, open(plain, "wb") as fod:
+            shutil.copyfileobj(fid, fod)
+        tgz = str(tmp_path / "rules.tar.gz")
+        with tarfile.open(tgz, "w:gz") as tar:
+            tar.add(plain, arcname="rules.csv")
+        zipf = str(tmp_path / "rules.zip")
+        with zipfile.ZipFile(zipf, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+            zf.write(plain, arcname="rules.csv")
+        return plain, [rulesd12_csv, tgz, zipf]
+
+    def test_extract_to_csv(self, rulesd12_csv, tmp_path):
+        plain, archives = self.make_archives(rulesd12_csv, tmp_path)
+        with open(plain, "rb") as fid:
+            expected = fid.read()
+        for archive in archives:
+            outdir = tempfile.mkdtemp(dir=str(tmp_path))
+            path = extract_to_csv(archive, outdir)
+            assert path.endswith(".csv") and not path.endswith(".csv.csv")
+            with open(path, "rb") as fid:
+                assert fid.read() == expected
+            assert sniff_rules(archive) == "explicit"
+
+    def test_format_files_for_knime_link(self, sink_dat, source_dat, rulesd12_csv, tmp_path):
+        files = format_files_for_knime(sink_dat, source_dat, rulesd12_csv, str(tmp_path), str(tmp_path))
+        for key, path in [("sink", sink_dat), ("source", source_dat)]:
+            assert files[key].endswith(".csv")
+            assert os.path.samefile(files[key], path)
+        assert os.path.islink(files["rules"]) is False
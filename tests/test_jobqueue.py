@@ -0,0 +1,183 @@
+import os
+import threading
+import time
+
+from retropath2_wrapper import jobqueue
+from retropath2_wrapper.Args import RETCODES, build_queue_args_parser
+from retropath2_wrapper.jobqueue import (
+    JobQueue,
+    Worker,
+    queue_sources,
+)
+
+
+LYCOPENE = "InChI=1S/C40H56/c1-33(2)19-13-23-37(7)27-17-31-39(9)29-15-25-35(5)21-11-12-22-36(6)26-16-30-40(10)32-18-28-38(8)24-14-20-34(3)4/h11-12,15-22,25-32H,13-14,23-24H2,1-10H3"
+ATP = "InChI=1S/C10H16N5O13P3/c11-8-5-9(13-2-12-8)15(3-14-5)10-7(17)6(16)4(26-10)1-25-30(21,22)28-31(23,24)27-29(18,19)20/h2-4,6-7,10,16-17H,1H2,(H,21,22)(H,23,24)(H2,11,12,13)(H2,18,19,20)"
+
+
+class TestJobQueue:
+    def test_claim(self, tmp_path):
+        queue = JobQueue(str(tmp_path / "queue"), lease=60, max_attempts=2)
+        ids = [queue.submit({"name": f"job{i}"}) for i in range(2)]
+        queue.submit({"name": "bad", "r_code": RETCODES["InChI"]})
+        assert queue.status()["pending"] == 2
+        assert queue.status()["done"] == 1
+
+        job = queue.claim("w1")
+        assert job["id"] == ids[0]
+        assert job["attempts"] == 1
+        assert queue.claim("w2")["id"] == ids[1]
+        assert queue.claim("w3") is None
+        assert queue.status()["workers"] == ["w1", "w2"]
+        assert queue.job_ids("running") == ids
+
+        assert queue.heartbeat(ids[0], job["claim"])
+        assert not queue.heartbeat(ids[0], "other")
+        assert not queue.complete(ids[0], "other", RETCODES["OK"])
+        assert queue.complete(ids[0], job["claim"], RETCODES["OK"])
+        assert queue.read("done", ids[0])["r_code"] == RETCODES["OK"]
+        # Settings are the ones of the queue creation
+        assert JobQueue(str(tmp_path / "queue"), lease=1).lease == 60
+
+    def test_requeue(self, tmp_path):
+        queue = JobQueue(str(tmp_path / "queue"), lease=10, max_attempts=2)
+        job_id = queue.submit({"name": "job"})
+        dead = queue.claim("dead")
+        assert queue.requeue_expired() == []
+
+        # Worker stopped sending heartbeats
+        running = queue.job_file("running", job_id, dead["claim"])
+        old = queue.now() - 60
+        os.utime(running, (old, old))
+        assert queue.requeue_expired() == [job_id]
+        assert not queue.heartbeat(job_id, dead["claim"])
+        alive = queue.claim("alive")
+        assert alive["attempts"] == 2
+        assert not queue.complete(job_id, dead["claim"], RETCODES["OK"])
+
+        # File of the expired claim is gone, not the one of the new claim
+        assert not os.path.exists(running)
+
+        # Given up after max_attempts
+        running = queue.job_file("running", job_id, alive["claim"])
+        os.utime(running, (old, old))
+        assert queue.requeue_expired() == []
+        assert queue.read("done", job_id)["r_code"] == RETCODES["OSError"]
+        assert queue.status()["running"] == 0
+
+    def test_claim_requeue(self, tmp_path, monkeypatch):
+        queue = JobQueue(str(tmp_path / "queue"), lease=0.5)
+        job_id = queue.submit({"name": "job"})
+        claiming = threading.current_thread()
+        read_json = jobqueue.read_json
+
+        # Claim slower than the lease, while another worker takes back expired jobs
+        def slow_read_json(path):
+            if threading.current_thread() is claiming:
+                time.sleep(1)
+            return read_json(path)
+
+        monkeypatch.setattr(jobqueue, "read_json", slow_read_json)
+        taken_back = []
+        done = threading.Event()
+
+        def requeue():
+            while not done.is_set():
+                taken_back.extend(queue.requeue_expired())
+
+        requeuer = threading.Thread(target=requeue)
+        requeuer.start()
+        try:
+            job = queue.claim("w")
+        finally:
+            done.set()
+            requeuer.join()
+
+        # Job claimed once, never both pending and running
+        assert job["id"] == job_id
+        assert taken_back == []
+        assert queue.job_ids("pending") == []
+        assert queue.job_files("running") == [(job_id, queue.job_file("running", job_id, job["claim"]))]
+
+    def test_pool_lock(self, tmp_path, monkeypatch):
+        worker = Worker(JobQueue(str(tmp_path / "queue")), kinstall=str(tmp_path))
+        locked = []
+
+        # KNIME set up (e.g. installed) without blocking heartbeats
+        def init_knime(knime, rp2_version, logger):
+            locked.append(worker._lock.acquire(timeout=1))
+            worker._lock.release()
+            return knime
+
+        monkeypatch.setattr(jobqueue, "init_knime", init_knime)
+        args = build_queue_args_parser().parse_args(["submit", "sink.csv", "rules.csv", "out", "--queue_dir", str(tmp_path / "queue")])
+        pool = worker.pool(args)
+        assert locked == [True]
+        assert worker.pool(args) is pool
+        pool.shutdown()
+
+    def test_workers(self, fake_knime, lycopene_sink_csv, rulesd12_csv, tmp_path):
+        sources = tmp_path / "sources.csv"
+        sources.write_text("Name,InChI\n" + "".join(
+            '"%s","%s"\n' % (name, inchi)
+            for name, inchi in [("lyco1", LYCOPENE), ("lyco2", LYCOPENE), ("lyco3", LYCOPENE), ("atp", ATP)]
+        ))
+        args = build_queue_args_parser().parse_args([
+            "submit", lycopene_sink_csv, rulesd12_csv, str(tmp_path / "out"),
+            "--source_file", str(sources),
+            "--queue_dir", str(tmp_path / "queue"),
+            "--sink_index_dir", str(tmp_path / "index"),
+            "--rp2_version", "r20220104",
+        ])
+        queue = JobQueue(args.queue_dir, lease=args.lease, max_attempts=args.max_attempts)
+        r_code, jobs = queue_sources(queue, args, "Aromatized (no Hs added)")
+        assert r_code == RETCODES["OK"]
+        # Source in sink, not queued
+        assert queue.status()["pending"] == 3
+        assert queue.status()["r_codes"] == {"SrcInSink": 1}
+
+        # Two nodes sharing the queue folder
+        workers = [
+            Worker(JobQueue(args.queue_dir), kinstall=fake_knime, jobs=2, name=f"node{i}")
+            for i in range(2)
+        ]
+        counts = [0, 0]
+
+        def run(i):
+            counts[i] = workers[i].run(exit_when_empty=True, poll=0.1)
+
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert sum(counts) == 3
+        status = queue.status()
+        assert status["pending"] == status["running"] == 0
+        assert status["r_codes"] == {"OK": 3, "SrcInSink": 1}
+        for name in ["lyco1", "lyco2", "lyco3"]:
+            assert os.path.exists(os.path.join(str(tmp_path / "out"), name, "results.csv"))
+
+    def test_taken_back(self, fake_knime, lycopene_sink_csv, rulesd12_csv, tmp_path, monkeypatch):
+        # KNIME writing recorded results iteration by iteration, 1s apart
+        monkeypatch.setenv("RP2_FAKE_KNIME_DELAY", "1")
+        sources = tmp_path / "sources.csv"
+        sources.write_text('Name,InChI\n"lyco","%s"\n' % LYCOPENE)
+        args = build_queue_args_parser().parse_args([
+            "submit", lycopene_sink_csv, rulesd12_csv, str(tmp_path / "out"),
+            "--source_file", str(sources),
+            "--queue_dir", str(tmp_path / "queue"),
+            "--sink_index_dir", str(tmp_path / "index"),
+            "--rp2_version", "r20220104",
+        ])
+        queue = JobQueue(args.queue_dir)
+        queue_sources(queue, args, "Aromatized (no Hs added)")
+        worker = Worker(queue, kinstall=fake_knime)
+        job = queue.claim(worker.name)
+
+        # Job not held by the worker any more, KNIME is stopped at once
+        start = time.monotonic()
+        assert worker.execute(job) == RETCODES["OSError"]
+        assert time.monotonic() - start < 2
+        assert not os.path.exists(os.path.join(job["outdir"], "run_report.json"))
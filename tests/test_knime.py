@@ -1,12 +1,17 @@
+import asyncio
 import os
 import pathlib
 import shutil
+import signal
 import subprocess
+import sys
 import tempfile
+import time
 
 import pytest
-from retropath2_wrapper.Args import RETCODES
-from retropath2_wrapper.knime import Knime
+from retropath2_wrapper.Args import RETCODES, build_batch_args_parser
+from retropath2_wrapper.knime import Knime, KnimePool
+from retropath2_wrapper.preference import Preference
 
 
 FUNCTIONAL = "RP2_FUNCTIONAL" not in os.environ
@@ -39,6 +44,25 @@ class TestKnime:
         spath = Knime.standardize_path(path=path)
         assert "\\" not in spath
 
+    @pytest.mark.skipif(sys.platform == "win32", reason="Shell script as executable")
+    def test_find_executable_manifest(self, tmp_path):
+        bindir = tmp_path / "knime_4.6.4"
+        (bindir / "p2").mkdir(parents=True)
+        kexec = bindir / "knime"
+        kexec.write_text('#!/bin/sh\nexit 0\n')
+        kexec.chmod(0o755)
+        assert Knime.find_executable(path=str(tmp_path)) == str(kexec)
+        assert Knime.find_p2_dir(path=str(tmp_path)) == str(bindir / "p2")
+        manifest = Knime.read_manifest(path=str(tmp_path))
+        assert manifest == {"kexec": str(kexec), "p2_dir": str(bindir / "p2")}
+        # Stale manifest
+        kexec.unlink()
+        other = tmp_path / "knime"
+        other.write_text('#!/bin/sh\nexit 0\n')
+        other.chmod(0o755)
+        assert Knime.find_executable(path=str(tmp_path)) == str(other)
+        assert Knime.read_manifest(path=str(tmp_path))["kexec"] == str(other)
+
     @pytest.mark.skipif(FUNCTIONAL, reason="Functional test")
     def test_install_knime_from_zenodo(self):
         tempdir = tempfile.mkdtemp()
@@ -47,3 +71,190 @@ class TestKnime:
         kexec = TestKnime.filter_exec(path=tempdir)
         assert kexec is not None
         shutil.rmtree(tempdir, ignore_errors=True)
+
+    @pytest.mark.skipif(sys.platform == "win32", reason="Shell script as executable")
+    def test_pool(self, tmp_path):
+        kexec = tmp_path / "knime"
+        kexec.write_text('#!/bin/sh\nexit 0\n')
+        kexec.chmod(0o755)
+        files = dict(
+            sink="sink.csv", source="source.csv", rules="rules.csv",
+            outdir=str(tmp_path), results="results.csv", **{"src-in-sk": "source-in-sink.csv"},
+        )
+        params = dict(dmin=0, dmax=1000, max_steps=3, topx=100, mwmax_source=1000, std_hydrogen="implicit")
+        with KnimePool(kinstall=str(tmp_path), workflow="", size=2) as pool:
+            assert pool.kexec == str(kexec)
+            workdir = pool.workdir
+            futures = [pool.submit(files=files, params=params, preference=None) for _ in range(4)]
+            assert [x.result() for x in futures] == [RETCODES["OK"]] * 4
+            assert sorted(os.listdir(workdir)) == ["workspace_0", "workspace_1"]
+        assert os.path.exists(workdir) is False
+
+    @pytest.mark.skipif(sys.platform == "win32", reason="Shell script as executable")
+    def test_pool_share(self, tmp_path):
+        kexec = tmp_path / "knime"
+        # Log the workflow of each run
+        kexec.write_text('#!/bin/sh\nfor x in "$@"; do case "$x" in -workflowFile=*) echo "$x" >> "%s";; esac; done\nsleep 0.5\n' % (tmp_path / "runs.log",))
+        kexec.chmod(0o755)
+        files = dict(
+            sink="sink.csv", source="source.csv", rules="rules.csv",
+            outdir=str(tmp_path), results="results.csv", **{"src-in-sk": "source-in-sink.csv"},
+        )
+        params = dict(dmin=0, dmax=1000, max_steps=3, topx=100, mwmax_source=1000, std_hydrogen="implicit")
+        with KnimePool(kinstall=str(tmp_path), workflow="a.knwf", size=1) as pool:
+            shared = pool.share()
+            shared.workflow = "b.knwf"
+            start = time.time()
+            futures = [x.submit(files=files, params=params, preference=None) for x in [pool, shared]]
+            assert [x.result() for x in futures] == [RETCODES["OK"]] * 2
+            # One slot for both
+            assert time.time() - start >= 1
+            assert sorted(os.path.basename(x.split("=", 1)[1]) for x in (tmp_path / "runs.log").read_text().split()) == ["a.knwf", "b.knwf"]
+            shared.shutdown()
+            assert os.path.isdir(pool.workdir)
+            assert pool.submit(files=files, params=params, preference=None).result() == RETCODES["OK"]
+
+    def test_workflow_cache(self, tmp_path):
+        workflow = os.path.join(
+            os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            "retropath2_wrapper", "workflows", "RetroPath2.0_r20250728.knwf",
+        )
+        knime = Knime(kinstall=str(tmp_path / "kinstall"), workflow=workflow, workflow_cache=str(tmp_path / "cache"))
+        extracted = Knime.extract_workflow(workflow=workflow, path=knime.workflow_cache)
+        assert os.path.isfile(os.path.join(extracted, "workflow.knime"))
+        assert Knime.extract_workflow(workflow=workflow, path=knime.workflow_cache) == extracted
+        clones = [knime.clone_workflow() for _ in range(2)]
+        assert clones[0] != clones[1]
+        for clone in clones:
+            assert os.path.isfile(os.path.join(clone, "workflow.knime"))
+            assert sorted(os.listdir(clone)) == sorted(os.listdir(extracted))
+
+    def test_jvm_args(self, tmp_path):
+        rules = tmp_path / "rules.csv"
+        rules.write_text("header\n" + "rule\n" * 1000)
+        sink = tmp_path / "sink.csv"
+        sink.write_text("header\n" + "compound\n" * 1000)
+        files = dict(sink=str(sink), rules=str(rules), outdir=str(tmp_path))
+        params = dict(max_steps=3)
+
+        knime = Knime(kinstall=str(tmp_path))
+        assert knime.jvm_args(files=files, params=params) == []
+
+        knime = Knime(kinstall=str(tmp_path), jvm_heap="8g", jvm_gc="G1", jvm_gc_log=True)
+        args = knime.jvm_args(files=files, params=params)
+        assert args[:4] == ["--launcher.appendVmargs", "-vmargs", "-Xmx8g", "-XX:+UseG1GC"]
+        assert args[4].startswith("-Xlog:gc*:file=")
+
+        heap = Knime.auto_heap(files=files, params=params, jobs=1)
+        assert Knime.JVM_HEAP_MIN <= heap
+        assert Knime.auto_heap(files=files, params=params, jobs=1000) <= heap
+        knime = Knime(kinstall=str(tmp_path), jvm_heap="auto")
+        assert knime.jvm_args(files=files, params=params)[-1].startswith("-Xmx")
+
+        with pytest.raises(ValueError):
+            Knime(kinstall=str(tmp_path), jvm_heap="lots")
+        with pytest.raises(ValueError):
+            Knime(kinstall=str(tmp_path), jvm_gc="CMS")
+
+    def test_knime_args(self):
+        parser = build_batch_args_parser()
+        positional = ["sink.csv", "rules.csv", "out"]
+        args = parser.parse_args(positional + ["--jvm_heap", "8g", "--knime_threads", "auto"])
+        assert (args.jvm_heap, args.knime_threads) == ("8g", "auto")
+        for bad in [["--jvm_heap", "lots"], ["--knime_threads", "0"], ["--knime_threads", "many"]]:
+            with pytest.raises(SystemExit):
+                parser.parse_args(positional + bad)
+
+    def test_run_preference(self, tmp_path):
+        files = dict(outdir=str(tmp_path))
+        knime = Knime(kinstall=str(tmp_path), max_threads="2", table_cache="SMALL", temp_dir=str(tmp_path))
+        preference = knime.run_preference(Preference(rdkit_timeout_minutes=10))
+        assert preference.rdkit_timeout_minutes == 10
+        assert preference.max_threads == "2"
+        assert preference.temp_dir == str(tmp_path)
+        assert knime.jvm_args(files=files, params={}, preference=preference) == [
+            "--launcher.appendVmargs", "-vmargs", "-Dknime.table.cache=SMALL",
+        ]
+        # Preferences of the run take precedence
+        assert knime.run_preference(Preference(max_threads=8)).max_threads == 8
+
+        cpus = Knime.available_cpus()
+        with KnimePool(kinstall=str(tmp_path), size=2, max_threads="auto") as pool:
+            assert pool.options()["max_threads"] == "auto"
+            assert pool.run_preference(None).max_threads == max(1, cpus // 2)
+        with pytest.raises(ValueError):
+            Knime(kinstall=str(tmp_path), max_threads="many")
+
+    @pytest.mark.skipif(sys.platform == "win32", reason="Shell script as executable")
+    def test_timeout(self, tmp_path):
+        kexec = tmp_path / "knime"
+        files = dict(
+            sink="sink.csv", source="source.csv", rules="rules.csv",
+            outdir=str(tmp_path), results="results.csv", **{"src-in-sk": "source-in-sink.csv"},
+        )
+        params = dict(dmin=0, dmax=1000, max_steps=3, topx=100, mwmax_source=1000, std_hydrogen="implicit")
+
+        # Child process of KNIME stopped with it
+        kexec.write_text('#!/bin/sh\necho partial > "%s"\nsleep 60\n' % (tmp_path / "results.csv",))
+        kexec.chmod(0o755)
+        knime = Knime(kinstall=str(tmp_path))
+        start = time.time()
+        r_code = knime.call(files=files, params=params, preference=None, timeout=1 / 60)
+        assert r_code == RETCODES["TimeOut"]
+        assert time.time() - start < 30
+        assert (tmp_path / "results.csv").read_text() == "partial\n"
+
+        kexec.write_text('#!/bin/sh\nwhile :; do :; done\n')
+        r_code = knime.call(files=files, params=params, preference=None, cpu_timeout=1 / 60)
+        assert r_code == RETCODES["TimeOut"]
+
+    @pytest.mark.skipif(sys.platform == "win32", reason="POSIX signals")
+    def test_cpu_exceeded(self):
+        # SIGKILL of the hard limit only once the budget is used
+        assert Knime.cpu_exceeded(-signal.SIGXCPU, 1)
+        assert not Knime.cpu_exceeded(-signal.SIGKILL, 1, cpu_time=5, elapsed=5)
+        assert Knime.cpu_exceeded(-signal.SIGKILL, 1, cpu_time=60, elapsed=61)
+        assert not Knime.cpu_exceeded(-signal.SIGKILL, None, cpu_time=60)
+        assert not Knime.cpu_exceeded(-signal.SIGTERM, 1, cpu_time=60)
+        # Not measured, killed too early to have used the budget
+        assert not Knime.cpu_exceeded(-signal.SIGKILL, 1000, elapsed=1)
+
+    @pytest.mark.skipif(sys.platform == "win32", reason="Shell script as executable")
+    def test_acall(self, tmp_path):
+        kexec = tmp_path / "knime"
+        kexec.write_text('#!/bin/sh\nsleep 1\nexit 3\n')
+        kexec.chmod(0o755)
+        files = dict(
+            sink="sink.csv", source="source.csv", rules="rules.csv",
+            outdir=str(tmp_path), results="results.csv", **{"src-in-sk": "source-in-sink.csv"},
+        )
+        params = dict(dmin=0, dmax=1000, max_steps=3, topx=100, mwmax_source=1000, std_hydrogen="implicit")
+
+        async def run():
+            with KnimePool(kinstall=str(tmp_path), size=4) as pool:
+                return await asyncio.gather(*[
+                    pool.acall(files=files, params=params, preference=None) for _ in range(4)
+                ])
+
+        start = time.time()
+        assert asyncio.run(run()) == [3] * 4
+        assert time.time() - start < 3
+
+        knime = Knime(kinstall=str(tmp_path))
+        r_code = asyncio.run(knime.acall(files=files, params=params, preference=None, timeout=0.5 / 60))
+        assert r_code == RETCODES["TimeOut"]
+
+        # Waiting for a free slot, cancelled waits do not keep one
+        async def wait_slot():
+            with KnimePool(kinstall=str(tmp_path), size=1) as pool:
+                first = asyncio.ensure_future(pool.acall(files=files, params=params, preference=None))
+                waiting = asyncio.ensure_future(pool.acall(files=files, params=params, preference=None))
+                await asyncio.sleep(0.2)
+                waiting.cancel()
+                r_codes = [await first]
+                r_codes.append(await asyncio.wait_for(pool.acall(files=files, params=params, preference=None), 5))
+                return r_codes
+
+        start = time.time()
+        assert asyncio.run(wait_slot()) == [3, 3]
+        assert 2 <= time.time() - start < 4
@@ -0,0 +1,58 @@
+import csv
+import gzip
+import shutil
+
+import pytest
+
+from retropath2_wrapper.outputs import (
+    Compound,
+    iter_rows,
+    iter_transformations,
+    split_list,
+)
+
+
+class TestOutputs:
+    def test_split_list(self):
+        assert split_list("[RR-02-a-12-F, RR-02-b-12-F]") == ("RR-02-a-12-F", "RR-02-b-12-F")
+        assert split_list("[None]") == ()
+        assert split_list("[]") == ()
+        assert split_list("1.1.1.1") == ("1.1.1.1",)
+
+    def test_iter_rows(self, lycopene_r20220104_results_csv):
+        rows = iter_rows(lycopene_r20220104_results_csv)
+        row = next(rows)
+        assert row.transformation_id == "TRS_0_0_0"
+        assert row.in_sink is True
+        assert row.sink_names == ("MNXM1",)
+        assert row.rule_ids == ("RR-02-d113c3f07e1e36fc-12-F",)
+        assert row.ec_numbers == ("1.3.99.30",)
+        assert (row.diameter, row.score, row.iteration) == (12, 0.0, 0)
+        assert row.starting_source_smiles == ""
+        assert 1 + sum(1 for _ in rows) == 2168
+
+    def test_gzip(self, tmp_path, lycopene_r20220104_target_csv):
+        path = str(tmp_path / "target_scope.csv.gz")
+        with open(lycopene_r20220104_target_csv, "rb") as fid, gzip.open(path, "wb") as fod:
+            shutil.copyfileobj(fid, fod)
+        rows = list(iter_rows(path))
+        assert rows == list(iter_rows(lycopene_r20220104_target_csv))
+        assert rows[0].starting_source_smiles != ""
+
+    def test_not_results(self, lycopene_sink_csv):
+        with pytest.raises(ValueError):
+            next(iter_rows(lycopene_sink_csv))
+
+    def test_iter_transformations(self, lycopene_r20220104_results_csv, lycopene_r20220104_target_csv):
+        with open(lycopene_r20220104_results_csv) as fid:
+            rows = list(csv.DictReader(fid))
+        transformations = list(iter_transformations(lycopene_r20220104_results_csv))
+        assert len(transformations) == len(set(x["Transformation ID"] for x in rows))
+        assert sum(len(x.products) for x in transformations) == len(rows)
+        first = transformations[0]
+        assert first.transformation_id == "TRS_0_0_0"
+        assert isinstance(first.substrate, Compound)
+        assert [x.iteration for x in transformations] == sorted(x.iteration for x in transformations)
+        # Transformations whose products are all in the sink
+        assert sum(all(c.in_sink for c in x.products) for x in transformations) == 3
+        assert len(list(iter_transformations(lycopene_r20220104_target_csv))) == 5
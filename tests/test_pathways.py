@@ -0,0 +1,85 @@
+import csv
+import filecmp
+
+from retropath2_wrapper.pathways import (
+    ScopeGraph,
+    iter_pathways,
+    top_pathways,
+    write_pathways,
+    write_scope,
+)
+
+
+HEADER = [
+    "Initial source", "Transformation ID", "Reaction SMILES", "Substrate SMILES", "Substrate InChI",
+    "Product SMILES", "Product InChI", "In Sink", "Sink name", "Diameter", "Rule ID", "EC number",
+    "Score", "Iteration",
+]
+
+
+def write_results(path, transformations):
+    """transformations: (id, substrate, [(product, in sink)], score, iteration)"""
+    with open(path, "w", newline="") as fod:
+        f_writer = csv.writer(fod, quoting=csv.QUOTE_ALL)
+        f_writer.writerow(HEADER)
+        for trs_id, substrate, products, score, iteration in transformations:
+            for product, in_sink in products:
+                f_writer.writerow([
+                    "[target]", trs_id, "", "", substrate, "", product, int(in_sink), "[None]",
+                    12, "[RR]", "[NOEC]", score, iteration,
+                ])
+    return str(path)
+
+
+class TestPathways:
+    def test_lycopene(self, lycopene_r20220104_results_csv, lycopene_r20220104_target_csv, tmp_path):
+        graph = ScopeGraph.from_file(lycopene_r20220104_results_csv)
+        assert len(graph.sources) == 1
+        pathways = sorted(iter_pathways(graph), key=lambda x: -x.score)
+        assert [x.transformations for x in pathways] == [
+            ("TRS_0_0_1", "TRS_0_1_9", "TRS_0_2_949"),
+            ("TRS_0_0_1", "TRS_0_1_9", "TRS_0_2_950"),
+            ("TRS_0_0_1", "TRS_0_1_9", "TRS_0_2_952"),
+        ]
+        assert all(x.steps == 3 for x in pathways)
+        # Scope holds the same pathways
+        scope = ScopeGraph.from_file(lycopene_r20220104_target_csv)
+        assert top_pathways(scope, 3) == pathways
+        assert top_pathways(graph, 1) == pathways[:1]
+        assert list(iter_pathways(graph, max_steps=2)) == []
+
+        path = write_pathways(pathways, str(tmp_path / "pathways.csv"))
+        with open(path) as fid:
+            rows = list(csv.DictReader(fid))
+        assert rows[0]["Transformation IDs"] == "TRS_0_0_1;TRS_0_1_9;TRS_0_2_949"
+
+    def test_write_scope(self, lycopene_r20220104_results_csv, lycopene_r20220104_target_csv, tmp_path):
+        # Same scope as the workflow
+        path = str(tmp_path / "target_scope.csv")
+        assert write_scope(lycopene_r20220104_results_csv, path) == 5
+        assert filecmp.cmp(path, lycopene_r20220104_target_csv, shallow=False)
+        assert ScopeGraph.from_file(lycopene_r20220104_results_csv).scope(2) == []
+
+    def test_branches(self, tmp_path):
+        # T -> A + B, A and B made from the sink in several ways, A <-> C cycle
+        path = write_results(tmp_path / "results.csv", [
+            ("TRS_0_0_0", "T", [("A", False), ("B", False), ("W", True)], 1.0, 0),
+            ("TRS_0_0_1", "T", [("D", False)], 0.5, 0),
+            ("TRS_0_1_0", "A", [("S1", True)], 2.0, 1),
+            ("TRS_0_1_1", "A", [("C", False)], 3.0, 1),
+            ("TRS_0_1_2", "B", [("S2", True)], 1.0, 1),
+            ("TRS_0_1_3", "B", [("S3", True), ("S1", True)], 0.0, 1),
+            ("TRS_0_1_4", "D", [("E", False)], 9.0, 1),
+            ("TRS_0_2_0", "C", [("A", False)], 1.0, 2),
+            ("TRS_0_2_1", "C", [("S3", True)], 0.5, 2),
+        ])
+        graph = ScopeGraph.from_file(path)
+        pathways = list(iter_pathways(graph))
+        # A in 2 ways (directly or through C), B in 2 ways, D never
+        assert len(pathways) == 4
+        assert len(set(x.transformations for x in pathways)) == 4
+        assert max(x.score for x in pathways) == 1.0 + 3.0 + 0.5 + 1.0
+        assert top_pathways(graph, 2) == sorted(
+            pathways, key=lambda x: (-x.score, len(x.transformations))
+        )[:2]
+        assert len(list(iter_pathways(graph, max_steps=2))) == 2
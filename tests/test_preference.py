@@ -31,3 +31,40 @@ class TestPreference:
         assert pref.is_init() is False
         pref = Preference(rdkit_timeout_minutes=10)
         assert pref.is_init() is True
+
+    def test_knobs(self, tmp_path):
+        pref = Preference(
+            path=str(tmp_path / "pref.epf"),
+            rdkit_timeout_minutes=10,
+            max_threads=4,
+            temp_dir="/scratch/knime",
+            table_cache="SMALL",
+            cells_in_memory=1000,
+        )
+        pref.to_file()
+        with open(pref.path) as fid:
+            lines = fid.read().splitlines()
+        assert "/instance/org.knime.workbench.core/knime.maxThreads=4" in lines
+        assert "/instance/org.knime.workbench.core/knime.tempDir=/scratch/knime" in lines
+        assert pref.vmargs() == ["-Dknime.table.cache=SMALL", "-Dorg.knime.container.cellsinmemory=1000"]
+        assert Preference(max_threads=4).is_init() is True
+        with pytest.raises(ValueError):
+            Preference(max_threads=0)
+        with pytest.raises(ValueError):
+            Preference(table_cache="MRU")
+
+    def test_for_jobs(self):
+        pref = Preference(max_threads="auto", table_cache="auto", rdkit_timeout_minutes=10)
+        job = pref.for_jobs(jobs=4, cpus=16, memory=32 * 1024 ** 3)
+        assert job.path == pref.path
+        assert job.rdkit_timeout_minutes == 10
+        assert job.max_threads == 4
+        assert job.table_cache == "LRU"
+        job = pref.for_jobs(jobs=16, cpus=8, memory=32 * 1024 ** 3)
+        assert job.max_threads == 1
+        assert job.table_cache == "SMALL"
+        # Left to KNIME if unknown
+        job = pref.for_jobs(jobs=4)
+        assert job.max_threads is None
+        assert job.vmargs() == []
+        assert Preference(max_threads=2).for_jobs(jobs=4, cpus=16).max_threads == 2
@@ -0,0 +1,81 @@
+import asyncio
+import sys
+
+import pytest
+from retropath2_wrapper.Args import RETCODES
+from retropath2_wrapper.RetroPath2 import retropath2
+from retropath2_wrapper.knime import Knime
+from retropath2_wrapper.progress import (
+    ProgressLogger,
+    ProgressParser,
+    stream_progress,
+)
+
+
+class TestProgress:
+    def test_parse(self):
+        events = []
+        parser = ProgressParser(events.append)
+        for line in [
+            "INFO  main BatchExecutor ===== Executing workflow =====",
+            "INFO  KNIME-Worker-4-Chunk Loop Start 0:780  LocalNodeExecutionJob  Chunk Loop Start 0:1081:780 Start execute",
+            "INFO  KNIME-Worker-4-Chunk Loop Start 0:780  LocalNodeExecutionJob  Chunk Loop Start 0:1081:780 End execute (0 secs)",
+            "INFO  KNIME-Worker-5 LocalNodeExecutionJob  Recursive Loop Start (2 ports) 0:1081:781 Start execute",
+            "DEBUG KNIME-Worker-5 Node  nothing to tell",
+            "ERROR KNIME-Worker-5 Node  Execute failed",
+            "INFO  main BatchExecutor Workflow execution done Finished in 3 secs",
+        ]:
+            parser.feed(line)
+        assert [x.kind for x in events] == ["start", "node_start", "node_end", "iteration", "error", "done"]
+        assert events[1].node == "Chunk Loop Start"
+        assert events[1].node_id == "0:1081:780"
+        assert events[3].node == "Recursive Loop Start (2 ports)"
+        assert events[3].iteration == 1
+        assert events[-1].nodes == 1
+
+    def test_callback_error(self):
+        def callback(event):
+            raise ValueError(event)
+        parser = ProgressParser(callback)
+        assert parser.feed("INFO  main BatchExecutor ===== Executing workflow =====").kind == "start"
+
+    def test_stream(self, fake_knime, lycopene_sink_csv, lycopene_source_csv, rulesd12_csv, tmp_path):
+        events = list(stream_progress(
+            retropath2,
+            sink_file=lycopene_sink_csv,
+            source_file=lycopene_source_csv,
+            rules_file=rulesd12_csv,
+            outdir=str(tmp_path / "out"),
+            std_hydrogen="implicit",
+            knime=Knime(kinstall=fake_knime),
+            rp2_version=None,
+            max_steps=2,
+        ))
+        assert [x.iteration for x in events if x.kind == "iteration"] == [1, 2]
+        assert events[0].kind == "start"
+        assert events[-2].kind == "done"
+        assert events[-1].kind == "exit"
+        assert events[-1].data[0] == RETCODES["OK"]
+        ProgressLogger()(events[0])
+
+    @pytest.mark.skipif(sys.platform == "win32", reason="Shell script as executable")
+    def test_acall(self, tmp_path):
+        kexec = tmp_path / "knime"
+        kexec.write_text(
+            '#!/bin/sh\n'
+            'echo "INFO  main BatchExecutor ===== Executing workflow ====="\n'
+            'echo "INFO  KNIME-Worker-1 LocalNodeExecutionJob  Recursive Loop Start (2 ports) 0:1081:781 Start execute"\n'
+            'echo "INFO  main BatchExecutor Workflow execution done"\n'
+        )
+        kexec.chmod(0o755)
+        files = dict(
+            sink="sink.csv", source="source.csv", rules="rules.csv",
+            outdir=str(tmp_path), results="results.csv", **{"src-in-sk": "source-in-sink.csv"},
+        )
+        params = dict(dmin=0, dmax=1000, max_steps=3, topx=100, mwmax_source=1000, std_hydrogen="implicit")
+        events = []
+        r_code = asyncio.run(Knime(kinstall=str(tmp_path)).acall(
+            files=files, params=params, preference=None, progress=events.append,
+        ))
+        assert r_code == RETCODES["OK"]
+        assert [x.kind for x in events] == ["start", "iteration", "done"]
@@ -0,0 +1,60 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from retropath2_wrapper.knime import Knime
+from retropath2_wrapper.report import REPORT_FILE, RunReport, count_rows
+
+
+class TestReport:
+    def test_count_rows(self, tmp_path, lycopene_sink_csv):
+        path = tmp_path / "x.csv"
+        path.write_text("a,b\n1,2\n3,4")
+        assert count_rows(str(path)) == 2
+        path.write_text("a,b\n1,2\n3,4\n")
+        assert count_rows(str(path)) == 2
+        path.write_text("")
+        assert count_rows(str(path)) == 0
+        with open(lycopene_sink_csv) as fid:
+            assert count_rows(lycopene_sink_csv) == len(fid.readlines()) - 1
+        # Counted once for each version of a file
+        path.write_text("header\n" + "compound\n" * 1000)
+        assert count_rows(str(path)) == 1000
+        assert count_rows(str(path)) == 1000
+        path.write_text("header\n" + "compound\n" * 2000)
+        assert count_rows(str(path)) == 2000
+
+    def test_write(self, tmp_path, lycopene_sink_csv):
+        report = RunReport()
+        with report.phase("check_input"):
+            pass
+        with report.phase("check_input"):
+            pass
+        report.add_input("sink", lycopene_sink_csv, rows=True)
+        (tmp_path / "results.csv").write_text("a,b\n1,2\n")
+        report.add_outputs(str(tmp_path), ["results.csv", "missing.csv"])
+        path = report.write(str(tmp_path), r_code=0)
+        assert path == os.path.join(str(tmp_path), REPORT_FILE)
+        with open(path) as fid:
+            data = json.load(fid)
+        assert data["r_code"] == 0
+        assert list(data["phases"]) == ["check_input"]
+        assert data["inputs"]["sink"]["rows"] == count_rows(lycopene_sink_csv)
+        assert data["outputs"] == {
+            "results.csv": {"path": str(tmp_path / "results.csv"), "size": 8, "rows": 1}
+        }
+
+    @pytest.mark.skipif(sys.platform == "win32", reason="os.wait4 not available")
+    def test_wait_usage(self):
+        proc = subprocess.Popen([sys.executable, "-c", "x = bytearray(50 * 1024 ** 2)"])
+        rusage = Knime.wait(proc, timeout=60)
+        assert proc.returncode == 0
+        assert rusage.ru_maxrss > 0
+        proc = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"])
+        with pytest.raises(subprocess.TimeoutExpired):
+            Knime.wait(proc, timeout=0.2)
+        Knime.terminate(proc, grace=1)
+        assert proc.returncode is not None
@@ -3,6 +3,7 @@ Created on Jul 15 2020
 
 @author: Joan Hérisson
 """
+import asyncio
 import filecmp
 import os
 import shutil
@@ -12,7 +13,11 @@ import tempfile
 import pytest
 from retropath2_wrapper.__main__ import create_logger
 from retropath2_wrapper.Args import RETCODES
-from retropath2_wrapper.RetroPath2 import retropath2
+from retropath2_wrapper.RetroPath2 import (
+    retropath2,
+    retropath2_async,
+)
+from retropath2_wrapper.knime import Knime
 
 
 FUNCTIONAL = "RP2_FUNCTIONAL" not in os.environ
@@ -65,6 +70,30 @@ class TestRetropath2:
             assert filecmp.cmp(result['outdir'] + "/" + result['results'], lycopene_r20220104_results_7325_csv)
         shutil.rmtree(tempdir, ignore_errors=True)
 
+    def test_retropath2_async(self, fake_knime, lycopene_sink_csv, lycopene_source_csv, rulesd12_csv, lycopene_r20220104_results_csv, tmp_path):
+        # KNIME writing recorded outputs
+        knime = Knime(kinstall=fake_knime)
+
+        async def run():
+            return await asyncio.gather(*[
+                retropath2_async(
+                    sink_file=lycopene_sink_csv,
+                    source_file=lycopene_source_csv,
+                    rules_file=rulesd12_csv,
+                    outdir=str(tmp_path / f"out_{i}"),
+                    std_hydrogen="implicit",
+                    knime=knime,
+                    rp2_version=None,
+                )
+                for i in range(3)
+            ])
+
+        for r_code, result in asyncio.run(run()):
+            assert r_code == RETCODES['OK']
+            assert filecmp.cmp(os.path.join(result['outdir'], result['results']), lycopene_r20220104_results_csv)
+            # Default bounds keep every rule, rules only uncompressed
+            assert os.path.basename(result['rules']) == 'rules_d12.csv'
+
     """
     # Set attributes
     maxDiff = None
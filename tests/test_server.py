@@ -0,0 +1,157 @@
+import json
+import os
+import threading
+import time
+from urllib.error import HTTPError
+from urllib.request import (
+    Request,
+    urlopen,
+)
+
+import pytest
+
+from retropath2_wrapper.Args import RETCODES
+from retropath2_wrapper.knime import Knime
+from retropath2_wrapper.server import (
+    RetroPath2Service,
+    parse_files,
+    parse_params,
+    serve,
+)
+
+
+LYCOPENE = "InChI=1S/C40H56/c1-33(2)19-13-23-37(7)27-17-31-39(9)29-15-25-35(5)21-11-12-22-36(6)26-16-30-40(10)32-18-28-38(8)24-14-20-34(3)4/h11-12,15-22,25-32H,13-14,23-24H2,1-10H3"
+ATP = "InChI=1S/C10H16N5O13P3/c11-8-5-9(13-2-12-8)15(3-14-5)10-7(17)6(16)4(26-10)1-25-30(21,22)28-31(23,24)27-29(18,19)20/h2-4,6-7,10,16-17H,1H2,(H,21,22)(H,23,24)(H2,11,12,13)(H2,18,19,20)"
+
+
+def request(url, data=None, method=None):
+    body = None if data is None else json.dumps(data).encode("utf-8")
+    if method is None:
+        method = "GET" if data is None else "POST"
+    try:
+        with urlopen(Request(url, data=body, method=method)) as f:
+            return f.status, f.read()
+    except HTTPError as e:
+        return e.code, e.read()
+
+
+class TestServer:
+    def test_parse(self):
+        files = parse_files(["other=b.csv"], "a.csv")
+        assert files == {"default": os.path.abspath("a.csv"), "other": os.path.abspath("b.csv")}
+        with pytest.raises(ValueError):
+            parse_files(["default=b.csv"], "a.csv")
+        with pytest.raises(ValueError):
+            parse_files(["b.csv"], "a.csv")
+        assert parse_params({"max_steps": 3, "topx": "50", "min_rule_score": 0}) == {
+            "max_steps": 3, "topx": 50, "min_rule_score": 0.0
+        }
+        assert parse_params({"rp2_version": "r20220104"}) == {"rp2_version": "r20220104"}
+        for params in [{"foo": 1}, {"max_steps": 2.5}, {"max_steps": True}, {"rp2_version": 1}, {"rp2_version": "../foo"}, []]:
+            with pytest.raises(ValueError):
+                parse_params(params)
+
+    def test_jobs(self, fake_knime, lycopene_sink_csv, rulesd12_csv, tmp_path):
+        service = RetroPath2Service(
+            sinks={"default": lycopene_sink_csv},
+            rules={"default": rulesd12_csv},
+            std_hydrogen={"default": "Aromatized (no Hs added)"},
+            outdir=str(tmp_path / "out"),
+            knime=Knime(kinstall=fake_knime),
+            jobs=1,
+            queue_size=1,
+            rp2_version="r20220104",
+            sink_index_dir=str(tmp_path / "index"),
+        )
+        with service:
+            server = serve(service, port=0)
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            url = "http://127.0.0.1:%d" % server.server_address[1]
+            try:
+                assert request(url + "/jobs", {"inchi": "foo"})[0] == 400
+                assert request(url + "/jobs", {"inchi": LYCOPENE, "sink": "other"})[0] == 400
+                assert request(url + "/jobs", {"inchi": LYCOPENE, "params": {"foo": 1}})[0] == 400
+                assert request(url + "/jobs", {"inchi": LYCOPENE, "name": 'a",\nb'})[0] == 400
+                assert request(url + "/jobs", {"inchi": LYCOPENE, "name": ["a"]})[0] == 400
+
+                code, body = request(url + "/jobs", {"inchi": ATP, "name": "atp"})
+                assert code == 202
+                assert json.loads(body)["r_code"] == RETCODES["SrcInSink"]
+
+                # One job running and one waiting at most
+                codes = []
+                jobs = []
+                for i in range(4):
+                    code, body = request(url + "/jobs", {"inchi": LYCOPENE, "params": {"max_steps": 3}})
+                    codes.append(code)
+                    if code == 202:
+                        jobs.append(json.loads(body)["id"])
+                assert 503 in codes
+                assert codes[0] == 202
+
+                job_id = jobs[0]
+                for _ in range(300):
+                    job = json.loads(request(url + f"/jobs/{job_id}")[1])
+                    if job["state"] == "done":
+                        break
+                    assert request(url + f"/jobs/{job_id}/results")[0] in [200, 409]
+                    time.sleep(0.1)
+                assert job["r_code"] == RETCODES["OK"]
+                assert job["params"] == {"max_steps": 3}
+
+                code, body = request(url + f"/jobs/{job_id}/results")
+                assert code == 200
+                with open(os.path.join(job["outdir"], "results.csv"), "rb") as f:
+                    assert body == f.read()
+                code, body = request(url + f"/jobs/{job_id}/scope?format=jsonl")
+                assert code == 200
+                rows = [json.loads(x) for x in body.splitlines()]
+                assert rows and all("transformation_id" in x for x in rows)
+                code, body = request(url + f"/jobs/{job_id}/report")
+                assert code == 200
+                assert json.loads(body)["params"]["max_steps"] == 3
+
+                assert request(url + "/jobs/foo")[0] == 404
+                assert len(json.loads(request(url + "/jobs")[1])) == 1 + len(jobs)
+                health = json.loads(request(url + "/health")[1])
+                assert sum(health[x] for x in ["queued", "running", "done"]) == 1 + len(jobs)
+                assert request(url + "/jobs", {"inchi": LYCOPENE, "name": "x" * 100000})[0] == 413
+
+                # Done job forgotten with its outputs
+                assert request(url + f"/jobs/{job_id}", method="DELETE")[0] == 200
+                assert not os.path.exists(job["outdir"])
+                assert request(url + f"/jobs/{job_id}")[0] == 404
+                assert request(url + f"/jobs/{job_id}", method="DELETE")[0] == 404
+                jobs.remove(job_id)
+            finally:
+                server.shutdown()
+                server.server_close()
+        # Queued jobs are run before the service stops
+        assert all(service.job(x)["state"] == "done" for x in jobs)
+
+    def test_retention(self, fake_knime, lycopene_sink_csv, rulesd12_csv, tmp_path, monkeypatch):
+        monkeypatch.setenv("RP2_FAKE_KNIME_DELAY", "0.2")
+        service = RetroPath2Service(
+            sinks={"default": lycopene_sink_csv},
+            rules={"default": rulesd12_csv},
+            std_hydrogen={"default": "Aromatized (no Hs added)"},
+            outdir=str(tmp_path / "out"),
+            knime=Knime(kinstall=fake_knime),
+            retention=2,
+            rp2_version="r20220104",
+        )
+        with service:
+            jobs = []
+            for i in range(3):
+                jobs.append(service.submit({"inchi": ATP, "name": f"atp{i}"}))
+                os.makedirs(jobs[-1]["outdir"])
+            # Oldest done jobs forgotten with their outputs
+            assert [x["id"] for x in service.all_jobs()] == [x["id"] for x in jobs[1:]]
+            assert not os.path.exists(jobs[0]["outdir"])
+            assert os.path.exists(jobs[1]["outdir"])
+            # Jobs not done are kept
+            queued = service.submit({"inchi": LYCOPENE, "params": {"max_steps": 3}})
+            with pytest.raises(ValueError):
+                service.delete(queued["id"])
+        assert [x["id"] for x in service.all_jobs()] == [jobs[2]["id"], queued["id"]]
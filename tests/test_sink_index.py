@@ -0,0 +1,80 @@
+import os
+
+import pytest
+from retropath2_wrapper.Args import RETCODES
+from retropath2_wrapper.RetroPath2 import check_input
+from retropath2_wrapper.sink_index import SinkIndex
+
+
+ATP = "InChI=1S/C10H16N5O13P3/c11-8-5-9(13-2-12-8)15(3-14-5)10-7(17)6(16)4(26-10)1-25-30(21,22)28-31(23,24)27-29(18,19)20/h2-4,6-7,10,16-17H,1H2,(H,21,22)(H,23,24)(H2,11,12,13)(H2,18,19,20)"
+
+
+class TestSinkIndex:
+    def test_lookup(self, lycopene_sink_csv, tmp_path):
+        with SinkIndex(lycopene_sink_csv, path=str(tmp_path)) as index:
+            assert index.lookup(ATP) == "MNXM3"
+            assert index.lookup(" %s " % (ATP,)) == "MNXM3"
+            assert index.lookup("InChI=1S/p+1") == "MNXM1"
+            assert index.lookup("InChI=1S/C40H56/foo") is None
+            assert "InChI" not in index
+            assert index.lookup_many([ATP, "foo"]) == {ATP: "MNXM3", "foo": None}
+            index_file = index.index_file
+        assert os.listdir(str(tmp_path)) == [os.path.basename(index_file)]
+        # Reuse
+        with SinkIndex(lycopene_sink_csv, path=str(tmp_path)) as index:
+            assert index.index_file == index_file
+            assert index.lookup(ATP) == "MNXM3"
+
+    def test_inchikey(self, tmp_path):
+        sink = tmp_path / "sink.csv"
+        sink.write_text('"Name","InChI","InChIKey"\n"MNXM3","%s","ZKHQWZAMYRWXGA-KQYNXXCUSA-N"\n' % (ATP,))
+        with SinkIndex(str(sink), path=str(tmp_path / "index")) as index:
+            assert index.lookup("ZKHQWZAMYRWXGA-KQYNXXCUSA-N") == "MNXM3"
+            assert index.lookup(ATP) == "MNXM3"
+            assert len(index) == 1
+
+    def test_collision(self, lycopene_sink_csv, tmp_path, monkeypatch):
+        # Every key in the same slot, told apart by the stored keys
+        monkeypatch.setattr(SinkIndex, "hash", classmethod(lambda cls, key: 42))
+        sink = tmp_path / "sink.csv"
+        sink.write_text('"Name","InChI"\n"MNXM3","%s"\n"MNXM1","InChI=1S/p+1"\n' % (ATP,))
+        with SinkIndex(str(sink), path=str(tmp_path / "index")) as index:
+            assert index.lookup(ATP) == "MNXM3"
+            assert index.lookup("InChI=1S/p+1") == "MNXM1"
+            assert index.lookup("InChI=1S/C40H56/foo") is None
+
+    def test_evict(self, tmp_path):
+        sink = tmp_path / "sink.csv"
+        sink.write_text('"Name","InChI"\n"MNXM1","InChI=1S/p+1"\n')
+        other = tmp_path / "other.csv"
+        other.write_text('"Name","InChI"\n"MNXM3","%s"\n' % (ATP,))
+        path = str(tmp_path / "index")
+        with SinkIndex(str(other), path=path) as index:
+            other_index = os.path.basename(index.index_file)
+        SinkIndex(str(sink), path=path).close()
+        assert len(os.listdir(path)) == 2
+
+        # New version of the sink file, previous index removed
+        sink.write_text('"Name","InChI"\n"MNXM1","InChI=1S/p+1"\n"MNXM3","%s"\n' % (ATP,))
+        with SinkIndex(str(sink), path=path) as index:
+            assert sorted(os.listdir(path)) == sorted([os.path.basename(index.index_file), other_index])
+            # Indexes not used for max_age
+            old = os.stat(index.index_file).st_mtime - 3600
+            for name in os.listdir(path):
+                os.utime(os.path.join(path, name), (old, old))
+        sink.write_text('"Name","InChI"\n"MNXM3","%s"\n' % (ATP,))
+        with SinkIndex(str(sink), path=path, max_age=60) as index:
+            assert os.listdir(path) == [os.path.basename(index.index_file)]
+
+    def test_malformed(self, tmp_path):
+        sink = tmp_path / "sink.csv"
+        sink.write_text('"Name","InChI"\n"MNXM3"\n')
+        with pytest.raises(ValueError):
+            SinkIndex(str(sink), path=str(tmp_path / "index"))
+
+    def test_check_input(self, lycopene_sink_csv, lycopene_source_csv, source_mnxm790_csv, tmp_path):
+        with SinkIndex(lycopene_sink_csv, path=str(tmp_path)) as index:
+            ret, inchi = check_input(source_file=source_mnxm790_csv, sink_file=lycopene_sink_csv, sink_index=index)
+            assert ret == RETCODES["SrcInSink"]
+            ret, inchi = check_input(source_file=lycopene_source_csv, sink_file=lycopene_sink_csv, sink_index=index)
+            assert ret == RETCODES["OK"]
@@ -0,0 +1,75 @@
+import os
+import time
+
+from retropath2_wrapper.RetroPath2 import format_files_for_knime, prepare_rules
+from retropath2_wrapper.staging import StagingCache
+
+
+class TestStaging:
+    def test_stage(self, rulesd12_csv, tmp_path):
+        staging = StagingCache(path=str(tmp_path / "staging"))
+        calls = []
+
+        def build(d):
+            calls.append(d)
+            return prepare_rules(rulesd12_csv, d)
+
+        paths = []
+        for i in range(2):
+            indir = tmp_path / f"run{i}"
+            indir.mkdir()
+            paths.append(staging.stage(rulesd12_csv, str(indir), variant={}, build=build))
+        assert len(calls) == 1
+        assert os.path.samefile(paths[0], paths[1])
+        assert paths[0].endswith(".csv")
+        # Different variant, different entry
+        indir = tmp_path / "run2"
+        indir.mkdir()
+        path = staging.stage(rulesd12_csv, str(indir), variant={"dmin": 12}, build=build)
+        assert len(calls) == 2
+        assert os.path.samefile(path, paths[0]) is False
+
+    def test_stage_nothing_to_do(self, sink_csv, tmp_path):
+        staging = StagingCache(path=str(tmp_path / "staging"))
+        path = staging.stage(sink_csv, str(tmp_path), variant={}, build=lambda d: prepare_rules(sink_csv, d))
+        assert path == sink_csv
+
+    def test_evict(self, tmp_path):
+        staging = StagingCache(path=str(tmp_path / "staging"), max_size=100, max_age=3600)
+        for name, age in [("a", 10), ("b", 20), ("c", 7200)]:
+            path = os.path.join(staging.path, name + ".csv")
+            with open(path, "w") as fod:
+                fod.write("x" * 40)
+            os.utime(path, (time.time() - age,) * 2)
+        # "c" is too old, then "b" is the least recently used
+        assert staging.evict(keep=os.path.join(staging.path, "a.csv")) == 1
+        assert sorted(os.listdir(staging.path)) == ["a.csv", "b.csv", "digests"]
+        staging.max_size = 50
+        assert staging.evict() == 1
+        assert sorted(os.listdir(staging.path)) == ["a.csv", "digests"]
+
+    def test_format_files_for_knime(self, lycopene_sink_csv, lycopene_source_csv, rulesd12_csv, tmp_path):
+        staging = StagingCache(path=str(tmp_path / "staging"))
+        files = format_files_for_knime(
+            lycopene_sink_csv, lycopene_source_csv, rulesd12_csv,
+            str(tmp_path), str(tmp_path),
+            dmin=0, dmax=1000, staging=staging,
+        )
+        assert os.path.dirname(files["rules"]) == str(tmp_path)
+        assert os.stat(files["rules"]).st_nlink == 2
+
+    def test_evict_digests(self, rulesd12_csv, tmp_path):
+        staging = StagingCache(path=str(tmp_path / "staging"), max_age=3600)
+        digest = staging.digest(rulesd12_csv)
+        old = tmp_path / "old.csv"
+        old.write_text("x")
+        staging.digest(str(old))
+        memos = sorted(os.listdir(os.path.join(staging.path, "digests")))
+        assert len(memos) == 2
+        for memo in memos:
+            path = os.path.join(staging.path, "digests", memo)
+            os.utime(path, (time.time() - 7200,) * 2)
+        # Used again, kept
+        assert staging.digest(rulesd12_csv) == digest
+        staging.evict()
+        assert len(os.listdir(os.path.join(staging.path, "digests"))) == 1
@@ -0,0 +1,131 @@
+import csv
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from retropath2_wrapper.Args import RETCODES
+from retropath2_wrapper.RetroPath2 import (
+    check_results,
+    retropath2,
+)
+from retropath2_wrapper.knime import Knime
+from retropath2_wrapper.report import REPORT_FILE
+from retropath2_wrapper.store import ResultStore, read_params
+
+
+def make_outdir(path, results, scope=None):
+    os.makedirs(path)
+    shutil.copyfile(results, os.path.join(path, "results.csv"))
+    if scope is not None:
+        shutil.copyfile(scope, os.path.join(path, "target_scope.csv"))
+    return str(path)
+
+
+class TestStore:
+    def test_ingest(self, tmp_path, lycopene_r20220104_results_csv, lycopene_r20220104_target_csv):
+        store = ResultStore(path=str(tmp_path / "db" / "results.sqlite"))
+        outdir = make_outdir(tmp_path / "run", lycopene_r20220104_results_csv, lycopene_r20220104_target_csv)
+        with open(lycopene_r20220104_results_csv) as fid:
+            rows = list(csv.DictReader(fid))
+
+        params = {"max_steps": 3, "topx": 100, "workflow": "RetroPath2.0_r20220104.knwf"}
+        assert store.ingest(outdir, params=params, r_code=0) == len(rows)
+        # Ingesting again replaces the run
+        assert store.ingest(outdir, params=params, r_code=0) == len(rows)
+        stats = store.stats()
+        assert stats["runs"] == 1
+        assert stats["products"] == len(rows)
+        assert stats["transformations"] == len(set(x["Transformation ID"] for x in rows))
+
+        runs = store.runs(max_steps=3)
+        assert [x["outdir"] for x in runs] == [outdir]
+        assert runs[0]["source_inchi"] == rows[0]["Substrate InChI"]
+        assert store.runs(max_steps=4) == []
+        with pytest.raises(ValueError):
+            store.runs(foo=1)
+
+        product = next(x for x in rows if x["In Sink"] == "1")
+        producers = store.producers(product["Product InChI"])
+        assert producers
+        assert all(x["outdir"] == outdir and x["in_sink"] == 1 for x in producers)
+        assert product["Transformation ID"] in [x["transformation_id"] for x in producers]
+        # Transformations of the scope are flagged
+        assert store.query(
+            "SELECT transformation_id FROM transformations WHERE in_scope = 1 ORDER BY transformation_id"
+        )[0] == {"transformation_id": "TRS_0_0_1"}
+
+        rules = store.top("rule_id", 3)
+        assert len(rules) == 3
+        assert rules[0]["transformations"] >= rules[-1]["transformations"]
+        assert rules[0]["runs"] == 1
+
+    def test_concurrent(self, tmp_path, lycopene_r20220104_results_csv):
+        store = ResultStore(path=str(tmp_path / "results.sqlite"))
+        outdirs = [
+            make_outdir(tmp_path / f"run{i}", lycopene_r20220104_results_csv) for i in range(4)
+        ]
+        with ThreadPoolExecutor(4) as executor:
+            counts = list(executor.map(store.ingest, outdirs))
+        assert len(set(counts)) == 1
+        assert store.stats()["products"] == 4 * counts[0]
+        assert store.top("rule_id", 1)[0]["runs"] == 4
+        # Compounds are shared between runs
+        with open(lycopene_r20220104_results_csv) as fid:
+            inchis = set()
+            for row in csv.DictReader(fid):
+                inchis.update([row["Substrate InChI"], row["Product InChI"]])
+        assert store.stats()["compounds"] == len(inchis)
+
+    def test_not_results(self, tmp_path, lycopene_sink_csv):
+        store = ResultStore(path=str(tmp_path / "results.sqlite"))
+        outdir = make_outdir(tmp_path / "run", lycopene_sink_csv)
+        assert store.ingest(outdir) is None
+        assert store.stats()["runs"] == 0
+
+    def test_retropath2(self, fake_knime, lycopene_sink_csv, lycopene_source_csv, rulesd12_csv, tmp_path):
+        outdir = str(tmp_path / "out")
+        store = ResultStore(path=str(tmp_path / "results.sqlite"))
+        r_code, result = retropath2(
+            sink_file=lycopene_sink_csv,
+            source_file=lycopene_source_csv,
+            rules_file=rulesd12_csv,
+            outdir=outdir,
+            std_hydrogen="implicit",
+            knime=Knime(kinstall=fake_knime),
+            rp2_version=None,
+            max_steps=3,
+            store=store,
+        )
+        assert r_code == RETCODES["OK"]
+        runs = store.runs()
+        assert len(runs) == 1
+        assert runs[0]["outdir"] == result["outdir"]
+        assert runs[0]["max_steps"] == 3
+        assert runs[0]["std_hydrogen"] == "implicit"
+        assert runs[0]["r_code"] == RETCODES["OK"]
+        assert store.stats()["products"] == 2168
+        # Parameters are in the report, for later ingestion
+        params, r_code = read_params(outdir)
+        assert params["max_steps"] == 3
+        assert r_code == RETCODES["OK"]
+        assert os.path.exists(os.path.join(outdir, REPORT_FILE))
+
+        # Stopped before any pathway, stored as checked
+        outdir = str(tmp_path / "out_stopped")
+        r_code, result = retropath2(
+            sink_file=lycopene_sink_csv,
+            source_file=lycopene_source_csv,
+            rules_file=rulesd12_csv,
+            outdir=outdir,
+            std_hydrogen="implicit",
+            knime=Knime(kinstall=fake_knime),
+            rp2_version=None,
+            max_steps=3,
+            stop_iterations=0,
+            store=store,
+        )
+        assert check_results(result) == RETCODES["NoSolution"]
+        assert [x["r_code"] for x in store.runs() if x["outdir"] == result["outdir"]] == [RETCODES["NoSolution"]]
+        assert read_params(outdir)[1] == RETCODES["NoSolution"]
@@ -0,0 +1,56 @@
+import csv
+import os
+
+import pytest
+
+from retropath2_wrapper.Args import RETCODES
+from retropath2_wrapper.knime import Knime
+from retropath2_wrapper.sweep import (
+    SWEEP_FILE,
+    expand_grid,
+    parse_grid,
+    retropath2_sweep,
+)
+
+
+class TestSweep:
+    def test_parse_grid(self):
+        grid = parse_grid(["topx=50,100", "min_rule_score=0.5", "rp2_version=r20220104"])
+        assert grid == {"topx": [50, 100], "min_rule_score": [0.5], "rp2_version": ["r20220104"]}
+        with pytest.raises(ValueError):
+            parse_grid(["sink_file=a,b"])
+        with pytest.raises(ValueError):
+            parse_grid(["topx=a"])
+        with pytest.raises(ValueError):
+            parse_grid(["topx="])
+        with pytest.raises(ValueError):
+            parse_grid(["rp2_version=r20220104,../../foo"])
+
+    def test_expand_grid(self):
+        points = expand_grid({"topx": [50, 100, 50], "dmax": [12]})
+        assert [x["name"] for x in points] == ["topx-50_dmax-12", "topx-100_dmax-12"]
+        assert points[1]["params"] == {"topx": 100, "dmax": 12}
+        assert expand_grid({}) == [{"name": "default", "params": {}}]
+
+    def test_retropath2_sweep(self, fake_knime, lycopene_sink_csv, lycopene_source_csv, rulesd12_csv, tmp_path):
+        outdir = str(tmp_path / "out")
+        r_code, points = retropath2_sweep(
+            sink_file=lycopene_sink_csv,
+            source_file=lycopene_source_csv,
+            rules_file=rulesd12_csv,
+            outdir=outdir,
+            grid={"dmax": [12, 16], "rp2_version": ["r20220104", "r20250728"], "max_steps": [2, 2]},
+            std_hydrogen="implicit",
+            knime=Knime(kinstall=fake_knime),
+            jobs=2,
+            sink_index_dir=str(tmp_path / "index"),
+        )
+        assert r_code == RETCODES["OK"]
+        assert len(points) == 4
+        with open(os.path.join(outdir, SWEEP_FILE)) as fid:
+            rows = list(csv.DictReader(fid))
+        assert [x["Name"] for x in rows] == [x["name"] for x in points]
+        assert set(x["Solutions"] for x in rows) == {"3"}
+        assert set(x["Results rows"] for x in rows) == {"2168"}
+        assert all(float(x["KNIME elapsed (s)"]) > 0 for x in rows)
+        assert all(os.path.isdir(x["outdir"]) for x in points)